@@ -141,6 +141,19 @@ def get_redis_client():
     return redis.from_url(redis_url)
 
 
+@st.cache_resource
+def get_live_redis_client():
+    """Redis holding the live counters (the API's cache Redis)."""
+    redis_url = os.environ.get(
+        "CACHE_REDIS_URL",
+        os.environ.get(
+            "RATE_LIMIT_REDIS_URL",
+            os.environ.get("CELERY_BROKER_URL", "redis://redis:6379/0"),
+        ),
+    )
+    return redis.from_url(redis_url)
+
+
 # =============================================================================
 # Data Fetching Functions
 # =============================================================================
@@ -161,13 +174,51 @@ def get_queue_lengths(r: redis.Redis) -> dict:
     return lengths
 
 
+def get_live_counts(r: redis.Redis, minutes: int = 60) -> pd.DataFrame:
+    """
+    Per-minute counts by channel, status and queue for the last ``minutes``.
+
+    Read from the ``live:<unix minute>`` hashes the API and workers keep in
+    Redis (one HGETALL per minute, pipelined), not from the log table.
+    """
+    current = int(datetime.now().timestamp() // 60)
+    window = range(current - minutes + 1, current + 1)
+    try:
+        pipe = r.pipeline(transaction=False)
+        for minute in window:
+            pipe.hgetall(f"live:{minute}")
+        hashes = pipe.execute()
+    except Exception:
+        return pd.DataFrame()
+
+    rows = []
+    for minute, counts in zip(window, hashes):
+        for field, count in counts.items():
+            channel, status, queue = field.decode().split(":", 2)
+            rows.append(
+                {
+                    "minute": datetime.fromtimestamp(minute * 60),
+                    "channel": channel,
+                    "status": status,
+                    "queue": queue,
+                    "count": int(count),
+                }
+            )
+    return pd.DataFrame(rows)
+
+
+# Aggregates below read the hourly rollups kept by the rollup_notification_stats
+# Celery task (every 5 minutes) instead of scanning notifications_notificationlog.
+ROLLUPS = "notifications_notificationhourlyrollup"
+
+
 def get_notification_stats(engine, hours: int = 24) -> pd.DataFrame:
     """Get notification counts by status and channel."""
     query = text(
-        """
-        SELECT status, channel, COUNT(*) as count
-        FROM notifications_notificationlog
-        WHERE created_at > NOW() - INTERVAL ':hours HOURS'
+        f"""
+        SELECT status, channel, SUM(count) as count
+        FROM {ROLLUPS}
+        WHERE hour >= DATE_TRUNC('hour', NOW() - INTERVAL ':hours HOURS')
         GROUP BY status, channel
         ORDER BY channel, status
     """.replace(":hours", str(hours))
@@ -184,14 +235,11 @@ def get_notification_stats(engine, hours: int = 24) -> pd.DataFrame:
 def get_hourly_trends(engine, hours: int = 24) -> pd.DataFrame:
     """Get hourly notification trends."""
     query = text(
-        """
-        SELECT 
-            DATE_TRUNC('hour', created_at) as hour,
-            status,
-            COUNT(*) as count
-        FROM notifications_notificationlog
-        WHERE created_at > NOW() - INTERVAL ':hours HOURS'
-        GROUP BY DATE_TRUNC('hour', created_at), status
+        f"""
+        SELECT hour, status, SUM(count) as count
+        FROM {ROLLUPS}
+        WHERE hour >= DATE_TRUNC('hour', NOW() - INTERVAL ':hours HOURS')
+        GROUP BY hour, status
         ORDER BY hour
     """.replace(":hours", str(hours))
     )
@@ -206,15 +254,15 @@ def get_hourly_trends(engine, hours: int = 24) -> pd.DataFrame:
 def get_retry_stats(engine, hours: int = 24) -> pd.DataFrame:
     """Get retry attempt statistics."""
     query = text(
-        """
+        f"""
         SELECT 
-            DATE_TRUNC('hour', created_at) as hour,
-            AVG(attempts) as avg_attempts,
-            MAX(attempts) as max_attempts,
-            COUNT(*) FILTER (WHERE status = 'retrying') as retrying_count
-        FROM notifications_notificationlog
-        WHERE created_at > NOW() - INTERVAL ':hours HOURS'
-        GROUP BY DATE_TRUNC('hour', created_at)
+            hour,
+            SUM(attempts_sum) * 1.0 / NULLIF(SUM(count), 0) as avg_attempts,
+            MAX(max_attempts) as max_attempts,
+            COALESCE(SUM(count) FILTER (WHERE status = 'retrying'), 0) as retrying_count
+        FROM {ROLLUPS}
+        WHERE hour >= DATE_TRUNC('hour', NOW() - INTERVAL ':hours HOURS')
+        GROUP BY hour
         ORDER BY hour
     """.replace(":hours", str(hours))
     )
@@ -229,17 +277,19 @@ def get_retry_stats(engine, hours: int = 24) -> pd.DataFrame:
 def get_failure_rates(engine, days: int = 7) -> pd.DataFrame:
     """Get failure rates by channel."""
     query = text(
-        """
+        f"""
         SELECT 
             channel,
-            COUNT(*) as total,
-            COUNT(*) FILTER (WHERE status = 'failed') as failed,
-            COUNT(*) FILTER (WHERE status = 'sent') as sent,
+            SUM(count) as total,
+            COALESCE(SUM(count) FILTER (WHERE status = 'failed'), 0) as failed,
+            COALESCE(SUM(count) FILTER (WHERE status = 'sent'), 0) as sent,
             ROUND(
-                COUNT(*) FILTER (WHERE status = 'failed') * 100.0 / NULLIF(COUNT(*), 0), 2
+                COALESCE(SUM(count) FILTER (WHERE status = 'failed'), 0) * 100.0
+                    / NULLIF(SUM(count), 0),
+                2
             ) as fail_rate
-        FROM notifications_notificationlog
-        WHERE created_at > NOW() - INTERVAL ':days DAYS'
+        FROM {ROLLUPS}
+        WHERE hour >= DATE_TRUNC('hour', NOW() - INTERVAL ':days DAYS')
         GROUP BY channel
         ORDER BY total DESC
     """.replace(":days", str(days))
@@ -255,15 +305,17 @@ def get_failure_rates(engine, days: int = 7) -> pd.DataFrame:
 def get_summary_metrics(engine) -> dict:
     """Get overall summary metrics."""
     query = text(
-        """
+        f"""
         SELECT 
-            COUNT(*) as total,
-            COUNT(*) FILTER (WHERE status = 'sent') as sent,
-            COUNT(*) FILTER (WHERE status = 'failed') as failed,
-            COUNT(*) FILTER (WHERE status = 'retrying') as retrying,
-            COUNT(*) FILTER (WHERE status = 'pending') as pending,
-            COUNT(*) FILTER (WHERE created_at > NOW() - INTERVAL '24 HOURS') as last_24h
-        FROM notifications_notificationlog
+            SUM(count) as total,
+            SUM(count) FILTER (WHERE status = 'sent') as sent,
+            SUM(count) FILTER (WHERE status = 'failed') as failed,
+            SUM(count) FILTER (WHERE status = 'retrying') as retrying,
+            SUM(count) FILTER (WHERE status = 'pending') as pending,
+            SUM(count) FILTER (
+                WHERE hour >= DATE_TRUNC('hour', NOW() - INTERVAL '24 HOURS')
+            ) as last_24h
+        FROM {ROLLUPS}
     """
     )
     try:
@@ -318,6 +370,68 @@ def get_recent_notifications(engine, limit: int = 10) -> pd.DataFrame:
 # =============================================================================
 
 
+@st.fragment(run_every=1)
+def live_activity():
+    """Last hour at one-minute resolution, redrawn every second from Redis."""
+    st.markdown(
+        '<div class="section-header">⚡ Live (Last 60 Minutes)</div>',
+        unsafe_allow_html=True,
+    )
+    live_df = get_live_counts(get_live_redis_client(), minutes=60)
+    if live_df.empty:
+        st.info("📭 No activity in the last hour")
+        return
+
+    per_minute = live_df.pivot_table(
+        index="minute", columns="status", values="count", aggfunc="sum"
+    ).fillna(0)
+    # The last five closed minutes; the current one is still filling
+    current = datetime.now().replace(second=0, microsecond=0)
+    recent = per_minute[
+        (per_minute.index >= current - timedelta(minutes=5)) & (per_minute.index < current)
+    ]
+    totals = recent.sum()
+    final = totals.get("sent", 0) + totals.get("failed", 0)
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric(label="📥 Queued / min", value=f"{totals.get('queued', 0) / 5:,.1f}")
+    with col2:
+        st.metric(label="✅ Sent / min", value=f"{totals.get('sent', 0) / 5:,.1f}")
+    with col3:
+        st.metric(label="🔄 Retries / min", value=f"{totals.get('retrying', 0) / 5:,.1f}")
+    with col4:
+        st.metric(
+            label="❌ Failure Rate (5 min)",
+            value=f"{totals.get('failed', 0) * 100 / final:.1f}%" if final else "–",
+        )
+
+    fig, ax = plt.subplots(figsize=(12, 3), facecolor="#1a1a1a")
+    ax.set_facecolor("#1a1a1a")
+    status_colors = {
+        "queued": "#00d4ff",
+        "sent": "#00ff88",
+        "failed": "#ff4757",
+        "retrying": "#ffd93d",
+    }
+    for status in per_minute.columns:
+        ax.plot(
+            per_minute.index,
+            per_minute[status],
+            label=status,
+            color=status_colors.get(status, "#888888"),
+            linewidth=2,
+        )
+    ax.set_ylabel("Per minute", color="#888888")
+    ax.tick_params(colors="#888888")
+    ax.legend(facecolor="#1a1a1a", labelcolor="#888888")
+    for spine in ax.spines.values():
+        spine.set_color("#333333")
+    plt.tight_layout()
+    st.pyplot(fig)
+    plt.close(fig)
+
+
 def main():
     # Header
     st.markdown(
@@ -342,9 +456,9 @@ def main():
         auto_refresh = st.checkbox("Auto-refresh (30s)", value=False)
         time_range = st.selectbox(
             "Time Range",
-            options=[6, 12, 24, 48, 72],
+            options=[6, 12, 24, 48, 72, 168, 720],
             index=2,
-            format_func=lambda x: f"Last {x} hours",
+            format_func=lambda x: f"Last {x} hours" if x < 168 else f"Last {x // 24} days",
         )
 
         st.markdown("---")
@@ -404,6 +518,8 @@ def main():
         total_queued = sum(queue_lengths.values())
         st.metric(label="📬 Queue Length", value=f"{total_queued:,}")
 
+    live_activity()
+
     # Queue Lengths
     st.markdown(
         '<div class="section-header">📬 Queue Status</div>', unsafe_allow_html=True
@@ -8,7 +8,7 @@ import time
 from threading import Thread
 
 import redis
-from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from prometheus_client import Gauge, Histogram, start_http_server
 from sqlalchemy import create_engine, text
 
 # =============================================================================
@@ -24,13 +24,13 @@ QUEUE_LENGTH = Gauge(
 
 NOTIFICATIONS_BY_STATUS = Gauge(
     "pulse_notifications_by_status",
-    "Current notification count by status",
+    "Notifications in the log by status (hourly rollups, pruned with retention)",
     ["status"],
 )
 
 NOTIFICATIONS_BY_CHANNEL = Gauge(
     "pulse_notifications_by_channel",
-    "Current notification count by channel",
+    "Notifications in the log by channel (hourly rollups, pruned with retention)",
     ["channel"],
 )
 
@@ -45,13 +45,18 @@ AVG_RETRY_ATTEMPTS = Gauge(
     "Average retry attempts for retrying notifications",
 )
 
-# Counters (cumulative)
-NOTIFICATIONS_TOTAL = Counter(
-    "pulse_notifications_total",
-    "Total notifications processed",
+LIVE_RATE = Gauge(
+    "pulse_live_notifications_per_minute",
+    "Notifications per minute by channel and status (last few minutes)",
     ["channel", "status"],
 )
 
+LIVE_FAILURE_RATE = Gauge(
+    "pulse_live_failure_rate",
+    "Failed share of final delivery outcomes by channel (last few minutes)",
+    ["channel"],
+)
+
 # Histograms
 DELIVERY_LATENCY = Histogram(
     "pulse_notification_delivery_latency_seconds",
@@ -66,13 +71,18 @@ DELIVERY_LATENCY = Histogram(
 
 
 def get_db_engine():
-    """Create SQLAlchemy engine for PostgreSQL."""
+    """
+    Create the SQLAlchemy engine for PostgreSQL.
+
+    The exporter runs one collection at a time, so a single pooled connection
+    (checked with a ping before reuse) serves every cycle.
+    """
     db_url = os.environ.get(
         "DATABASE_URL", "postgresql://postgres:postgres@db:5432/pulse"
     )
     if db_url.startswith("postgres://"):
         db_url = db_url.replace("postgres://", "postgresql://", 1)
-    return create_engine(db_url)
+    return create_engine(db_url, pool_size=1, max_overflow=0, pool_pre_ping=True)
 
 
 def get_redis_client():
@@ -81,6 +91,18 @@ def get_redis_client():
     return redis.from_url(redis_url)
 
 
+def get_live_redis_client():
+    """Redis holding the live counters (the API's cache Redis)."""
+    redis_url = os.environ.get(
+        "CACHE_REDIS_URL",
+        os.environ.get(
+            "RATE_LIMIT_REDIS_URL",
+            os.environ.get("CELERY_BROKER_URL", "redis://redis:6379/0"),
+        ),
+    )
+    return redis.from_url(redis_url)
+
+
 # =============================================================================
 # Metrics Collection Functions
 # =============================================================================
@@ -97,114 +119,177 @@ def collect_queue_metrics(r: redis.Redis):
             QUEUE_LENGTH.labels(queue_name=queue).set(0)
 
 
-def collect_notification_metrics(engine):
-    """Collect notification metrics from PostgreSQL."""
-    # Status counts
-    status_query = text(
-        """
-        SELECT status, COUNT(*) as count
-        FROM notifications_notificationlog
-        GROUP BY status
+# Every count and gauge in one grouped query over the hourly rollups, which
+# the rollup_notification_stats task keeps current and retention prunes with
+# the logs; the log table itself is never scanned.
+COUNTS_QUERY = text(
     """
-    )
+    SELECT
+        channel,
+        status,
+        SUM(count) AS count,
+        COALESCE(
+            SUM(count) FILTER (
+                WHERE hour >= DATE_TRUNC('hour', NOW() - INTERVAL '24 HOURS')
+            ),
+            0
+        ) AS last_24h,
+        SUM(attempts_sum) AS attempts
+    FROM notifications_notificationhourlyrollup
+    GROUP BY channel, status
+"""
+)
 
-    try:
-        with engine.connect() as conn:
-            result = conn.execute(status_query)
-            for row in result:
-                NOTIFICATIONS_BY_STATUS.labels(status=row[0]).set(row[1])
-    except Exception as e:
-        print(f"Error collecting status metrics: {e}")
-
-    # Channel counts
-    channel_query = text(
-        """
-        SELECT channel, COUNT(*) as count
-        FROM notifications_notificationlog
-        GROUP BY channel
+# Deliveries sent after the high-water mark (sent_at, id), oldest first. Rows
+# younger than LATENCY_LAG_SECONDS are left for the next cycle: sent_at is
+# stamped by the worker before its UPDATE commits, so a row can become
+# visible shortly after later ones.
+LATENCY_QUERY = text(
     """
-    )
+    SELECT id, channel, sent_at, EXTRACT(EPOCH FROM (sent_at - created_at))
+    FROM notifications_notificationlog
+    WHERE sent_at IS NOT NULL
+        AND (sent_at, id) > (:sent_at, CAST(:id AS uuid))
+        AND sent_at <= NOW() - make_interval(secs => :lag)
+    ORDER BY sent_at, id
+    LIMIT :limit
+"""
+)
 
-    try:
-        with engine.connect() as conn:
-            result = conn.execute(channel_query)
-            for row in result:
-                NOTIFICATIONS_BY_CHANNEL.labels(channel=row[0]).set(row[1])
-    except Exception as e:
-        print(f"Error collecting channel metrics: {e}")
-
-    # Failure rates by channel (last 24h)
-    failure_query = text(
-        """
-        SELECT 
-            channel,
-            ROUND(
-                COUNT(*) FILTER (WHERE status = 'failed') * 100.0 / NULLIF(COUNT(*), 0), 2
-            ) as fail_rate
-        FROM notifications_notificationlog
-        WHERE created_at > NOW() - INTERVAL '24 HOURS'
-        GROUP BY channel
+LATENCY_LAG_SECONDS = float(os.environ.get("METRICS_LATENCY_LAG", "30"))
+LATENCY_BATCH_SIZE = 5000
+NIL_UUID = "00000000-0000-0000-0000-000000000000"
+
+
+def collect_notification_metrics(conn):
+    """Set the status, channel, failure rate and retry gauges."""
+    by_status, by_channel = {}, {}
+    total_24h, failed_24h = {}, {}
+    retrying = retrying_attempts = 0
+    for channel, status, count, last_24h, attempts in conn.execute(COUNTS_QUERY):
+        by_status[status] = by_status.get(status, 0) + count
+        by_channel[channel] = by_channel.get(channel, 0) + count
+        total_24h[channel] = total_24h.get(channel, 0) + last_24h
+        if status == "failed":
+            failed_24h[channel] = last_24h
+        elif status == "retrying":
+            retrying += count
+            retrying_attempts += attempts
+
+    for status, count in by_status.items():
+        NOTIFICATIONS_BY_STATUS.labels(status=status).set(count)
+    for channel, count in by_channel.items():
+        NOTIFICATIONS_BY_CHANNEL.labels(channel=channel).set(count)
+    for channel, total in total_24h.items():
+        if total:
+            rate = round(failed_24h.get(channel, 0) * 100.0 / total, 2)
+            FAILURE_RATE.labels(channel=channel).set(rate)
+    AVG_RETRY_ATTEMPTS.set(retrying_attempts / retrying if retrying else 0)
+
+
+# Closed minutes the live gauges average over
+LIVE_WINDOW_MINUTES = int(os.environ.get("METRICS_LIVE_WINDOW", "5"))
+
+
+def read_live_counters(r: redis.Redis, minutes: int, now: float = None) -> list:
     """
-    )
+    Per-minute counters of the last ``minutes`` minutes, oldest first.
 
-    try:
-        with engine.connect() as conn:
-            result = conn.execute(failure_query)
-            for row in result:
-                if row[1] is not None:
-                    FAILURE_RATE.labels(channel=row[0]).set(float(row[1]))
-    except Exception as e:
-        print(f"Error collecting failure rate metrics: {e}")
-
-    # Average retry attempts
-    retry_query = text(
-        """
-        SELECT AVG(attempts) as avg_attempts
-        FROM notifications_notificationlog
-        WHERE status = 'retrying'
+    Returns ``[(minute start, {(channel, status, queue): count})]``, the
+    current, still filling minute last. The API and workers write them to
+    ``live:<unix minute>`` hashes (see ``notifications/live_counters.py``);
+    they are read in one round trip.
     """
-    )
-
-    try:
-        with engine.connect() as conn:
-            result = conn.execute(retry_query).fetchone()
-            if result and result[0]:
-                AVG_RETRY_ATTEMPTS.set(float(result[0]))
-    except Exception as e:
-        print(f"Error collecting retry metrics: {e}")
-
-    # Delivery latency for recently sent notifications
-    latency_query = text(
-        """
-        SELECT 
-            channel,
-            EXTRACT(EPOCH FROM (sent_at - created_at)) as latency
-        FROM notifications_notificationlog
-        WHERE status = 'sent' 
-            AND sent_at IS NOT NULL 
-            AND created_at > NOW() - INTERVAL '1 HOUR'
+    current = int((now if now is not None else time.time()) // 60)
+    window = range(current - minutes + 1, current + 1)
+    pipe = r.pipeline(transaction=False)
+    for minute in window:
+        pipe.hgetall(f"live:{minute}")
+    return [
+        (
+            minute * 60,
+            {tuple(field.decode().split(":", 2)): int(count) for field, count in counts.items()},
+        )
+        for minute, counts in zip(window, pipe.execute())
+    ]
+
+
+def collect_live_metrics(r: redis.Redis, now: float = None):
+    """Set the live per-minute rate and failure rate gauges."""
+    # The closed minutes only; the current one is still being counted
+    minutes = read_live_counters(r, LIVE_WINDOW_MINUTES + 1, now)[:-1]
+    totals = {}
+    for _, counts in minutes:
+        for (channel, status, _), count in counts.items():
+            totals[channel, status] = totals.get((channel, status), 0) + count
+
+    LIVE_RATE.clear()
+    LIVE_FAILURE_RATE.clear()
+    for (channel, status), count in totals.items():
+        LIVE_RATE.labels(channel=channel, status=status).set(count / LIVE_WINDOW_MINUTES)
+    for channel in {channel for channel, _ in totals}:
+        failed = totals.get((channel, "failed"), 0)
+        final = failed + totals.get((channel, "sent"), 0)
+        if final:
+            LIVE_FAILURE_RATE.labels(channel=channel).set(round(failed * 100.0 / final, 2))
+
+
+def initial_latency_mark(conn):
+    """Start observing deliveries from now on (history is not replayed)."""
+    now = conn.execute(
+        text("SELECT NOW() - make_interval(secs => :lag)"), {"lag": LATENCY_LAG_SECONDS}
+    ).scalar()
+    return now, NIL_UUID
+
+
+def collect_delivery_latency(conn, mark):
     """
-    )
-
-    try:
-        with engine.connect() as conn:
-            result = conn.execute(latency_query)
-            for row in result:
-                if row[1] is not None:
-                    DELIVERY_LATENCY.labels(channel=row[0]).observe(float(row[1]))
-    except Exception as e:
-        print(f"Error collecting latency metrics: {e}")
+    Observe each delivery sent after ``mark`` exactly once.
 
-
-def collect_metrics_loop(engine, r: redis.Redis, interval: int = 15):
+    Returns the new high-water mark. Only rows past the mark are read (via
+    the ``sent_at`` index), so the cost follows the delivery rate, not the
+    table size.
+    """
+    while True:
+        rows = conn.execute(
+            LATENCY_QUERY,
+            {
+                "sent_at": mark[0],
+                "id": mark[1],
+                "lag": LATENCY_LAG_SECONDS,
+                "limit": LATENCY_BATCH_SIZE,
+            },
+        ).fetchall()
+        for _, channel, _, latency in rows:
+            if latency is not None:
+                DELIVERY_LATENCY.labels(channel=channel).observe(float(latency))
+        if rows:
+            mark = (rows[-1][2], str(rows[-1][0]))
+        if len(rows) < LATENCY_BATCH_SIZE:
+            return mark
+
+
+def collect_metrics_loop(engine, r: redis.Redis, live: redis.Redis, interval: int = 15):
     """Main loop to collect all metrics."""
     print(f"Starting metrics collection loop (interval: {interval}s)")
+    mark = None
     while True:
         try:
             collect_queue_metrics(r)
-            collect_notification_metrics(engine)
         except Exception as e:
-            print(f"Error in metrics collection: {e}")
+            print(f"Error collecting queue metrics: {e}")
+        try:
+            collect_live_metrics(live)
+        except Exception as e:
+            print(f"Error collecting live metrics: {e}")
+        try:
+            with engine.connect() as conn:
+                collect_notification_metrics(conn)
+                if mark is None:
+                    mark = initial_latency_mark(conn)
+                mark = collect_delivery_latency(conn, mark)
+        except Exception as e:
+            print(f"Error collecting notification metrics: {e}")
         time.sleep(interval)
 
 
@@ -226,9 +311,10 @@ def main():
     # Initialize connections
     engine = get_db_engine()
     r = get_redis_client()
+    live = get_live_redis_client()
 
     # Start metrics collection in main thread
-    collect_metrics_loop(engine, r, interval=15)
+    collect_metrics_loop(engine, r, live, interval=15)
 
 
 if __name__ == "__main__":
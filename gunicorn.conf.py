@@ -0,0 +1,26 @@
+"""
+Gunicorn settings for serving the API with several worker processes:
+
+    PROMETHEUS_MULTIPROC_DIR=/tmp/prometheus gunicorn pulse.wsgi -c gunicorn.conf.py
+
+Each worker writes its Prometheus samples to PROMETHEUS_MULTIPROC_DIR and
+/metrics adds them up (see notifications/metrics.py).
+"""
+
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("GUNICORN_WORKERS", "4"))
+
+
+def on_starting(server):
+    from notifications.metrics import clear_multiprocess_dir
+
+    clear_multiprocess_dir()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(worker.pid)
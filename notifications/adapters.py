@@ -8,38 +8,69 @@ logger = logging.getLogger(__name__)
 
 class BaseChannelAdapter(ABC):
     @abstractmethod
+    def signature(self, log_id, payload):
+        """Build the Celery signature that delivers this notification."""
+        raise NotImplementedError
+
     def send(self, log_id, payload):
         """Send the notification. Update log on success/fail."""
-        raise NotImplementedError
+        self.signature(log_id, payload).apply_async()
 
 
 class EmailAdapter(BaseChannelAdapter):
-    def send(self, log_id, payload):
+    def signature(self, log_id, payload):
         queue = payload.get("queue") or "low_priority"
-        send_email_task.apply_async(
+        # Task handles the rest (from Day 2)
+        return send_email_task.signature(
             args=[log_id, payload["to"], payload["subject"], payload["body"]],
             queue=queue,
         )
-        # Task handles the rest (from Day 2)
 
 
 class SMSAdapter(BaseChannelAdapter):
-    def send(self, log_id, payload):
+    def signature(self, log_id, payload):
         from .tasks import send_sms_task
 
         queue = payload.get("queue") or "low_priority"
         # Queue task - task will handle Twilio API call and retries
-        send_sms_task.apply_async(
+        return send_sms_task.signature(
             args=[log_id, payload["to"], payload["body"]],
             queue=queue,
         )
 
 
 class PushAdapter(BaseChannelAdapter):
-    def send(self, log_id, payload):
+    def signature(self, log_id, payload):
         queue = payload.get("queue") or "low_priority"
         # For now, dummy Firebase — replace with real later
-        send_push_task.apply_async(
+        return send_push_task.signature(
             args=[log_id, payload["device_token"], payload["title"], payload["body"]],
             queue=queue,
         )
+
+
+ADAPTERS = {
+    "email": EmailAdapter(),
+    "sms": SMSAdapter(),
+    "push": PushAdapter(),
+}
+
+
+def queue_for_template(template) -> str:
+    """Basic priority routing: treat OTP-like templates as high priority."""
+    template_name = (template.name or "").lower()
+    if "otp" in template_name:
+        return "high_priority"
+    return "low_priority"
+
+
+def build_payload(data: dict, template, channel: str, rendered_body: str) -> dict:
+    """Build the adapter payload for a validated send request."""
+    return {
+        "to": data["to"],
+        "subject": data.get("subject", template.subject),
+        "body": rendered_body,
+        "device_token": data.get("device_token") if channel == "push" else None,
+        "title": data.get("title", template.subject) if channel == "push" else None,
+        "queue": queue_for_template(template),
+    }
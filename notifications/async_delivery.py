@@ -0,0 +1,480 @@
+"""
+Asyncio delivery worker.
+
+Runs many deliveries concurrently in one process by consuming the Celery
+queues directly from Redis and awaiting provider I/O instead of blocking a
+prefork process per send. Status handling is the one in ``delivery`` (same
+skip rules, single-UPDATE transitions and backoff), run on a thread pool
+because the ORM is synchronous.
+
+Messages that are not due yet (countdown retries carry an ETA) are not held
+in memory: they are parked in the ``ASYNC_WORKER_DELAYED_KEY`` sorted set,
+scored by their ETA, and every worker moves due ones back onto their queue
+once a second. A slot is therefore only ever taken by a send that can run.
+
+Each message is moved atomically from its queue onto the worker's own
+processing list (``ASYNC_WORKER_PROCESSING_KEY:<name>``) and removed from it
+once its outcome is recorded or it is parked. On SIGTERM/SIGINT the worker
+stops fetching and drains in-flight sends; a killed worker leaves its
+messages on the list, and the next worker started under the same name puts
+them back onto their queues. Delivery is therefore at least once: a message
+whose send completed just before the kill runs again, and is skipped if its
+log was already marked sent.
+"""
+
+import asyncio
+import base64
+import json
+import logging
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from celery import current_app
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import delivery
+from .metrics import PUBLISHED_AT_HEADER, TASK_QUEUE_WAIT
+from .providers import PROVIDERS
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover - optional dependency
+    aiohttp = None
+
+try:
+    import aiosmtplib
+except ImportError:  # pragma: no cover - optional dependency
+    aiosmtplib = None
+
+logger = logging.getLogger("notifications.tasks.async_delivery")
+
+SMTP_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+
+# Seconds between moves of due parked messages back onto their queues
+PROMOTE_INTERVAL = 1.0
+PROMOTE_BATCH_SIZE = 500
+
+# Seconds to block on the first queue when every queue is empty. BLMOVE takes
+# a single source list, so lower priority queues are polled this often while
+# idle.
+FETCH_WAIT = 0.25
+
+# Moves the oldest message of the first non-empty queue onto the processing
+# list and returns it, checking queues in priority order.
+#
+# KEYS[1]  processing list, KEYS[2..] queues, highest priority first
+FETCH_SCRIPT = """
+for i = 2, #KEYS do
+    local raw = redis.call('LMOVE', KEYS[i], KEYS[1], 'RIGHT', 'LEFT')
+    if raw then
+        return raw
+    end
+end
+return false
+"""
+
+# Puts every message left on a processing list back at the consuming end of
+# the queue it was taken from, oldest message first in line.
+#
+# KEYS[1]  processing list
+REQUEUE_SCRIPT = """
+local count = 0
+while true do
+    local raw = redis.call('LPOP', KEYS[1])
+    if not raw then
+        return count
+    end
+    local message = cjson.decode(raw)
+    redis.call('RPUSH', message['properties']['delivery_info']['routing_key'], raw)
+    count = count + 1
+end
+"""
+
+# Moves up to ARGV[2] messages due at ARGV[1] from the delayed set back onto
+# the queue they were taken from, atomically, so concurrent workers never
+# push the same message twice.
+#
+# KEYS[1]  delayed set
+# ARGV[1]  now, ARGV[2] batch size
+PROMOTE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, raw in ipairs(due) do
+    local message = cjson.decode(raw)
+    redis.call('LPUSH', message['properties']['delivery_info']['routing_key'], raw)
+    redis.call('ZREM', KEYS[1], raw)
+end
+return #due
+"""
+
+
+def _email_args(log_id, to, subject, body):
+    return log_id, to, body, {"subject": subject}
+
+
+def _sms_args(log_id, to, body):
+    return log_id, to, body, {}
+
+
+def _push_args(log_id, device_token, title, body):
+    return log_id, device_token, body, {"title": title}
+
+
+# Celery task name -> (channel, task args -> (log_id, to, body, extra))
+DELIVERY_TASKS = {
+    "notifications.tasks.send_email_task": ("email", _email_args),
+    "notifications.tasks.send_sms_task": ("sms", _sms_args),
+    "notifications.tasks.send_push_task": ("push", _push_args),
+}
+
+
+def decode_message(raw: bytes) -> dict:
+    """Decode a kombu Redis message into task name, args, kwargs and options."""
+    envelope = json.loads(raw)
+    body = envelope["body"]
+    if envelope["properties"].get("body_encoding") == "base64":
+        body = base64.b64decode(body)
+    args, kwargs, _embed = json.loads(body)
+    headers = envelope["headers"]
+    return {
+        "task": headers["task"],
+        "id": headers["id"],
+        "args": args,
+        "kwargs": kwargs,
+        "eta": parse_datetime(headers["eta"]) if headers.get("eta") else None,
+        "queue": envelope["properties"]["delivery_info"]["routing_key"],
+        "published_at": headers.get(PUBLISHED_AT_HEADER),
+    }
+
+
+class AsyncEmailSender:
+    """A small pool of persistent aiosmtplib connections."""
+
+    def __init__(self, size: int) -> None:
+        self._idle = asyncio.LifoQueue()
+        self._slots = asyncio.Semaphore(size)
+
+    async def send(self, to, body, subject="", **extra):
+        from email.message import EmailMessage
+
+        message = EmailMessage()
+        message["From"] = getattr(settings, "DEFAULT_FROM_EMAIL", "pulse@example.com")
+        message["To"] = to
+        message["Subject"] = subject
+        message.set_content(body)
+
+        async with self._slots:
+            client = None if self._idle.empty() else self._idle.get_nowait()
+            if client is None or not client.is_connected:
+                client = await self._connect()
+            try:
+                try:
+                    await client.send_message(message)
+                except aiosmtplib.SMTPServerDisconnected:
+                    # Dropped while idle: reconnect once
+                    client = await self._connect()
+                    await client.send_message(message)
+            except Exception:
+                client.close()
+                raise
+            self._idle.put_nowait(client)
+        return {}
+
+    async def _connect(self):
+        client = aiosmtplib.SMTP(
+            hostname=settings.EMAIL_HOST,
+            port=settings.EMAIL_PORT,
+            start_tls=settings.EMAIL_USE_TLS,
+            timeout=settings.EMAIL_TIMEOUT or 30,
+        )
+        await client.connect()
+        if settings.EMAIL_HOST_USER:
+            await client.login(settings.EMAIL_HOST_USER, settings.EMAIL_HOST_PASSWORD)
+        return client
+
+    async def close(self):
+        while not self._idle.empty():
+            client = self._idle.get_nowait()
+            try:
+                await client.quit()
+            except (aiosmtplib.SMTPException, OSError):
+                pass
+
+
+class AsyncSMSSender:
+    """Twilio's Messages API over a keep-alive aiohttp session."""
+
+    def __init__(self, size: int) -> None:
+        self._session = None
+        self._size = size
+
+    async def send(self, to, body, **extra):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self._size),
+                timeout=aiohttp.ClientTimeout(total=settings.TWILIO_TIMEOUT),
+                auth=aiohttp.BasicAuth(
+                    settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN
+                ),
+            )
+        base_url = (settings.TWILIO_BASE_URL or "https://api.twilio.com").rstrip("/")
+        url = f"{base_url}/2010-04-01/Accounts/{settings.TWILIO_ACCOUNT_SID}/Messages.json"
+        data = {"To": to, "From": settings.TWILIO_PHONE_NUMBER, "Body": body}
+        async with self._session.post(url, data=data) as response:
+            payload = await response.json(content_type=None)
+            if response.status >= 400:
+                raise RuntimeError(
+                    f"Twilio returned {response.status}: {payload.get('message')}"
+                )
+        return {"twilio_sid": str(payload["sid"])}
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+class AsyncDeliveryWorker:
+    """
+    Consume delivery tasks from Redis and run up to ``concurrency`` at once.
+
+    Each provider additionally gets its own semaphore
+    (``ASYNC_PROVIDER_CONCURRENCY``), so a slow provider cannot take every
+    slot. Channels without a native async client (or when ``aiohttp`` /
+    ``aiosmtplib`` are not installed) run the regular provider on the thread
+    pool. Tasks other than deliveries are executed with ``Task.apply``.
+
+    ``name`` (default ``ASYNC_WORKER_NAME``) identifies the processing list;
+    it must be unique among running workers and stable across restarts for
+    a killed worker's messages to be recovered.
+    """
+
+    def __init__(
+        self, queues, concurrency=200, db_threads=20, redis_client=None, name=None
+    ):
+        self.queues = list(queues)
+        self.concurrency = concurrency
+        self.name = name or settings.ASYNC_WORKER_NAME
+        self.redis = redis_client
+        self._owns_redis = redis_client is None
+        self._db_threads = db_threads
+        self._executor = ThreadPoolExecutor(
+            max_workers=db_threads, thread_name_prefix="async-delivery"
+        )
+        self._slots = None
+        self._provider_slots = {}
+        self._senders = {}
+        self._inflight = set()
+        self._stopping = False
+        self._promote = None
+        self._fetch = None
+        self._requeue = None
+
+    @property
+    def processing_key(self) -> str:
+        return f"{settings.ASYNC_WORKER_PROCESSING_KEY}:{self.name}"
+
+    def _setup(self):
+        if self.redis is None:
+            import redis.asyncio
+
+            self.redis = redis.asyncio.Redis.from_url(settings.CELERY_BROKER_URL)
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._promote = self.redis.register_script(PROMOTE_SCRIPT)
+        self._fetch = self.redis.register_script(FETCH_SCRIPT)
+        self._requeue = self.redis.register_script(REQUEUE_SCRIPT)
+        limits = settings.ASYNC_PROVIDER_CONCURRENCY
+        for channel, provider in PROVIDERS.items():
+            limit = limits.get(provider.name, self.concurrency)
+            self._provider_slots[channel] = asyncio.Semaphore(limit)
+        if aiosmtplib is not None and settings.EMAIL_BACKEND == SMTP_BACKEND:
+            self._senders["email"] = AsyncEmailSender(limits.get("smtp", 10))
+        if aiohttp is not None:
+            self._senders["sms"] = AsyncSMSSender(limits.get("twilio", 100))
+
+    async def run(self):
+        """Fetch and process messages until ``stop()`` is called."""
+        self._setup()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):  # pragma: no cover
+                pass
+
+        requeued = await self.requeue_unfinished()
+        if requeued:
+            logger.warning(
+                "Requeued %s messages left unfinished by worker %s", requeued, self.name
+            )
+        logger.info(
+            "Async delivery worker %s consuming %s (concurrency=%s)",
+            self.name,
+            ", ".join(self.queues),
+            self.concurrency,
+        )
+        promoter = asyncio.create_task(self._promote_delayed())
+        while not self._stopping:
+            await self._slots.acquire()
+            raw = await self.fetch()
+            if raw is None:
+                self._slots.release()
+                continue
+            task = asyncio.create_task(self._guarded(raw))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+        if self._inflight:
+            logger.info("Draining %s in-flight deliveries", len(self._inflight))
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        promoter.cancel()
+        await asyncio.gather(promoter, return_exceptions=True)
+        await self.close()
+
+    def stop(self):
+        self._stopping = True
+
+    async def close(self):
+        for sender in self._senders.values():
+            await sender.close()
+        if self._owns_redis:
+            await self.redis.aclose()
+        self._close_db_connections()
+        self._executor.shutdown(wait=True)
+
+    async def _promote_delayed(self):
+        while not self._stopping:
+            try:
+                await self.promote_due()
+            except Exception:
+                logger.exception("Failed to promote delayed messages")
+            await asyncio.sleep(PROMOTE_INTERVAL)
+
+    async def fetch(self):
+        """Move the next message onto the processing list and return it."""
+        raw = await self._fetch(keys=[self.processing_key, *self.queues])
+        if raw is None:
+            raw = await self.redis.blmove(
+                self.queues[0], self.processing_key, FETCH_WAIT, "RIGHT", "LEFT"
+            )
+        return raw
+
+    async def requeue_unfinished(self) -> int:
+        """Put messages a previous run of this worker held back on their queues."""
+        return await self._requeue(keys=[self.processing_key])
+
+    async def promote_due(self) -> int:
+        """Move parked messages that are due back onto their queues."""
+        return await self._promote(
+            keys=[settings.ASYNC_WORKER_DELAYED_KEY],
+            args=[time.time(), PROMOTE_BATCH_SIZE],
+        )
+
+    def _close_db_connections(self):
+        # Django connections are per thread: run close_all once on every
+        # executor thread, the barrier stops a thread taking two turns.
+        barrier = threading.Barrier(self._db_threads)
+
+        def close():
+            connections.close_all()
+            try:
+                barrier.wait(timeout=5)
+            except threading.BrokenBarrierError:  # pragma: no cover
+                pass
+
+        for _ in range(self._db_threads):
+            self._executor.submit(close)
+
+    async def _guarded(self, raw):
+        try:
+            await self.process(raw)
+        except Exception:
+            logger.exception("Async delivery worker failed to process a message")
+        finally:
+            try:
+                await self.redis.lrem(self.processing_key, 1, raw)
+            except Exception:
+                # Left on the list, the message runs again after a restart
+                logger.exception("Failed to remove a processed message")
+            self._slots.release()
+
+    async def process(self, raw):
+        """Process one raw kombu message."""
+        message = decode_message(raw)
+        if message["eta"] and message["eta"] > timezone.now():
+            # Countdown retries come back with an ETA: park the message until
+            # it is due instead of holding a slot while waiting
+            await self.redis.zadd(
+                settings.ASYNC_WORKER_DELAYED_KEY, {raw: message["eta"].timestamp()}
+            )
+            return
+        if message["published_at"]:
+            due = message["published_at"]
+            if message["eta"]:
+                due = max(due, message["eta"].timestamp())
+            TASK_QUEUE_WAIT.labels(task=message["task"], queue=message["queue"]).observe(
+                max(0.0, time.time() - due)
+            )
+
+        spec = DELIVERY_TASKS.get(message["task"])
+        if spec is None:
+            task = current_app.tasks[message["task"]]
+            await self._db(task.apply, args=message["args"], kwargs=message["kwargs"])
+            return
+
+        channel, unpack = spec
+        log_id, to, body, extra = unpack(*message["args"], **message["kwargs"])
+        await self.deliver(channel, log_id, to, body, extra, message)
+
+    async def deliver(self, channel, log_id, to, body, extra, message):
+        log = await self._db(delivery.load, channel, log_id)
+        if log is None:
+            return
+
+        try:
+            async with self._provider_slots[channel]:
+                sender = self._senders.get(channel)
+                with delivery.timed_provider_call(channel):
+                    if sender is not None:
+                        metadata = await sender.send(to, body, **extra)
+                    else:
+                        metadata = await self._db(PROVIDERS[channel].send, to, body, **extra)
+        except Exception as exc:
+            delay = await self._db(
+                delivery.record_failure, log, channel, log_id, to, exc, queue=message["queue"]
+            )
+            if delay is None:
+                return
+            scheduled = await self._db(
+                delivery.schedule_retry,
+                message["task"],
+                message["args"],
+                message["kwargs"],
+                message["queue"],
+                delay,
+                log["attempts"] + 1,
+            )
+            if not scheduled:
+                task = current_app.tasks[message["task"]]
+                await self._db(
+                    task.apply_async,
+                    args=message["args"],
+                    kwargs=message["kwargs"],
+                    countdown=delay,
+                    queue=message["queue"],
+                )
+            return
+
+        await self._db(
+            delivery.record_sent, log, channel, log_id, to, metadata, queue=message["queue"]
+        )
+
+    async def _db(self, func, *args, **kwargs):
+        return await sync_to_async(func, thread_sensitive=False, executor=self._executor)(
+            *args, **kwargs
+        )
+
@@ -0,0 +1,181 @@
+"""
+Delivery engine shared by every channel task.
+
+Per delivery the database sees one SELECT of the few columns needed to decide
+whether to send, and one conditional UPDATE recording the outcome (status,
+timestamps, error and provider metadata together).
+"""
+
+import logging
+import random
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import idempotency, live_counters, retry_scheduler
+from .metrics import NOTIFICATIONS_TOTAL, PROVIDER_CALL_DURATION
+from .models import NotificationLog
+from .providers import PROVIDERS
+from .status_buffer import get_status_buffer
+
+# Child of the tasks logger, so delivery logs end up in logs/celery.log
+logger = logging.getLogger("notifications.tasks.delivery")
+
+
+def retry_delay(attempt: int) -> int:
+    """
+    Exponential backoff in seconds before retry number ``attempt``.
+
+    Half of the delay is random ("equal jitter"), so notifications that failed
+    together during an outage do not all come back in the same second.
+    """
+    base = 60 * (2**attempt)
+    return base // 2 + random.randint(0, base // 2)
+
+
+def schedule_retry(task_name, args, kwargs, queue, delay, attempt) -> bool:
+    """Park a retry in the Redis schedule; ``False`` means use a countdown."""
+    if not settings.RETRY_SCHEDULER_ENABLED:
+        return False
+    return retry_scheduler.schedule(task_name, args, kwargs, queue, delay, attempt)
+
+
+def deliver(task, channel: str, log_id: str, to: str, body: str, **extra) -> None:
+    """
+    Deliver one notification through the provider for ``channel``.
+
+    Logs already sent or failed are skipped without calling the provider, so a
+    redelivered or duplicated task message cannot send twice. Failures are
+    recorded as ``retrying`` and retried with jittered exponential backoff
+    (through the Redis retry schedule when ``RETRY_SCHEDULER_ENABLED``,
+    otherwise ``task.retry``) until ``max_retries`` is reached, then recorded
+    as ``failed``.
+    """
+    log = load(channel, log_id)
+    if log is None:
+        return
+
+    request = task.request
+    queue = (request.delivery_info or {}).get("routing_key") or "low_priority"
+    try:
+        with timed_provider_call(channel):
+            metadata = PROVIDERS[channel].send(to, body, **extra)
+    except Exception as exc:
+        delay = record_failure(log, channel, log_id, to, exc, queue=queue)
+        if delay is None:
+            return  # No retry
+        if schedule_retry(
+            task.name, request.args, request.kwargs, queue, delay, log["attempts"] + 1
+        ):
+            return
+        raise task.retry(exc=exc, countdown=delay)
+
+    record_sent(log, channel, log_id, to, metadata, queue=queue)
+
+
+@contextmanager
+def timed_provider_call(channel: str):
+    """Observe the duration of the provider call run in the block."""
+    started = time.monotonic()
+    outcome = "error"
+    try:
+        yield
+        outcome = "success"
+    finally:
+        PROVIDER_CALL_DURATION.labels(channel=channel, outcome=outcome).observe(
+            time.monotonic() - started
+        )
+
+
+def load(channel: str, log_id: str):
+    """The columns delivery needs, or ``None`` if the log must not be sent."""
+    log = (
+        NotificationLog.objects.filter(id=log_id)
+        .values("status", "attempts", "max_retries", "idempotency_key")
+        .first()
+    )
+    if log is None:
+        logger.warning(
+            "NotificationLog %s no longer exists, skipping %s send", log_id, channel
+        )
+        return None
+    if log["status"] in NotificationLog.TERMINAL_STATUSES:
+        logger.info(
+            "NotificationLog %s already %s, skipping %s send",
+            log_id,
+            log["status"],
+            channel,
+        )
+        return None
+    return log
+
+
+def record_sent(log, channel, log_id, to, metadata, queue=None) -> None:
+    now = timezone.now()
+    fields = {"sent_at": now, "last_attempt_at": now}
+    if metadata:
+        fields["provider_config"] = metadata
+    _record(log, log_id, "sent", **fields)
+    _count(channel, "sent", queue)
+    logger.info("%s sent successfully to %s (log=%s)", channel, to, log_id)
+
+
+def record_failure(log, channel, log_id, to, exc, queue=None):
+    """Record a failed attempt; return the retry delay, or ``None`` if final."""
+    next_attempt = log["attempts"] + 1
+    if next_attempt >= log["max_retries"]:
+        _record(
+            log,
+            log_id,
+            "failed",
+            error_message=str(exc),
+            last_attempt_at=timezone.now(),
+            next_retry_at=None,
+        )
+        _count(channel, "failed", queue)
+        logger.error(
+            "%s delivery failed permanently for %s (log=%s)",
+            channel,
+            to,
+            log_id,
+            exc_info=exc,
+        )
+        return None
+
+    delay = retry_delay(next_attempt)
+    now = timezone.now()
+    _record(
+        log,
+        log_id,
+        "retrying",
+        error_message=str(exc),
+        last_attempt_at=now,
+        next_retry_at=now + timezone.timedelta(seconds=delay),
+    )
+    _count(channel, "retrying", queue)
+    logger.warning(
+        "%s delivery failed for %s (log=%s). Retrying in %s seconds",
+        channel,
+        to,
+        log_id,
+        delay,
+    )
+    return delay
+
+
+def _count(channel, status, queue):
+    NOTIFICATIONS_TOTAL.labels(channel=channel, status=status).inc()
+    live_counters.record(channel, status, queue)
+
+
+def _record(log, log_id, status, **fields):
+    if settings.STATUS_BUFFER_ENABLED:
+        # Written later in a batch with other workers' outcomes
+        get_status_buffer().add(
+            log_id, status, idempotency_key=log["idempotency_key"], **fields
+        )
+        return
+    if NotificationLog.transition(log_id, status, **fields) and log["idempotency_key"]:
+        idempotency.update_status(log["idempotency_key"], log_id, status)
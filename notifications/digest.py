@@ -0,0 +1,281 @@
+"""
+Daily digest pipeline.
+
+``send_daily_digest`` is a coordinator. Each run reads the next page of ids
+of users with activity on the previous day, in user id order, just enough to
+fill the free slots, and hands them out ``DIGEST_CHUNK_SIZE`` at a time to
+``send_digest_chunk`` tasks. At most ``DIGEST_MAX_IN_FLIGHT`` chunks are
+queued or running at once; when they are all taken the coordinator
+re-enqueues itself instead of waiting. Each chunk aggregates its users'
+activity in one grouped query and creates and publishes their digest emails
+in bulk.
+
+Only one coordinator chain runs per day: it holds the ``digest:<day>:running``
+lease and renews it on every run, so a chain started while another is still
+re-enqueuing itself (Beat retries the day hourly) exits at once. The last
+user id handed out is checkpointed in Redis, so a chain that dies resumes
+after it once its lease expires. Digests carry the idempotency key
+``digest:<day>:<user_id>``, so a chunk that runs twice does not email anyone
+twice.
+
+The lease, checkpoint and in-flight count live on the durable state Redis
+(``redis_clients.get_state_client``). A Redis error propagates: the
+coordinator stops and retries later rather than taking a missing lease or
+checkpoint for a fresh start.
+"""
+
+import logging
+import uuid
+from contextlib import nullcontext
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+from . import live_counters, outbox
+from .models import NotificationLog, NotificationTemplate
+from .publisher import publish_many
+from .redis_clients import get_state_client
+from .rendering import TemplateRenderError
+from .template_cache import template_cache
+
+logger = logging.getLogger("notifications.tasks.digest")
+
+# Redis state of a run expires after this many seconds
+STATE_TTL = 2 * 24 * 60 * 60
+
+# An in-flight count left behind by a killed chunk expires after this long
+IN_FLIGHT_TTL = 10 * 60
+
+# A coordinator chain that stops renewing its lease (killed worker, lost
+# message) lets the next Beat run take over after this long
+LEASE_TTL = 5 * 60
+
+# Takes or renews the lease KEYS[1] for holder ARGV[1], for ARGV[2] seconds,
+# unless another holder has it.
+LEASE_SCRIPT = """
+local holder = redis.call('GET', KEYS[1])
+if holder and holder ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return 1
+"""
+
+# Deletes the lease KEYS[1] if holder ARGV[1] still has it.
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def _key(day: date, name: str) -> str:
+    return f"digest:{day.isoformat()}:{name}"
+
+
+def window(day: date) -> tuple[datetime, datetime]:
+    """The activity a digest sent on ``day`` covers: the whole previous day."""
+    end = timezone.make_aware(datetime.combine(day, time.min))
+    return end - timedelta(days=1), end
+
+
+def active_users(day: date, after=None, limit=None) -> list[str]:
+    """Up to ``limit`` distinct user ids active in ``window(day)``, after ``after``."""
+    start, end = window(day)
+    logs = NotificationLog.objects.filter(created_at__gte=start, created_at__lt=end)
+    logs = logs.exclude(template__name=settings.DIGEST_TEMPLATE)
+    if after:
+        logs = logs.filter(user_id__gt=after)
+    users = logs.order_by("user_id").values_list("user_id", flat=True).distinct()
+    return list(users[:limit] if limit else users)
+
+
+def hold_lease(day: date, holder=None):
+    """
+    Take (``holder`` is None) or renew the coordinator lease for ``day``.
+
+    Returns the holder token to pass to the next run, or ``None`` if another
+    coordinator chain holds the lease.
+    """
+    holder = holder or uuid.uuid4().hex
+    held = _scripts()[0](keys=[_key(day, "running")], args=[holder, LEASE_TTL])
+    return holder if held else None
+
+
+def release_lease(day: date, holder: str) -> None:
+    _scripts()[1](keys=[_key(day, "running")], args=[holder])
+
+
+def dispatch(day: date) -> tuple[int, bool]:
+    """
+    Hand out as many chunks of ``day``'s users as there are free slots.
+
+    Returns ``(chunks dispatched, finished)``.
+    """
+    client = get_state_client()
+    if client.exists(_key(day, "done")):
+        return 0, True
+    free = settings.DIGEST_MAX_IN_FLIGHT - int(client.get(_key(day, "in_flight")) or 0)
+    if free <= 0:
+        return 0, False
+
+    # Read only the page the free slots can take, from the checkpoint on
+    checkpoint = client.get(_key(day, "checkpoint"))
+    page = free * settings.DIGEST_CHUNK_SIZE
+    users = active_users(day, after=checkpoint.decode() if checkpoint else None, limit=page)
+    dispatched = 0
+    for start in range(0, len(users), settings.DIGEST_CHUNK_SIZE):
+        _dispatch_chunk(client, day, users[start : start + settings.DIGEST_CHUNK_SIZE])
+        dispatched += 1
+    if len(users) == page:
+        return dispatched, False  # There may be more
+
+    client.set(_key(day, "done"), 1, ex=STATE_TTL)
+    return dispatched, True
+
+
+def _dispatch_chunk(client, day, user_ids):
+    from .tasks import send_digest_chunk
+
+    pipe = client.pipeline(transaction=False)
+    pipe.incr(_key(day, "in_flight"))
+    pipe.expire(_key(day, "in_flight"), IN_FLIGHT_TTL)
+    pipe.execute()
+    send_digest_chunk.apply_async(
+        args=[day.isoformat(), user_ids], queue=settings.DIGEST_QUEUE
+    )
+    # Checkpoint only once the chunk is queued; a crash in between queues it
+    # again on resume, and idempotency keys make that harmless.
+    client.set(_key(day, "checkpoint"), user_ids[-1], ex=STATE_TTL)
+
+
+_lease_scripts = None
+
+
+def _scripts():
+    global _lease_scripts
+    if _lease_scripts is None:
+        client = get_state_client()
+        _lease_scripts = (
+            client.register_script(LEASE_SCRIPT),
+            client.register_script(RELEASE_SCRIPT),
+        )
+    return _lease_scripts
+
+
+def release_slot(day: date) -> None:
+    """Called when a chunk finishes, freeing its slot for the coordinator."""
+    client = get_state_client()
+    if client.decr(_key(day, "in_flight")) < 0:
+        # A chunk run by hand, or redelivered, never took a slot
+        client.set(_key(day, "in_flight"), 0, ex=IN_FLIGHT_TTL)
+
+
+def aggregate(day: date, user_ids, template: NotificationTemplate) -> list[dict]:
+    """Per-user activity counts for ``window(day)``, in one grouped query."""
+    start, end = window(day)
+    return list(
+        NotificationLog.objects.filter(
+            user_id__in=user_ids, created_at__gte=start, created_at__lt=end
+        )
+        .exclude(template=template)
+        .values("user_id")
+        .annotate(
+            total=Count("id"),
+            sent=Count("id", filter=Q(status="sent")),
+            failed=Count("id", filter=Q(status="failed")),
+            email=Max("to", filter=Q(channel="email")),
+        )
+        .order_by()
+    )
+
+
+def send_chunk(day: date, user_ids) -> int:
+    """Create and publish the digests of ``user_ids``; return how many."""
+    from .adapters import ADAPTERS
+
+    try:
+        template = template_cache.get(settings.DIGEST_TEMPLATE)
+    except NotificationTemplate.DoesNotExist:
+        logger.error("Digest template %r does not exist", settings.DIGEST_TEMPLATE)
+        return 0
+
+    logs, payloads = [], {}
+    for row in aggregate(day, user_ids, template):
+        if not row["email"]:
+            continue  # No address to send a digest to
+        context = {
+            "user_id": row["user_id"],
+            "date": (day - timedelta(days=1)).isoformat(),
+            "total": row["total"],
+            "sent": row["sent"],
+            "failed": row["failed"],
+            "pending": row["total"] - row["sent"] - row["failed"],
+        }
+        try:
+            body = template.renderer.render(context)
+        except TemplateRenderError as exc:
+            logger.error("Cannot render digest for %s: %s", row["user_id"], exc)
+            continue
+        log = NotificationLog(
+            user_id=row["user_id"],
+            template=template,
+            channel="email",
+            to=row["email"],
+            idempotency_key=f"digest:{day.isoformat()}:{row['user_id']}",
+        )
+        logs.append(log)
+        payloads[log.idempotency_key] = {
+            "to": row["email"],
+            "subject": template.subject,
+            "body": body,
+            "queue": settings.DIGEST_QUEUE,
+        }
+
+    use_outbox = settings.NOTIFICATION_OUTBOX_ENABLED
+    with transaction.atomic() if use_outbox else nullcontext():
+        created = _insert(logs)
+        signatures = [
+            (log.id, ADAPTERS["email"].signature(str(log.id), payloads[log.idempotency_key]))
+            for log in created
+        ]
+        if use_outbox:
+            outbox.enqueue(signatures)
+    if not use_outbox:
+        publish_many(signature for _, signature in signatures)
+    live_counters.record("email", "queued", settings.DIGEST_QUEUE, amount=len(created))
+    return len(created)
+
+
+def _insert(logs):
+    """Insert the digests not sent yet; return the ones created."""
+    keys = [log.idempotency_key for log in logs]
+    existing = set(
+        NotificationLog.objects.filter(idempotency_key__in=keys).values_list(
+            "idempotency_key", flat=True
+        )
+    )
+    logs = [log for log in logs if log.idempotency_key not in existing]
+    try:
+        with transaction.atomic():
+            NotificationLog.objects.bulk_create(logs, batch_size=500)
+        return logs
+    except IntegrityError:
+        # The same chunk is running concurrently: insert one by one
+        created = []
+        for log in logs:
+            _, was_created = NotificationLog.create_idempotent(
+                id=log.id,
+                user_id=log.user_id,
+                template=log.template,
+                channel=log.channel,
+                to=log.to,
+                idempotency_key=log.idempotency_key,
+            )
+            if was_created:
+                created.append(log)
+        return created
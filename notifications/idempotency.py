@@ -0,0 +1,101 @@
+import logging
+from typing import NamedTuple, Optional
+
+import redis
+from django.conf import settings
+
+from .redis_clients import get_cache_client
+
+logger = logging.getLogger(__name__)
+
+PENDING = b"pending"
+
+# Returns the stored value if the key is already taken, otherwise reserves
+# it (marked pending) and returns nil, in one round trip.
+#
+# KEYS[1]  idempotency key
+# ARGV[1]  reservation TTL (seconds)
+RESERVE_SCRIPT = """
+local value = redis.call('GET', KEYS[1])
+if value then
+    return value
+end
+redis.call('SET', KEYS[1], 'pending', 'EX', ARGV[1])
+return false
+"""
+
+
+class IdempotentHit(NamedTuple):
+    """A previously accepted request, as remembered by Redis."""
+
+    id: str
+    status: str
+
+
+def _key(idempotency_key: str) -> str:
+    return f"idempotency:{idempotency_key}"
+
+
+def reserve(idempotency_key: str) -> tuple[bool, Optional[IdempotentHit]]:
+    """
+    Try to claim ``idempotency_key`` for a new notification.
+
+    Returns ``(True, None)`` when this request now owns the key,
+    ``(False, hit)`` when Redis knows the notification it produced, and
+    ``(False, None)`` when Redis cannot answer (another request holds the
+    reservation, or Redis is unreachable). In that last case callers fall
+    back to the database, whose unique constraint stays the source of truth.
+    """
+    try:
+        value = _script()(
+            keys=[_key(idempotency_key)],
+            args=[settings.IDEMPOTENCY_RESERVATION_TTL],
+        )
+    except redis.RedisError as exc:
+        logger.warning("Idempotency reservation failed (%s); using database", exc)
+        return False, None
+
+    if value is None:
+        return True, None
+    if value == PENDING:
+        return False, None
+    log_id, _, status = value.decode().partition(":")
+    return False, IdempotentHit(id=log_id, status=status)
+
+
+def remember(idempotency_key: str, log_id, status: str) -> None:
+    """Store the notification accepted for ``idempotency_key``."""
+    _safe_set(idempotency_key, f"{log_id}:{status}", ex=settings.IDEMPOTENCY_TTL)
+
+
+def update_status(idempotency_key: str, log_id, status: str) -> None:
+    """Refresh the remembered status, keeping the key's TTL."""
+    _safe_set(idempotency_key, f"{log_id}:{status}", xx=True, keepttl=True)
+
+
+def release(idempotency_key: str) -> None:
+    """Drop a reservation whose request did not create a notification."""
+    try:
+        client = get_cache_client()
+        key = _key(idempotency_key)
+        if client.get(key) == PENDING:
+            client.delete(key)
+    except redis.RedisError as exc:
+        logger.warning("Failed to release idempotency reservation: %s", exc)
+
+
+def _safe_set(idempotency_key: str, value: str, **options) -> None:
+    try:
+        get_cache_client().set(_key(idempotency_key), value, **options)
+    except redis.RedisError as exc:
+        logger.warning("Failed to store idempotency result: %s", exc)
+
+
+_reserve_script = None
+
+
+def _script():
+    global _reserve_script
+    if _reserve_script is None:
+        _reserve_script = get_cache_client().register_script(RESERVE_SCRIPT)
+    return _reserve_script
@@ -0,0 +1,116 @@
+"""
+Per-minute notification counters in Redis for the live dashboard.
+
+The API counts every notification it queues and the workers count every
+delivery outcome, by channel, status and queue. Each minute has its own hash,
+``live:<unix minute>``, with one field per ``<channel>:<status>:<queue>``;
+the hash expires ``LIVE_COUNTERS_RETENTION`` minutes after its minute ends,
+so Redis holds a fixed ring of the most recent minutes and nothing has to
+trim it. Readers (``dashboard/app.py``, ``dashboard/metrics.py``) fetch the
+last few hashes in one pipeline instead of counting rows in the log table.
+
+Increments are fire-and-forget: ``record`` only bumps an in-process counter,
+and a daemon thread flushes them every ``LIVE_COUNTERS_FLUSH_INTERVAL``
+seconds as one pipeline of ``HINCRBY`` and ``EXPIREAT``. If Redis is down the
+counts are dropped; these are approximate, live numbers and the log table
+stays the source of truth.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+import redis
+from celery.signals import worker_process_shutdown
+from django.conf import settings
+
+from .redis_clients import get_cache_client
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "live:"
+
+
+def key(minute: int) -> str:
+    return f"{KEY_PREFIX}{minute}"
+
+
+class LiveCounters:
+    def __init__(self, flush_interval=1.0, retention=1440) -> None:
+        self.flush_interval = flush_interval
+        self.retention = retention
+        self._pending = Counter()  # (minute, field) -> count
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def incr(self, channel, status, queue, amount=1) -> None:
+        minute = int(time.time() // 60)
+        with self._lock:
+            self._ensure_flusher()
+            self._pending[minute, f"{channel}:{status}:{queue}"] += amount
+
+    def flush(self) -> int:
+        """Send the buffered increments; return how many fields were written."""
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        if not pending:
+            return 0
+
+        pipe = get_cache_client().pipeline(transaction=False)
+        for (minute, field), count in pending.items():
+            pipe.hincrby(key(minute), field, count)
+        for minute in {minute for minute, _ in pending}:
+            pipe.expireat(key(minute), (minute + 1 + self.retention) * 60)
+        try:
+            pipe.execute()
+        except redis.RedisError as exc:
+            logger.warning("Dropped %s live counter increments: %s", len(pending), exc)
+            return 0
+        return len(pending)
+
+    def _ensure_flusher(self):
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        # First use in this process (or after a fork): start its flusher
+        self._pid = os.getpid()
+        self._thread = threading.Thread(
+            target=self._run, name="live-counters-flusher", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+
+_counters = None
+
+
+def get_live_counters() -> LiveCounters:
+    global _counters
+    if _counters is None:
+        _counters = LiveCounters(
+            flush_interval=settings.LIVE_COUNTERS_FLUSH_INTERVAL,
+            retention=settings.LIVE_COUNTERS_RETENTION,
+        )
+    return _counters
+
+
+def record(channel, status, queue, amount=1) -> None:
+    """Count ``amount`` notifications reaching ``status`` in the current minute."""
+    if settings.LIVE_COUNTERS_ENABLED and amount:
+        get_live_counters().incr(channel, status, queue or "low_priority", amount)
+
+
+@worker_process_shutdown.connect
+def _drain(**kwargs):
+    if _counters is not None:
+        _counters.flush()
+
+
+atexit.register(_drain)
@@ -0,0 +1,52 @@
+import time
+
+from django.conf import settings
+from django.core.mail import EmailMessage, send_mail
+from django.core.management.base import BaseCommand
+
+from notifications.smtp_pool import SMTPConnectionPool
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare send_mail (new connection per message) with the pooled SMTP "
+        "connections used by email workers. Point EMAIL_HOST at a local sink "
+        "such as mailpit."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=200, help="Messages per run")
+        parser.add_argument("--to", default="bench@example.com", help="Recipient")
+
+    def handle(self, *args, **options):
+        count = options["messages"]
+        to = options["to"]
+        from_email = settings.DEFAULT_FROM_EMAIL
+        pool = SMTPConnectionPool(
+            size=1,
+            idle_timeout=settings.SMTP_POOL_IDLE_TIMEOUT,
+            max_messages=settings.SMTP_POOL_MAX_MESSAGES,
+        )
+
+        def unpooled(i):
+            send_mail(f"bench {i}", "body", from_email, [to], fail_silently=False)
+
+        def pooled(i):
+            pool.send(EmailMessage(f"bench {i}", "body", from_email, [to]))
+
+        self.stdout.write(f"Sending {count} messages via {settings.EMAIL_HOST}:{settings.EMAIL_PORT}")
+        timings = {}
+        for label, func in (("send_mail", unpooled), ("pooled", pooled)):
+            start = time.perf_counter()
+            for i in range(count):
+                func(i)
+            elapsed = time.perf_counter() - start
+            timings[label] = elapsed
+            self.stdout.write(
+                f"{label:<10} {elapsed / count * 1e3:8.2f} ms/message "
+                f"{count / elapsed:10,.0f} messages/s"
+            )
+        pool.close_all()
+
+        speedup = timings["send_mail"] / timings["pooled"]
+        self.stdout.write(self.style.SUCCESS(f"speedup: {speedup:.2f}x"))
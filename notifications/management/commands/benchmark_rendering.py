@@ -0,0 +1,49 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from notifications.rendering import CompiledTemplate
+
+DEFAULT_TEMPLATE = (
+    "Hi {name}, your order {order_id} for {amount} has shipped and should "
+    "arrive on {delivery_date}. Track it at {tracking_url}. Thanks, {company}"
+)
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmark CompiledTemplate against plain str.format."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--template", default=DEFAULT_TEMPLATE, help="Template body to render"
+        )
+        parser.add_argument(
+            "--iterations", type=int, default=200_000, help="Renders per run"
+        )
+        parser.add_argument("--repeat", type=int, default=5, help="Runs per method")
+
+    def handle(self, *args, **options):
+        source = options["template"]
+        iterations = options["iterations"]
+        compiled = CompiledTemplate(source)
+        context = {name: f"<{name}>" for name in compiled.variables}
+
+        if compiled.render(context) != source.format(**context):
+            self.stderr.write("Renderers disagree; aborting benchmark")
+            return
+
+        candidates = {
+            "str.format": lambda: source.format(**context),
+            "CompiledTemplate": lambda: compiled.render(context),
+        }
+        timings = {}
+        for label, func in candidates.items():
+            best = min(timeit.repeat(func, number=iterations, repeat=options["repeat"]))
+            timings[label] = best
+            self.stdout.write(
+                f"{label:<18} {best / iterations * 1e9:8.0f} ns/render "
+                f"{iterations / best:12,.0f} renders/s"
+            )
+
+        speedup = timings["str.format"] / timings["CompiledTemplate"]
+        self.stdout.write(self.style.SUCCESS(f"speedup: {speedup:.2f}x"))
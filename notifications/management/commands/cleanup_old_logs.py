@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from notifications.retention import ARCHIVE_MODES, cleanup
+
+
+class Command(BaseCommand):
+    help = "Delete (and optionally archive) old sent/failed logs in bounded batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=30, help="Retention in days")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.RETENTION_BATCH_SIZE,
+            help="Rows deleted per transaction",
+        )
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=settings.RETENTION_BATCH_PAUSE,
+            help="Seconds to sleep between batches",
+        )
+        parser.add_argument(
+            "--time-budget",
+            type=float,
+            default=settings.RETENTION_TIME_BUDGET,
+            help="Stop after this many seconds (the next run resumes)",
+        )
+        parser.add_argument(
+            "--archive",
+            choices=ARCHIVE_MODES,
+            default=settings.RETENTION_ARCHIVE or None,
+            help="Copy rows to the archive table or to gzipped NDJSON files first",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            result = cleanup(
+                options["days"],
+                batch_size=options["batch_size"],
+                pause=options["pause"],
+                time_budget=options["time_budget"],
+                archive=options["archive"] or "",
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc)) from exc
+
+        self.stdout.write(
+            f"Deleted {result.deleted:,} logs in {result.batches} batches, "
+            f"{result.elapsed:.1f}s ({result.rows_per_second:,.0f} rows/s)"
+        )
+        if result.finished:
+            self.stdout.write(self.style.SUCCESS("Retention cleanup complete"))
+        else:
+            self.stdout.write(
+                self.style.WARNING("Time budget reached; the next run resumes from here")
+            )
@@ -0,0 +1,67 @@
+import logging
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from notifications.outbox import dispatch_batch
+
+logger = logging.getLogger("notifications.outbox")
+
+# Longest pause, in seconds, between attempts while dispatching keeps failing
+MAX_BACKOFF = 30.0
+
+
+class Command(BaseCommand):
+    help = "Publish NotificationOutbox rows to Celery in pipelined batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.OUTBOX_BATCH_SIZE,
+            help="Rows claimed per transaction",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=settings.OUTBOX_POLL_INTERVAL,
+            help="Seconds to sleep when the outbox is empty",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Drain the outbox and exit"
+        )
+
+    def handle(self, *args, **options):
+        self._stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        batch_size = options["batch_size"]
+        total = failures = 0
+        while not self._stopping:
+            try:
+                published = dispatch_batch(batch_size)
+            except Exception:
+                if options["once"]:
+                    raise
+                # Broker or database down: keep the dispatcher alive, back off
+                failures += 1
+                delay = min(MAX_BACKOFF, options["poll_interval"] * 2**failures)
+                logger.exception("Outbox dispatch failed; retrying in %.1fs", delay)
+                close_old_connections()
+                time.sleep(delay)
+                continue
+            failures = 0
+            total += published
+            if published < batch_size:
+                if options["once"]:
+                    break
+                time.sleep(options["poll_interval"])
+
+        self.stdout.write(self.style.SUCCESS(f"Published {total} outbox entries"))
+
+    def _stop(self, signum, frame):
+        self._stopping = True
@@ -0,0 +1,60 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from notifications.export import FORMATS, ExportError, export_queryset, stream_export
+
+
+class Command(BaseCommand):
+    help = "Stream notification logs to NDJSON or CSV for reconciliation."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", help="Inclusive lower bound on created_at")
+        parser.add_argument("--end", help="Exclusive upper bound on created_at")
+        parser.add_argument("--channel", help="Filter by channel")
+        parser.add_argument("--status", help="Filter by status")
+        parser.add_argument("--user-id", help="Filter by user identifier")
+        parser.add_argument(
+            "--format", dest="fmt", choices=FORMATS, default="ndjson", help="Output format"
+        )
+        parser.add_argument("--gzip", action="store_true", help="Gzip the output")
+        parser.add_argument(
+            "--chunk-size", type=int, help="Rows fetched per cursor round trip"
+        )
+        parser.add_argument(
+            "--output", "-o", default="-", help="Output file (default: stdout)"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            logs = export_queryset(
+                start=options["start"],
+                end=options["end"],
+                channel=options["channel"],
+                status=options["status"],
+                user_id=options["user_id"],
+            )
+            blocks = stream_export(
+                logs,
+                fmt=options["fmt"],
+                compress=options["gzip"],
+                chunk_size=options["chunk_size"],
+            )
+        except ExportError as exc:
+            raise CommandError(str(exc)) from exc
+
+        path = options["output"]
+        out = sys.stdout.buffer if path == "-" else open(path, "wb")
+        written = 0
+        try:
+            for block in blocks:
+                out.write(block)
+                written += len(block)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+            else:
+                out.flush()
+
+        if path != "-":
+            self.stdout.write(self.style.SUCCESS(f"Wrote {written:,} bytes to {path}"))
@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from notifications import partitions
+
+
+class Command(BaseCommand):
+    help = (
+        "Convert NotificationLog to a table range-partitioned by created_at "
+        "(PostgreSQL), or create upcoming partitions and refresh its idempotency "
+        "triggers if it already is."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            choices=partitions.INTERVALS,
+            default=settings.NOTIFICATION_LOG_PARTITIONS or None,
+            help="Partition size (default: NOTIFICATION_LOG_PARTITIONS)",
+        )
+        parser.add_argument(
+            "--ahead",
+            type=int,
+            default=settings.NOTIFICATION_LOG_PARTITIONS_AHEAD,
+            help="Partitions to create beyond the current one",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Partitioning requires PostgreSQL")
+        interval = options["interval"]
+        if not interval:
+            raise CommandError("Pass --interval or set NOTIFICATION_LOG_PARTITIONS")
+        if interval != settings.NOTIFICATION_LOG_PARTITIONS:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"Set NOTIFICATION_LOG_PARTITIONS={interval} for the API, "
+                    "workers and Beat"
+                )
+            )
+
+        if partitions.is_partitioned():
+            created = partitions.ensure_partitions(interval, options["ahead"])
+            # Brings tables converted by an earlier version up to date
+            partitions.install_claim_triggers()
+            orphaned = partitions.remove_orphaned_claims()
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Already partitioned; created {len(created)} partitions, "
+                    f"removed {orphaned} orphaned idempotency claims"
+                )
+            )
+            return
+
+        copied = partitions.convert(interval, options["ahead"])
+        count = len(partitions.partitions(interval))
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Partitioned NotificationLog by {interval}: {copied:,} rows in "
+                f"{count} partitions"
+            )
+        )
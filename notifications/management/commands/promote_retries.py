@@ -0,0 +1,48 @@
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from notifications.retry_scheduler import promote_due
+
+
+class Command(BaseCommand):
+    help = "Move due delivery retries from the Redis retry schedule onto their queues."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.RETRY_PROMOTER_BATCH_SIZE,
+            help="Retries published per round trip",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=settings.RETRY_PROMOTER_POLL_INTERVAL,
+            help="Seconds to sleep when no retry is due",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Promote what is due and exit"
+        )
+
+    def handle(self, *args, **options):
+        self._stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        batch_size = options["batch_size"]
+        total = 0
+        while not self._stopping:
+            promoted = promote_due(batch_size)
+            total += promoted
+            if promoted < batch_size:
+                if options["once"]:
+                    break
+                time.sleep(options["poll_interval"])
+
+        self.stdout.write(self.style.SUCCESS(f"Promoted {total} retries"))
+
+    def _stop(self, signum, frame):
+        self._stopping = True
@@ -0,0 +1,47 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from notifications.async_delivery import AsyncDeliveryWorker
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the asyncio delivery worker: hundreds of concurrent sends per "
+        "process instead of one per prefork process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-Q",
+            "--queues",
+            default="high_priority,low_priority",
+            help="Comma-separated queues, highest priority first",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=settings.ASYNC_WORKER_CONCURRENCY,
+            help="Maximum in-flight messages",
+        )
+        parser.add_argument(
+            "--db-threads",
+            type=int,
+            default=settings.ASYNC_WORKER_DB_THREADS,
+            help="Threads running ORM calls",
+        )
+        parser.add_argument(
+            "--name",
+            default=settings.ASYNC_WORKER_NAME,
+            help="Unique, restart-stable worker name (names its processing list)",
+        )
+
+    def handle(self, *args, **options):
+        worker = AsyncDeliveryWorker(
+            queues=[queue for queue in options["queues"].split(",") if queue],
+            concurrency=options["concurrency"],
+            db_threads=options["db_threads"],
+            name=options["name"],
+        )
+        asyncio.run(worker.run())
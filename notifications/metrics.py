@@ -0,0 +1,219 @@
+"""
+In-process Prometheus metrics for the API and Celery workers.
+
+The API serves them at ``/metrics``; a Celery worker serves them on
+``WORKER_METRICS_PORT`` from its main process. With several processes per
+service (gunicorn workers, prefork pool children) set
+``PROMETHEUS_MULTIPROC_DIR`` to a directory of the service's own before it
+starts: every process then keeps its samples in files there and a scrape adds
+them up across processes, including ones that have since exited. The
+directory is cleared when the service starts (gunicorn ``on_starting``, Celery
+``worker_init``).
+
+Worker timings come from Celery task signals: the publisher stamps each
+message with the time it was published, so ``task_prerun`` can tell how long
+it waited in the queue (from its ETA, for countdown retries).
+"""
+
+import glob
+import os
+import time
+from datetime import datetime
+
+from celery.signals import (
+    before_task_publish,
+    task_postrun,
+    task_prerun,
+    worker_init,
+    worker_process_shutdown,
+)
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+
+MULTIPROC_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+# =============================================================================
+# Rate Limiting
+# =============================================================================
+
+RATE_LIMIT_FALLBACK_ACTIVE = Gauge(
+    "pulse_rate_limit_fallback_active",
+    "1 while the rate limiter answers from its in-process fallback",
+    multiprocess_mode="livemax",
+)
+
+RATE_LIMIT_FALLBACK_DECISIONS = Counter(
+    "pulse_rate_limit_fallback_decisions_total",
+    "Rate limit decisions made by the in-process fallback",
+    ["allowed"],
+)
+
+RATE_LIMIT_REJECTIONS = Counter(
+    "pulse_rate_limit_rejections_total",
+    "Send requests rejected by a rate limit tier",
+    ["tier", "channel"],
+)
+
+# =============================================================================
+# API
+# =============================================================================
+
+API_REQUEST_DURATION = Histogram(
+    "pulse_api_request_duration_seconds",
+    "Time to answer a send request",
+    ["view", "status_code"],
+    buckets=[0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5],
+)
+
+API_STAGE_DURATION = Histogram(
+    "pulse_api_stage_duration_seconds",
+    "Time in each stage of a send request, excluding nested stages",
+    ["view", "stage"],
+    buckets=[0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1],
+)
+
+API_DB_QUERIES = Histogram(
+    "pulse_api_db_queries",
+    "Database queries per send request",
+    ["view"],
+    buckets=[0, 1, 2, 3, 4, 6, 8, 12, 20, 50],
+)
+
+API_DB_TIME = Histogram(
+    "pulse_api_db_time_seconds",
+    "Time spent in database queries per send request",
+    ["view"],
+    buckets=[0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1],
+)
+
+IDEMPOTENT_HITS = Counter(
+    "pulse_idempotent_hits_total",
+    "Send requests answered with an existing notification",
+    ["source"],  # "lookup" (before insert) or "insert" (unique constraint)
+)
+
+# =============================================================================
+# Workers
+# =============================================================================
+
+TASK_QUEUE_WAIT = Histogram(
+    "pulse_task_queue_wait_seconds",
+    "Time from publish (or ETA) until a worker starts the task",
+    ["task", "queue"],
+    buckets=[0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900],
+)
+
+TASK_DURATION = Histogram(
+    "pulse_task_duration_seconds",
+    "Task run time by final state",
+    ["task", "state"],
+    buckets=[0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60],
+)
+
+PROVIDER_CALL_DURATION = Histogram(
+    "pulse_provider_call_duration_seconds",
+    "Time spent in the channel provider's send call",
+    ["channel", "outcome"],
+    buckets=[0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30],
+)
+
+NOTIFICATIONS_TOTAL = Counter(
+    "pulse_notifications_total",
+    "Delivery outcomes recorded by workers",
+    ["channel", "status"],
+)
+
+# =============================================================================
+# Exposition
+# =============================================================================
+
+
+def collecting_registry():
+    """The registry to scrape: every process's samples in multiprocess mode."""
+    if os.environ.get(MULTIPROC_DIR_ENV):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def render() -> tuple[bytes, str]:
+    """The current samples in the text exposition format, and its content type."""
+    return generate_latest(collecting_registry()), CONTENT_TYPE_LATEST
+
+
+def clear_multiprocess_dir(keep_pid=None) -> None:
+    """Create the multiprocess directory, removing samples of an earlier run."""
+    directory = os.environ.get(MULTIPROC_DIR_ENV)
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, "*.db")):
+        if keep_pid is None or not path.endswith(f"_{keep_pid}.db"):
+            os.remove(path)
+
+
+# =============================================================================
+# Celery signals
+# =============================================================================
+
+PUBLISHED_AT_HEADER = "published_at"
+
+_task_started = {}  # task id -> monotonic start
+
+
+@before_task_publish.connect
+def _stamp_published_at(headers=None, **kwargs):
+    if headers is not None:
+        headers[PUBLISHED_AT_HEADER] = time.time()
+
+
+@task_prerun.connect
+def _observe_queue_wait(task_id=None, task=None, **kwargs):
+    _task_started[task_id] = time.monotonic()
+    request = task.request
+    published_at = getattr(request, PUBLISHED_AT_HEADER, None)
+    if published_at is None or request.is_eager:
+        return
+    due = published_at
+    eta = request.eta
+    if eta:
+        if isinstance(eta, str):
+            eta = datetime.fromisoformat(eta)
+        due = max(due, eta.timestamp())
+    queue = (request.delivery_info or {}).get("routing_key") or "celery"
+    TASK_QUEUE_WAIT.labels(task=task.name, queue=queue).observe(max(0.0, time.time() - due))
+
+
+@task_postrun.connect
+def _observe_task_duration(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        TASK_DURATION.labels(task=task.name, state=state or "UNKNOWN").observe(
+            time.monotonic() - started
+        )
+
+
+@worker_init.connect
+def _start_worker_exporter(**kwargs):
+    from django.conf import settings
+
+    # Runs in the worker's main process, before the pool forks
+    clear_multiprocess_dir(keep_pid=os.getpid())
+    if settings.WORKER_METRICS_PORT:
+        start_http_server(settings.WORKER_METRICS_PORT, registry=collecting_registry())
+
+
+@worker_process_shutdown.connect
+def _mark_process_dead(**kwargs):
+    if os.environ.get(MULTIPROC_DIR_ENV):
+        multiprocess.mark_process_dead(os.getpid())
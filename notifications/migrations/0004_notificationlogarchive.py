@@ -0,0 +1,33 @@
+# Generated by Django 5.1.1 on 2026-10-17 06:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0003_notificationoutbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationLogArchive',
+            fields=[
+                ('id', models.UUIDField(primary_key=True, serialize=False)),
+                ('user_id', models.CharField(max_length=100)),
+                ('template_id', models.UUIDField()),
+                ('channel', models.CharField(max_length=20)),
+                ('to', models.CharField(max_length=255)),
+                ('idempotency_key', models.CharField(blank=True, max_length=255, null=True)),
+                ('status', models.CharField(max_length=20)),
+                ('attempts', models.PositiveIntegerField()),
+                ('max_retries', models.PositiveIntegerField()),
+                ('last_attempt_at', models.DateTimeField(blank=True, null=True)),
+                ('next_retry_at', models.DateTimeField(blank=True, null=True)),
+                ('error_message', models.TextField(blank=True, null=True)),
+                ('provider_config', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField()),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.1 on 2026-10-17 06:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0004_notificationlogarchive'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notificationlog',
+            index=models.Index(fields=['sent_at', 'id'], name='notificatio_sent_at_ef1bab_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.1 on 2026-10-17 06:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0005_notificationlog_sent_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationHourlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('channel', models.CharField(max_length=20)),
+                ('status', models.CharField(max_length=20)),
+                ('count', models.PositiveIntegerField()),
+                ('attempts_sum', models.PositiveBigIntegerField()),
+                ('max_attempts', models.PositiveIntegerField()),
+                ('latency_p50', models.FloatField(blank=True, null=True)),
+                ('latency_p95', models.FloatField(blank=True, null=True)),
+                ('latency_p99', models.FloatField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='notificationlog',
+            index=models.Index(fields=['created_at'], name='notificatio_created_01830a_idx'),
+        ),
+        migrations.AddField(
+            model_name='notificationhourlyrollup',
+            name='template',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='notifications.notificationtemplate'),
+        ),
+        migrations.AddConstraint(
+            model_name='notificationhourlyrollup',
+            constraint=models.UniqueConstraint(fields=('hour', 'channel', 'status', 'template'), name='unique_hourly_rollup'),
+        ),
+    ]
@@ -1,9 +1,13 @@
 import uuid
 from datetime import timedelta
 
-from django.db import models, transaction
+from django.conf import settings
+from django.db import connection, models, transaction
 from django.db.models import F, Q
 from django.utils import timezone
+from django.utils.functional import cached_property
+
+from .rendering import CompiledTemplate
 
 
 class NotificationTemplate(models.Model):
@@ -25,6 +29,11 @@ class NotificationTemplate(models.Model):
     def __str__(self) -> str:
         return f"{self.name} ({self.channel})"
 
+    @cached_property
+    def renderer(self) -> CompiledTemplate:
+        """Body template compiled once per loaded instance."""
+        return CompiledTemplate(self.body_template)
+
 
 class NotificationLog(models.Model):
     STATUS_CHOICES = [
@@ -33,6 +42,8 @@ class NotificationLog(models.Model):
         ("failed", "Failed"),
         ("retrying", "Retrying"),
     ]
+    # Delivery never moves a log out of these
+    TERMINAL_STATUSES = ("sent", "failed")
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user_id = models.CharField(max_length=100)
@@ -57,6 +68,8 @@ class NotificationLog(models.Model):
             models.Index(fields=["idempotency_key"]),  # Fast lookup
             models.Index(fields=["status", "next_retry_at"]),  # Queue scanning
             models.Index(fields=["user_id", "created_at"]),  # User history
+            models.Index(fields=["sent_at", "id"]),  # Exporter high-water mark
+            models.Index(fields=["created_at"]),  # Hourly rollups
         ]
         constraints = [
             models.UniqueConstraint(
@@ -96,19 +109,85 @@ class NotificationLog(models.Model):
     @classmethod
     def create_if_not_exists(cls, **kwargs):
         """Atomic create with idempotency check."""
+        obj, _ = cls.create_idempotent(**kwargs)
+        return obj
+
+    @classmethod
+    def create_idempotent(cls, **kwargs):
+        """Like ``create_if_not_exists`` but also reports whether a row was created."""
+        if (
+            kwargs.get("idempotency_key")
+            and connection.vendor == "postgresql"
+            # Partitioned logs have no unique index for ON CONFLICT to use;
+            # their claim trigger raises IntegrityError, as get_or_create expects
+            and not settings.NOTIFICATION_LOG_PARTITIONS
+        ):
+            return cls._insert_on_conflict(**kwargs)
+
         with transaction.atomic():
             idempotency_key = kwargs.get("idempotency_key")
             if idempotency_key:
-                existing, created = cls.objects.get_or_create(
+                return cls.objects.get_or_create(
                     idempotency_key=idempotency_key, defaults=kwargs
                 )
-                if not created:
-                    return existing  # Already processed
-                return existing
             else:
                 obj = cls(**kwargs)
                 obj.save()
-                return obj
+                return obj, True
+
+    @classmethod
+    def _insert_on_conflict(cls, **kwargs):
+        """
+        Idempotent insert in a single statement (PostgreSQL).
+
+        ``INSERT ... ON CONFLICT DO NOTHING RETURNING`` replaces the savepoint,
+        SELECT, INSERT and possible second SELECT of ``get_or_create``; the
+        existing row is only fetched when the key was already taken. A
+        conflicting insert does not abort the surrounding transaction.
+        """
+        obj = cls(**kwargs)
+        fields = cls._meta.concrete_fields
+        values = [
+            field.get_db_prep_save(field.pre_save(obj, add=True), connection)
+            for field in fields
+        ]
+        quote = connection.ops.quote_name
+        key = quote("idempotency_key")
+        # The conflict target repeats the partial unique constraint's predicate
+        # so PostgreSQL can infer it as the arbiter index.
+        sql = (
+            f"INSERT INTO {quote(cls._meta.db_table)} "
+            f"({', '.join(quote(field.column) for field in fields)}) "
+            f"VALUES ({', '.join(['%s'] * len(fields))}) "
+            f"ON CONFLICT ({key}) WHERE {key} IS NOT NULL DO NOTHING "
+            f"RETURNING {quote(cls._meta.pk.column)}"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, values)
+            inserted = cursor.fetchone()
+
+        if inserted:
+            obj._state.adding = False
+            obj._state.db = connection.alias
+            return obj, True
+        return cls.objects.get(idempotency_key=kwargs["idempotency_key"]), False
+
+    @classmethod
+    def transition(cls, log_id, status, **fields) -> bool:
+        """
+        Move a log that is not yet sent/failed to ``status`` in one UPDATE.
+
+        Unlike ``atomic_update_status`` this issues a single conditional
+        statement and does not reload the row. Returns whether it matched.
+        """
+        if status == "retrying":
+            fields["attempts"] = F("attempts") + 1
+        updated = (
+            cls.objects.filter(id=log_id)
+            .exclude(status__in=cls.TERMINAL_STATUSES)
+            .update(status=status, **fields)
+        )
+        return updated == 1
 
     def atomic_update_status(self, status, **extra):
         """Concurrency-safe update (e.g., for retries)."""
@@ -127,3 +206,88 @@ class NotificationLog(models.Model):
                 self.__class__.objects.filter(id=self.id).update(**update_kwargs)
 
             self.refresh_from_db()  # Reload for latest
+
+        if self.idempotency_key:
+            from . import idempotency
+
+            idempotency.update_status(self.idempotency_key, self.id, self.status)
+
+
+class NotificationOutbox(models.Model):
+    """
+    A delivery task written in the same transaction as its NotificationLog.
+
+    The ``dispatch_outbox`` command publishes and deletes these rows, so the
+    API never waits on the broker and a committed log is never left without
+    its task. ``log_id`` is deliberately not a foreign key: rows live for
+    milliseconds and deleting logs should not have to cascade through here.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    log_id = models.UUIDField()
+    task = models.CharField(max_length=200)
+    args = models.JSONField(default=list)
+    queue = models.CharField(max_length=100)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f"{self.task} \u2192 {self.queue} [{self.log_id}]"
+
+
+class NotificationHourlyRollup(models.Model):
+    """
+    NotificationLog counts per hour of ``created_at``, channel, status and
+    template, maintained by the ``rollup_notification_stats`` task so the
+    dashboard and exporter never scan the log table. Latency percentiles are
+    seconds from creation to sending, over the group's sent logs.
+    """
+
+    hour = models.DateTimeField()
+    channel = models.CharField(max_length=20)
+    status = models.CharField(max_length=20)
+    template = models.ForeignKey(NotificationTemplate, on_delete=models.CASCADE)
+    count = models.PositiveIntegerField()
+    attempts_sum = models.PositiveBigIntegerField()
+    max_attempts = models.PositiveIntegerField()
+    latency_p50 = models.FloatField(null=True, blank=True)
+    latency_p95 = models.FloatField(null=True, blank=True)
+    latency_p99 = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["hour", "channel", "status", "template"],
+                name="unique_hourly_rollup",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.hour:%Y-%m-%d %H:00} {self.channel}/{self.status}: {self.count}"
+
+
+class NotificationLogArchive(models.Model):
+    """
+    NotificationLog rows removed by retention cleanup (``RETENTION_ARCHIVE``
+    set to ``"table"``). The columns mirror NotificationLog so a batch is
+    copied with a single ``INSERT ... SELECT``; ``template_id`` is kept as a
+    plain value so archived rows survive their template.
+    """
+
+    id = models.UUIDField(primary_key=True)
+    user_id = models.CharField(max_length=100)
+    template_id = models.UUIDField()
+    channel = models.CharField(max_length=20)
+    to = models.CharField(max_length=255)
+    idempotency_key = models.CharField(max_length=255, null=True, blank=True)
+    status = models.CharField(max_length=20)
+    attempts = models.PositiveIntegerField()
+    max_retries = models.PositiveIntegerField()
+    last_attempt_at = models.DateTimeField(null=True, blank=True)
+    next_retry_at = models.DateTimeField(null=True, blank=True)
+    error_message = models.TextField(null=True, blank=True)
+    provider_config = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField()
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f"{self.channel} \u2192 {self.to} [{self.status}, archived]"
@@ -0,0 +1,57 @@
+"""
+Transactional outbox for delivery tasks.
+
+With ``NOTIFICATION_OUTBOX_ENABLED`` the send endpoints write each delivery
+task into ``NotificationOutbox`` in the same transaction as its log instead of
+publishing to the broker inline. ``dispatch_outbox`` processes claim rows in
+batches with ``SELECT ... FOR UPDATE SKIP LOCKED`` (so several can run side
+by side), publish them in one pipelined round trip and delete them in the
+same transaction.
+
+Delivery is at least once: if a dispatcher dies between publishing and
+committing, the batch is published again. Workers skip logs that are already
+sent or failed.
+"""
+
+import logging
+
+from celery import current_app
+from django.db import transaction
+
+from .models import NotificationOutbox
+from .publisher import publish_many
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(entries) -> int:
+    """Store ``(log_id, signature)`` pairs; call inside the log's transaction."""
+    rows = [
+        NotificationOutbox(
+            log_id=log_id,
+            task=signature.task,
+            args=list(signature.args),
+            queue=signature.options.get("queue") or "low_priority",
+        )
+        for log_id, signature in entries
+    ]
+    NotificationOutbox.objects.bulk_create(rows, batch_size=500)
+    return len(rows)
+
+
+def dispatch_batch(batch_size: int) -> int:
+    """Publish and delete up to ``batch_size`` outbox rows; return how many."""
+    with transaction.atomic():
+        rows = list(
+            NotificationOutbox.objects.select_for_update(skip_locked=True)
+            .order_by("id")
+            .values_list("id", "task", "args", "queue")[:batch_size]
+        )
+        if not rows:
+            return 0
+        publish_many(
+            current_app.signature(task, args=args, queue=queue)
+            for _, task, args, queue in rows
+        )
+        NotificationOutbox.objects.filter(id__in=[row[0] for row in rows]).delete()
+    return len(rows)
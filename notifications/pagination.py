@@ -0,0 +1,50 @@
+import base64
+import binascii
+import uuid
+from datetime import datetime
+
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded."""
+
+
+def encode_cursor(created_at: datetime, pk) -> str:
+    """Opaque cursor pointing just past the row ``(created_at, pk)``."""
+    raw = f"{created_at.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, uuid.UUID]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, _, pk = base64.urlsafe_b64decode(padded).decode().partition("|")
+        return datetime.fromisoformat(created_at), uuid.UUID(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as exc:
+        raise InvalidCursor("Invalid cursor") from exc
+
+
+def keyset_page(queryset, cursor, limit):
+    """
+    Return ``(rows, next_cursor)`` for one page, newest first.
+
+    Rows are ordered by ``(created_at, id)`` descending and the cursor is the
+    last row's key, so each page is an index range scan (the
+    ``user_id, created_at`` index when filtering by user) that costs the same
+    however deep the client has scrolled. ``queryset`` must be a ``values()``
+    queryset including ``id`` and ``created_at``.
+    """
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        # The redundant lte bound keeps the condition sargable on created_at
+        queryset = queryset.filter(created_at__lte=created_at).filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+        )
+
+    rows = list(queryset.order_by("-created_at", "-id")[: limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+    return rows, next_cursor
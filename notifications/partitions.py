@@ -0,0 +1,287 @@
+"""
+Range partitioning of NotificationLog by ``created_at`` (PostgreSQL 13+).
+
+Opt-in with ``NOTIFICATION_LOG_PARTITIONS`` set to ``"day"`` or ``"month"``
+and a one-off ``python manage.py partition_notification_logs``, which swaps
+the table for a partitioned copy in one transaction (it rewrites every row,
+so run it in a maintenance window). From then on:
+
+- ``ensure_log_partitions`` (Celery Beat, hourly) creates partitions
+  ``NOTIFICATION_LOG_PARTITIONS_AHEAD`` periods ahead; a default partition
+  catches anything outside them so inserts never fail.
+- Retention drops whole partitions once they are entirely older than the
+  cutoff, instead of deleting rows (every status, not only sent/failed).
+- Queries bounded on ``created_at`` (dashboard windows, list cursors) only
+  scan the partitions that can match.
+
+A partitioned table cannot have a unique index without the partition key, so
+idempotency keys are claimed in the unpartitioned ``IDEMPOTENCY_CLAIMS``
+table by a BEFORE INSERT trigger; a duplicate key still raises a unique
+violation (``IntegrityError``). An AFTER DELETE trigger releases the claim of
+every deleted row (template cascades, admin deletes), and claims of dropped
+partitions expire with retention. The primary key becomes ``(id, created_at)``,
+which means a lookup by id alone probes every partition's index: prefer
+monthly partitions unless daily volume needs daily ones.
+"""
+
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import connection, transaction
+
+from .models import NotificationLog
+
+logger = logging.getLogger("notifications.tasks.partitions")
+
+INTERVALS = ("day", "month")
+
+IDEMPOTENCY_CLAIMS = "notifications_idempotencyclaim"
+
+CLAIM_FUNCTION = "notifications_claim_idempotency_key"
+
+CLAIM_TRIGGER_SQL = f"""
+CREATE OR REPLACE FUNCTION {CLAIM_FUNCTION}() RETURNS trigger AS $$
+BEGIN
+    IF NEW.idempotency_key IS NOT NULL THEN
+        INSERT INTO {IDEMPOTENCY_CLAIMS} (idempotency_key, created_at)
+        VALUES (NEW.idempotency_key, NEW.created_at);
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+"""
+
+RELEASE_FUNCTION = "notifications_release_idempotency_key"
+
+RELEASE_TRIGGER_SQL = f"""
+CREATE OR REPLACE FUNCTION {RELEASE_FUNCTION}() RETURNS trigger AS $$
+BEGIN
+    IF OLD.idempotency_key IS NOT NULL THEN
+        DELETE FROM {IDEMPOTENCY_CLAIMS} WHERE idempotency_key = OLD.idempotency_key;
+    END IF;
+    RETURN OLD;
+END
+$$ LANGUAGE plpgsql
+"""
+
+# Rows removed per statement when expiring idempotency claims
+CLAIM_DELETE_BATCH = 10000
+
+
+def _table():
+    return NotificationLog._meta.db_table
+
+
+def _quote(name):
+    return connection.ops.quote_name(name)
+
+
+def period_start(moment: datetime, interval: str) -> datetime:
+    moment = moment.astimezone(dt_timezone.utc)
+    if interval == "month":
+        return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_period(start: datetime, interval: str) -> datetime:
+    if interval == "month":
+        return (start + timedelta(days=32)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+def partition_name(start: datetime, interval: str) -> str:
+    suffix = f"{start:%Y%m}" if interval == "month" else f"{start:%Y%m%d}"
+    return f"{_table()}_p{suffix}"
+
+
+def is_partitioned() -> bool:
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)",
+            [_table()],
+        )
+        return cursor.fetchone() is not None
+
+
+def ensure_partitions(interval: str, ahead: int, since: datetime = None) -> list:
+    """Create missing partitions from ``since`` (default now) through ``ahead`` periods."""
+    now = datetime.now(dt_timezone.utc)
+    start = period_start(since or now, interval)
+    last = period_start(now, interval)
+    for _ in range(ahead):
+        last = next_period(last, interval)
+
+    created = []
+    with connection.cursor() as cursor:
+        while start <= last:
+            end = next_period(start, interval)
+            name = partition_name(start, interval)
+            cursor.execute("SELECT to_regclass(%s)", [name])
+            if cursor.fetchone()[0] is None:
+                cursor.execute(
+                    f"CREATE TABLE {_quote(name)} PARTITION OF {_quote(_table())} "
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                )
+                created.append(name)
+            start = end
+    return created
+
+
+def partitions(interval: str) -> list:
+    """``(name, start, end)`` of the table's range partitions, oldest first."""
+    prefix = f"{_table()}_p"
+    fmt = "%Y%m" if interval == "month" else "%Y%m%d"
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(%s)",
+            [_table()],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    found = []
+    for name in names:
+        if not name.startswith(prefix):
+            continue  # the default partition
+        try:
+            start = datetime.strptime(name[len(prefix):], fmt).replace(tzinfo=dt_timezone.utc)
+        except ValueError:
+            continue
+        found.append((name, start, next_period(start, interval)))
+    return sorted(found, key=lambda partition: partition[1])
+
+
+def drop_expired(cutoff: datetime, interval: str, archive=None) -> tuple:
+    """
+    Drop partitions that end at or before ``cutoff``; return ``(rows, names)``.
+
+    ``archive``, if given, is called with ``created_at`` filters to copy each
+    partition's rows first. Idempotency claims expire up to the end of the
+    last dropped partition; the partition straddling ``cutoff`` keeps its rows
+    and therefore their claims.
+    """
+    rows, dropped, dropped_until = 0, [], None
+    for name, start, end in partitions(interval):
+        if end > cutoff:
+            break
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT count(*) FROM {_quote(name)}")
+                count = cursor.fetchone()[0]
+                if archive and count:
+                    archive(created_at__gte=start, created_at__lt=end)
+                cursor.execute(f"DROP TABLE {_quote(name)}")
+        logger.info("Dropped partition %s (%s rows)", name, count)
+        rows += count
+        dropped.append(name)
+        dropped_until = end
+
+    if dropped_until is not None:
+        _expire_claims(dropped_until)
+    return rows, dropped
+
+
+def _expire_claims(cutoff):
+    claims = _quote(IDEMPOTENCY_CLAIMS)
+    with connection.cursor() as cursor:
+        while True:
+            cursor.execute(
+                f"DELETE FROM {claims} WHERE idempotency_key IN ("
+                f"SELECT idempotency_key FROM {claims} WHERE created_at < %s LIMIT %s)",
+                [cutoff, CLAIM_DELETE_BATCH],
+            )
+            if cursor.rowcount < CLAIM_DELETE_BATCH:
+                break
+
+
+def convert(interval: str, ahead: int) -> int:
+    """
+    Replace NotificationLog with a partitioned table holding the same rows.
+
+    Secondary indexes and foreign keys are recreated under their existing
+    names so later Django migrations still find them. Returns rows copied.
+    """
+    table = _table()
+    old = f"{table}_unpartitioned"
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Deferred foreign key checks on the old table would block its DROP
+        cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        cursor.execute(
+            "SELECT indexdef FROM pg_indexes WHERE tablename = %s "
+            "AND indexdef NOT LIKE 'CREATE UNIQUE%%'",
+            [table],
+        )
+        indexes = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+            [table],
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(f"SELECT min(created_at) FROM {_quote(table)}")
+        oldest = cursor.fetchone()[0]
+
+        cursor.execute(f"ALTER TABLE {_quote(table)} RENAME TO {_quote(old)}")
+        cursor.execute(
+            f"CREATE TABLE {_quote(table)} (LIKE {_quote(old)} INCLUDING DEFAULTS "
+            f"INCLUDING CONSTRAINTS) PARTITION BY RANGE (created_at)"
+        )
+        cursor.execute(f"ALTER TABLE {_quote(table)} ADD PRIMARY KEY (id, created_at)")
+        cursor.execute(
+            f"CREATE TABLE {_quote(table + '_default')} PARTITION OF {_quote(table)} DEFAULT"
+        )
+        ensure_partitions(interval, ahead, since=oldest)
+
+        cursor.execute(f"INSERT INTO {_quote(table)} SELECT * FROM {_quote(old)}")
+        copied = cursor.rowcount
+        cursor.execute(f"DROP TABLE {_quote(old)}")
+        for definition in indexes:
+            cursor.execute(definition)
+        for name, definition in foreign_keys:
+            cursor.execute(
+                f"ALTER TABLE {_quote(table)} ADD CONSTRAINT {_quote(name)} {definition}"
+            )
+
+        cursor.execute(
+            f"CREATE TABLE {_quote(IDEMPOTENCY_CLAIMS)} ("
+            f"idempotency_key varchar(255) PRIMARY KEY, created_at timestamptz NOT NULL)"
+        )
+        cursor.execute(
+            f"CREATE INDEX {_quote(IDEMPOTENCY_CLAIMS + '_created_at')} "
+            f"ON {_quote(IDEMPOTENCY_CLAIMS)} (created_at)"
+        )
+        cursor.execute(
+            f"INSERT INTO {_quote(IDEMPOTENCY_CLAIMS)} SELECT idempotency_key, created_at "
+            f"FROM {_quote(table)} WHERE idempotency_key IS NOT NULL"
+        )
+        install_claim_triggers()
+    return copied
+
+
+def install_claim_triggers() -> None:
+    """(Re)create the triggers keeping ``IDEMPOTENCY_CLAIMS`` in step with the log."""
+    table = _quote(_table())
+    with transaction.atomic(), connection.cursor() as cursor:
+        for function, timing, sql in (
+            (CLAIM_FUNCTION, "BEFORE INSERT", CLAIM_TRIGGER_SQL),
+            (RELEASE_FUNCTION, "AFTER DELETE", RELEASE_TRIGGER_SQL),
+        ):
+            cursor.execute(sql)
+            cursor.execute(f"DROP TRIGGER IF EXISTS {_quote(function)} ON {table}")
+            cursor.execute(
+                f"CREATE TRIGGER {_quote(function)} {timing} ON {table} "
+                f"FOR EACH ROW EXECUTE FUNCTION {function}()"
+            )
+
+
+def remove_orphaned_claims() -> int:
+    """Delete claims whose log row is gone; return how many."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {_quote(IDEMPOTENCY_CLAIMS)} c WHERE NOT EXISTS ("
+            f"SELECT 1 FROM {_quote(_table())} l WHERE l.idempotency_key = c.idempotency_key)"
+        )
+        return cursor.rowcount
+
@@ -0,0 +1,111 @@
+"""
+Channel providers used by the delivery engine.
+
+A provider only talks to the outside world: it sends one message and returns
+metadata worth keeping on the log (stored in ``provider_config``), or raises
+on failure. Status bookkeeping and retries live in ``delivery``.
+"""
+
+import logging
+import os
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+
+from .smtp_pool import get_smtp_pool
+
+logger = logging.getLogger(__name__)
+
+
+class BaseProvider:
+    name = None
+
+    def send(self, to: str, body: str, **extra) -> dict:
+        """Deliver one message to ``to``; return metadata to store on the log."""
+        raise NotImplementedError
+
+
+class EmailProvider(BaseProvider):
+    name = "smtp"
+
+    def send(self, to, body, subject="", **extra):
+        message = EmailMessage(
+            subject=subject,
+            body=body,
+            from_email=getattr(settings, "DEFAULT_FROM_EMAIL", "pulse@example.com"),
+            to=[to],
+        )
+        # Reuses this worker's open SMTP connections instead of a handshake per message
+        get_smtp_pool().send(message)
+        return {}
+
+
+class SMSProvider(BaseProvider):
+    name = "twilio"
+
+    def __init__(self) -> None:
+        self._client = None
+        self._pid = None
+
+    def send(self, to, body, **extra):
+        message = self.client().messages.create(
+            body=body, from_=settings.TWILIO_PHONE_NUMBER, to=to
+        )
+        # Stored in provider_config for tracking
+        return {"twilio_sid": str(message.sid)}
+
+    def client(self):
+        """
+        The Twilio client of this worker process.
+
+        Built once per process (prefork children rebuild after the fork) on a
+        keep-alive HTTP session, so consecutive messages reuse the TCP/TLS
+        connection instead of opening one each.
+        """
+        if self._client is None or self._pid != os.getpid():
+            self._client = self._build_client()
+            self._pid = os.getpid()
+        return self._client
+
+    @staticmethod
+    def _build_client():
+        from requests.adapters import HTTPAdapter
+        from twilio.http.http_client import TwilioHttpClient
+        from twilio.rest import Client
+
+        http_client = TwilioHttpClient(timeout=settings.TWILIO_TIMEOUT)
+        adapter = HTTPAdapter(pool_maxsize=settings.TWILIO_POOL_SIZE)
+        http_client.session.mount("https://", adapter)
+        http_client.session.mount("http://", adapter)
+
+        client = Client(
+            settings.TWILIO_ACCOUNT_SID,
+            settings.TWILIO_AUTH_TOKEN,
+            http_client=http_client,
+        )
+        if settings.TWILIO_BASE_URL:
+            # e.g. a local stub for load tests
+            client.api.base_url = settings.TWILIO_BASE_URL
+        return client
+
+
+class PushProvider(BaseProvider):
+    name = "fcm"
+
+    def send(self, to, body, title="", **extra):
+        # Dummy for now — prints to logs. Real:
+        # from firebase_admin import messaging
+        # message = messaging.Message(
+        #     notification=messaging.Notification(title=title, body=body),
+        #     token=to,
+        # )
+        # response = messaging.send(message)
+        logger.info("Push sent to %s: %s - %s", to, title, body)
+        return {}
+
+
+PROVIDERS = {
+    "email": EmailProvider(),
+    "sms": SMSProvider(),
+    "push": PushProvider(),
+}
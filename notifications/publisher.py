@@ -0,0 +1,139 @@
+import base64
+import logging
+import uuid
+from typing import Optional
+from urllib.parse import urlparse
+
+import redis
+from celery import current_app
+from celery.signals import after_task_publish, before_task_publish
+from django.conf import settings
+from kombu import serialization
+from kombu.utils.json import dumps
+
+logger = logging.getLogger(__name__)
+
+# Signature options the pipelined path understands; anything else (priority,
+# custom exchanges, headers, ...) is published through apply_async instead.
+PIPELINED_OPTIONS = {"queue", "task_id", "countdown", "eta", "expires"}
+
+_broker_client: Optional[redis.Redis] = None
+
+
+def get_broker_client() -> redis.Redis:
+    """Lazily instantiate a plain Redis client on the Celery broker."""
+    global _broker_client
+    if _broker_client is None:
+        _broker_client = redis.Redis.from_url(settings.CELERY_BROKER_URL)
+    return _broker_client
+
+
+def publish_many(signatures) -> int:
+    """
+    Publish a list of Celery signatures in one round trip.
+
+    With the Redis transport every message is normally its own LPUSH, so
+    publishing N tasks costs N round trips. Here each message is built the
+    way ``apply_async`` builds it (``app.amqp.as_task_v2``, the task's
+    serializer, the ``before_task_publish``/``after_task_publish`` signals)
+    and wrapped in kombu's Redis message envelope, and the LPUSHes go out in
+    one non-transactional pipeline on a connection of our own. That envelope
+    is kombu's wire format, shared by every worker reading the queue, so it
+    does not depend on kombu internals, and nothing is patched on a shared
+    channel. Tasks routed to a direct queue (all of Pulse's) land on the list
+    named after the queue, exactly as Celery publishes them.
+
+    Other brokers, and signatures with options beyond ``PIPELINED_OPTIONS``,
+    are published one by one over a shared producer.
+
+    Results are ignored: nothing in Pulse reads task results, and skipping
+    them avoids a result-backend SUBSCRIBE per message.
+    """
+    signatures = list(signatures)
+    if not signatures:
+        return 0
+
+    app = current_app._get_current_object()
+    redis_broker = _is_plain_redis_broker(app)
+    pipelined, unsupported = [], []
+    for sig in signatures:
+        if redis_broker and set(sig.options) <= PIPELINED_OPTIONS:
+            pipelined.append(sig)
+        else:
+            unsupported.append(sig)
+
+    if pipelined:
+        pipe = get_broker_client().pipeline(transaction=False)
+        published = []
+        for sig in pipelined:
+            queue, message, task_message = _encode(app, sig)
+            pipe.lpush(queue, dumps(message))
+            published.append((sig.task, queue, task_message))
+        pipe.execute()
+        if after_task_publish.receivers:
+            for name, queue, (headers, _, body, _) in published:
+                after_task_publish.send(
+                    sender=name, body=body, headers=headers, exchange="", routing_key=queue
+                )
+
+    if unsupported:
+        with app.producer_or_acquire() as producer:
+            for sig in unsupported:
+                sig.apply_async(producer=producer, ignore_result=True)
+    return len(signatures)
+
+
+def _is_plain_redis_broker(app) -> bool:
+    scheme = urlparse(settings.CELERY_BROKER_URL).scheme
+    options = app.conf.broker_transport_options or {}
+    # A global key prefix changes the list a message goes to
+    return scheme in ("redis", "rediss") and not options.get("global_keyprefix")
+
+
+def _encode(app, sig):
+    """Build ``sig``'s message in kombu's Redis envelope; return its queue too."""
+    options = sig.options
+    queue = options.get("queue") or app.conf.task_default_queue
+    task_message = app.amqp.as_task_v2(
+        options.get("task_id") or str(uuid.uuid4()),
+        sig.task,
+        args=sig.args,
+        kwargs=sig.kwargs,
+        countdown=options.get("countdown"),
+        eta=options.get("eta"),
+        expires=options.get("expires"),
+        ignore_result=True,
+    )
+    headers, properties, body, _ = task_message
+    if before_task_publish.receivers:
+        before_task_publish.send(
+            sender=sig.task,
+            body=body,
+            exchange="",
+            routing_key=queue,
+            declare=[],
+            headers=headers,
+            properties=properties,
+            retry_policy=None,
+        )
+
+    content_type, content_encoding, payload = serialization.dumps(
+        body, serializer=app.conf.task_serializer
+    )
+    if isinstance(payload, str):
+        payload = payload.encode(content_encoding or "utf-8")
+    message = {
+        "body": base64.b64encode(payload).decode(),
+        "content-encoding": content_encoding,
+        "content-type": content_type,
+        "headers": headers,
+        "properties": {
+            **properties,
+            "delivery_mode": 2,  # persistent, kombu's default
+            "delivery_info": {"exchange": "", "routing_key": queue},
+            "priority": 0,
+            "body_encoding": "base64",
+            "delivery_tag": str(uuid.uuid4()),
+        },
+    }
+    return queue, message, task_message
@@ -1,67 +1,431 @@
+import logging
+import math
+import threading
 import time
-from typing import Optional
+from string import Formatter
+from typing import NamedTuple, Optional
 
 import redis
 from django.conf import settings
 
+from .metrics import RATE_LIMIT_FALLBACK_ACTIVE, RATE_LIMIT_FALLBACK_DECISIONS
+
+logger = logging.getLogger(__name__)
 
 _redis_client: Optional[redis.Redis] = None
 
 
 def get_redis_client() -> redis.Redis:
     """
-    Lazily instantiate a Redis client.
+    Lazily instantiate the rate limiter's Redis client.
 
-    We intentionally re-use the Celery broker URL so the rate limiter
-    works out-of-the-box in local/docker environments.
+    ``RATE_LIMIT_REDIS_URL`` can point at a Redis separate from the Celery
+    broker so rate limit traffic does not compete with task traffic (it
+    defaults to the broker URL so local/docker setups work out-of-the-box).
+    The pool is bounded and blocking, and every socket operation has a short
+    timeout: a slow Redis turns into a fast error, which the limiter answers
+    from its in-process fallback instead of stalling the request.
     """
     global _redis_client
     if _redis_client is None:
-        _redis_client = redis.from_url(getattr(settings, "CELERY_BROKER_URL"))
+        pool = redis.BlockingConnectionPool.from_url(
+            settings.RATE_LIMIT_REDIS_URL,
+            max_connections=settings.RATE_LIMIT_REDIS_MAX_CONNECTIONS,
+            timeout=settings.RATE_LIMIT_REDIS_TIMEOUT,
+            socket_timeout=settings.RATE_LIMIT_REDIS_TIMEOUT,
+            socket_connect_timeout=settings.RATE_LIMIT_REDIS_TIMEOUT,
+            socket_keepalive=True,
+            health_check_interval=settings.RATE_LIMIT_REDIS_HEALTH_CHECK_INTERVAL,
+        )
+        _redis_client = redis.Redis(connection_pool=pool)
     return _redis_client
 
 
+ALGORITHMS = ("fixed_window", "sliding_log", "gcra")
+ALGORITHM_ALIASES = {"token_bucket": "gcra"}
+
+# Evaluates any number of limits atomically on the server. Every limit is
+# checked first and, only if all of them allow the request, every limit is
+# charged; a rejected request therefore costs no tier any quota. Time comes
+# from Redis itself, so API servers with skewed clocks still agree on window
+# boundaries.
+#
+# KEYS     one key per limit
+# ARGV     algorithm, max requests, window (ms) for each key, in order
+# Returns  {allowed (0/1), remaining_1, retry_after_ms_1, remaining_2, ...}
+RATE_LIMIT_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+-- Each check returns ok, remaining after this request, retry after (ms)
+-- and whatever state the matching charge needs.
+local check = {}
+local charge = {}
+
+-- Counter expiring at the end of the current aligned window.
+check.fixed_window = function(key, limit, window)
+    local count = tonumber(redis.call('GET', key) or '0')
+    local window_end = (math.floor(now / window) + 1) * window
+    return count < limit, limit - count - 1, window_end - now, window_end
+end
+charge.fixed_window = function(key, limit, window, window_end)
+    if redis.call('INCR', key) == 1 then
+        redis.call('PEXPIREAT', key, window_end)
+    end
+end
+
+-- Sorted set of request timestamps inside the trailing window.
+check.sliding_log = function(key, limit, window)
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+    local count = redis.call('ZCARD', key)
+    local retry = 0
+    if count >= limit then
+        local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+        retry = tonumber(oldest[2]) + window - now
+    end
+    return count < limit, limit - count - 1, retry, count
+end
+charge.sliding_log = function(key, limit, window, count)
+    redis.call('ZADD', key, now, time[1] .. time[2] .. ':' .. count)
+    redis.call('PEXPIRE', key, window)
+end
+
+-- Generic cell rate algorithm: a token bucket of size `limit` refilled at
+-- limit/window, stored as a single theoretical arrival time.
+check.gcra = function(key, limit, window)
+    local interval = window / limit
+    local tat = tonumber(redis.call('GET', key) or now)
+    if tat < now then
+        tat = now
+    end
+    local new_tat = tat + interval
+    local headroom = now - (new_tat - window)
+    if headroom < 0 then
+        return false, -1, math.ceil(-headroom), new_tat
+    end
+    return true, math.floor(headroom / interval), 0, new_tat
+end
+charge.gcra = function(key, limit, window, new_tat)
+    redis.call('SET', key, string.format('%.3f', new_tat), 'PX', math.ceil(new_tat - now))
+end
+
+local allowed = 1
+local reply = {0}
+local states = {}
+for i, key in ipairs(KEYS) do
+    local algorithm = ARGV[i * 3 - 2]
+    if not check[algorithm] then
+        return redis.error_reply('unknown rate limit algorithm: ' .. algorithm)
+    end
+    local ok, remaining, retry, state = check[algorithm](
+        key, tonumber(ARGV[i * 3 - 1]), tonumber(ARGV[i * 3])
+    )
+    if not ok then
+        allowed = 0
+    else
+        retry = 0
+    end
+    states[i] = state
+    table.insert(reply, remaining)
+    table.insert(reply, retry)
+end
+
+if allowed == 1 then
+    for i, key in ipairs(KEYS) do
+        local algorithm = ARGV[i * 3 - 2]
+        charge[algorithm](key, tonumber(ARGV[i * 3 - 1]), tonumber(ARGV[i * 3]), states[i])
+    end
+end
+reply[1] = allowed
+return reply
+"""
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    limit: int
+    remaining: int
+    retry_after: float  # seconds; 0 when allowed
+    tier: Optional[str] = None  # the limiting tier, for tiered checks
+
+    @property
+    def retry_after_header(self) -> str:
+        """Value for the HTTP ``Retry-After`` header (whole seconds)."""
+        return str(max(1, math.ceil(self.retry_after)))
+
+
 class RateLimiter:
     """
-    Simple fixed-window rate limiter backed by Redis.
+    Redis rate limiter evaluated in a single round trip.
 
     The key should identify the caller and channel, e.g. "user_123:email".
+
+    Supported algorithms:
+
+    - ``fixed_window``: counter per aligned window (cheapest, allows bursts
+      of up to 2x at window boundaries).
+    - ``sliding_log``: exact trailing window backed by a sorted set (memory
+      grows with ``max_requests``).
+    - ``gcra`` (alias ``token_bucket``): smooth rate with bursts of up to
+      ``max_requests``, stored as one timestamp per key.
     """
 
-    def __init__(self, max_requests: int = 10, window: int = 60) -> None:
+    def __init__(
+        self, max_requests: int = 10, window: int = 60, algorithm: str = "fixed_window"
+    ) -> None:
+        algorithm = ALGORITHM_ALIASES.get(algorithm, algorithm)
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown rate limit algorithm: {algorithm}")
         self.max_requests = max_requests
         self.window = window
+        self.algorithm = algorithm
+
+    def redis_key(self, key: str) -> str:
+        return f"rate_limit:{self.algorithm}:{key}"
+
+    def check(self, key: str) -> RateLimitResult:
+        """Charge one request to ``key`` if it is under the limit."""
+        return _evaluate([(self.redis_key(key), None, self)])
 
     def is_allowed(self, key: str) -> bool:
         """
         Returns True if the call is allowed, False if the caller
         is over the limit for the current window.
         """
-        client = get_redis_client()
-        window_key = f"rate_limit:{key}:window"
-        count_key = f"rate_limit:{key}:count"
-
-        now = int(time.time())
-        current_window = now // self.window
-
-        # Ensure the window marker is set and has an expiry
-        existing_window = client.get(window_key)
-        if existing_window is None or int(existing_window) != current_window:
-            # New window: reset counter and window marker
-            pipe = client.pipeline()
-            pipe.set(window_key, current_window, ex=self.window)
-            pipe.set(count_key, 1, ex=self.window)
-            pipe.execute()
-            return True
-
-        # Same window: increment count atomically
-        current_count = client.incr(count_key)
-        # Make sure count key has an expiration aligned with window
-        if current_count == 1:
-            client.expire(count_key, self.window)
-
-        if current_count > self.max_requests:
-            return False
-        return True
+        return self.check(key).allowed
+
+
+class TieredRateLimiter:
+    """
+    Several named limits checked and charged together in one round trip.
+
+    Each tier is ``(name, key_template, limiter)``. The key template is
+    formatted with the scope passed to :meth:`check` (e.g.
+    ``"user:{user_id}:{channel}"``); tiers whose template needs a value the
+    scope does not provide are skipped. A request is admitted only if every
+    applicable tier allows it, and a rejected request charges no tier.
+    """
+
+    def __init__(self, tiers) -> None:
+        self.tiers = []
+        for name, key_template, limiter in tiers:
+            fields = {
+                field for _, field, _, _ in Formatter().parse(key_template) if field
+            }
+            self.tiers.append((name, key_template, fields, limiter))
+
+    @classmethod
+    def from_settings(cls, config=None) -> "TieredRateLimiter":
+        """Build the tiers from ``settings.RATE_LIMITS``."""
+        config = settings.RATE_LIMITS if config is None else config
+        return cls(
+            (
+                tier["name"],
+                tier["key"],
+                RateLimiter(
+                    max_requests=tier["max_requests"],
+                    window=tier["window"],
+                    algorithm=tier.get("algorithm", "fixed_window"),
+                ),
+            )
+            for tier in config
+        )
+
+    def check(self, **scope) -> RateLimitResult:
+        return self.check_many([scope])[0]
+
+    def check_many(self, scopes) -> list[RateLimitResult]:
+        """
+        Check and charge one request per scope, in order, in one round trip.
+
+        Each scope is evaluated atomically on its own, exactly as if
+        :meth:`check` were called for it, so items of a batch sharing a tier
+        use up its quota one by one and the rest are rejected.
+        """
+        results = [None] * len(scopes)
+        calls = []
+        for index, scope in enumerate(scopes):
+            entries = self._entries(scope)
+            if entries:
+                calls.append((index, entries))
+            else:
+                results[index] = RateLimitResult(
+                    allowed=True, limit=0, remaining=0, retry_after=0
+                )
+        for (index, _), result in zip(calls, _evaluate_many([e for _, e in calls])):
+            results[index] = result
+        return results
+
+    def _entries(self, scope):
+        entries = []
+        for name, key_template, fields, limiter in self.tiers:
+            if all(scope.get(field) for field in fields):
+                key = key_template.format(**scope)
+                entries.append((limiter.redis_key(f"{name}:{key}"), name, limiter))
+        return entries
+
+
+class LocalRateLimiter:
+    """
+    Approximate in-process limiter used while Redis is unreachable.
+
+    Every process enforces ``1/processes`` of each limit with a fixed window
+    of its own, so the fleet as a whole stays near the configured quota
+    without any shared state. It fails open: requests are never rejected
+    because Redis is down, only because the local share is used up.
+    """
+
+    MAX_KEYS = 10_000
+
+    def __init__(self, processes: int = 1, retry_interval: float = 5.0) -> None:
+        self.processes = max(1, processes)
+        self.retry_interval = retry_interval
+        self.active = False
+        self._failed_at = 0.0
+        self._counters: dict[str, tuple[int, int]] = {}
+        self._lock = threading.Lock()
+
+    def activate(self, exc: Exception) -> None:
+        self._failed_at = time.monotonic()
+        if not self.active:
+            logger.warning("Rate limit Redis unavailable (%s); using local fallback", exc)
+            self.active = True
+            RATE_LIMIT_FALLBACK_ACTIVE.set(1)
+
+    def deactivate(self) -> None:
+        if self.active:
+            logger.info("Rate limit Redis recovered; leaving local fallback")
+            self.active = False
+            self._counters.clear()
+            RATE_LIMIT_FALLBACK_ACTIVE.set(0)
+
+    def should_bypass_redis(self) -> bool:
+        """True while Redis recently failed, so requests skip its timeouts."""
+        return self.active and time.monotonic() - self._failed_at < self.retry_interval
+
+    def evaluate(self, entries) -> RateLimitResult:
+        now = time.time()
+        tiers = []
+        with self._lock:
+            if len(self._counters) > self.MAX_KEYS:
+                self._counters.clear()
+            for key, name, limiter in entries:
+                limit = max(1, math.ceil(limiter.max_requests / self.processes))
+                window_index = int(now // limiter.window)
+                counted_index, count = self._counters.get(key, (window_index, 0))
+                if counted_index != window_index:
+                    count = 0
+                retry_after = (window_index + 1) * limiter.window - now
+                tiers.append((key, name, limit, window_index, count, retry_after))
+
+            allowed = all(count < limit for _, _, limit, _, count, _ in tiers)
+            if allowed:
+                for key, _, _, window_index, count, _ in tiers:
+                    self._counters[key] = (window_index, count + 1)
+
+        RATE_LIMIT_FALLBACK_DECISIONS.labels(allowed=str(allowed).lower()).inc()
+        if allowed:
+            _, name, limit, _, count, _ = min(tiers, key=lambda t: t[2] - t[4])
+            return RateLimitResult(True, limit, limit - count - 1, 0, tier=name)
+        _, name, limit, _, _, retry_after = max(
+            (t for t in tiers if t[4] >= t[2]), key=lambda t: t[5]
+        )
+        return RateLimitResult(False, limit, 0, retry_after, tier=name)
+
+
+local_limiter = LocalRateLimiter(
+    processes=settings.RATE_LIMIT_LOCAL_PROCESSES,
+    retry_interval=settings.RATE_LIMIT_FALLBACK_RETRY_INTERVAL,
+)
+
+
+def _evaluate(entries) -> RateLimitResult:
+    """Run the rate limit script for ``(redis_key, tier, limiter)`` entries."""
+    return _evaluate_many([entries])[0]
+
+
+def _evaluate_many(calls) -> list[RateLimitResult]:
+    """Run the rate limit script once per list of entries, pipelined."""
+    if not calls:
+        return []
+    if local_limiter.should_bypass_redis():
+        return [local_limiter.evaluate(entries) for entries in calls]
+
+    try:
+        if len(calls) == 1:
+            replies = [_script()(keys=_keys(calls[0]), args=_args(calls[0]))]
+        else:
+            replies = _execute_pipelined(calls)
+    except (redis.ConnectionError, redis.TimeoutError) as exc:
+        local_limiter.activate(exc)
+        return [local_limiter.evaluate(entries) for entries in calls]
+    local_limiter.deactivate()
+    return [_result(reply, entries) for reply, entries in zip(replies, calls)]
+
+
+def _execute_pipelined(calls) -> list:
+    """
+    EVALSHA the script once per call in one round trip.
+
+    A ``Script`` used on a pipeline checks SCRIPT EXISTS before every
+    execute, so the calls are queued as plain EVALSHAs instead and the script
+    is loaded only when Redis answers NOSCRIPT (after a restart or a SCRIPT
+    FLUSH). The script then fails on every call alike, so nothing has been
+    charged and the whole batch is retried.
+    """
+    client = get_redis_client()
+    sha = _script().sha
+    for attempt in range(2):
+        pipe = client.pipeline(transaction=False)
+        for entries in calls:
+            keys = _keys(entries)
+            pipe.evalsha(sha, len(keys), *keys, *_args(entries))
+        try:
+            return pipe.execute()
+        except redis.exceptions.NoScriptError:
+            if attempt:
+                raise
+            client.script_load(RATE_LIMIT_SCRIPT)
+
+
+def _keys(entries) -> list:
+    return [key for key, _, _ in entries]
+
+
+def _args(entries) -> list:
+    args = []
+    for _, _, limiter in entries:
+        args.extend([limiter.algorithm, limiter.max_requests, limiter.window * 1000])
+    return args
+
+
+def _result(reply, entries) -> RateLimitResult:
+    allowed = bool(reply[0])
+    tiers = [
+        (int(reply[i * 2 + 1]), int(reply[i * 2 + 2]), name, limiter)
+        for i, (_, name, limiter) in enumerate(entries)
+    ]
+    if allowed:
+        # Report the tier closest to its limit
+        remaining, retry_ms, name, limiter = min(tiers, key=lambda t: t[0])
+    else:
+        # Report the tier that stays closed the longest
+        remaining, retry_ms, name, limiter = max(tiers, key=lambda t: t[1])
+    return RateLimitResult(
+        allowed=allowed,
+        limit=limiter.max_requests,
+        remaining=max(0, remaining),
+        retry_after=retry_ms / 1000,
+        tier=name,
+    )
+
+
+_rate_limit_script = None
 
 
+def _script():
+    global _rate_limit_script
+    if _rate_limit_script is None:
+        # Runs via EVALSHA, falling back to EVAL once if the script is unknown
+        _rate_limit_script = get_redis_client().register_script(RATE_LIMIT_SCRIPT)
+    return _rate_limit_script
@@ -0,0 +1,54 @@
+"""
+Redis clients for data other than rate limits, split by how much it matters.
+
+The rate limiter's client (``rate_limiter.get_redis_client``) is tuned for a
+hot path that must never stall: a bounded pool and quarter-second timeouts,
+with errors answered from an in-process fallback. The rest of Pulse keeps two
+kinds of data in Redis and gets a client for each:
+
+- ``get_cache_client`` for data that is only an optimisation and can be lost
+  or skipped when Redis is slow: idempotency reservations (the database
+  constraint stays authoritative), template cache versions and live counters.
+  Timeouts are short and callers fail open.
+- ``get_state_client`` for progress that jobs resume from: the retention and
+  rollup watermarks and the daily digest's lease, checkpoint and in-flight
+  count. It uses ordinary timeouts and should point at a durable Redis
+  (persistence on, no eviction); callers treat an error as "try again later",
+  never as "no state".
+"""
+
+from typing import Optional
+
+import redis
+from django.conf import settings
+
+_cache_client: Optional[redis.Redis] = None
+_state_client: Optional[redis.Redis] = None
+
+
+def get_cache_client() -> redis.Redis:
+    """Lazily instantiate the client of the Redis holding disposable data."""
+    global _cache_client
+    if _cache_client is None:
+        _cache_client = redis.Redis.from_url(
+            settings.CACHE_REDIS_URL,
+            socket_timeout=settings.CACHE_REDIS_TIMEOUT,
+            socket_connect_timeout=settings.CACHE_REDIS_TIMEOUT,
+            socket_keepalive=True,
+            health_check_interval=30,
+        )
+    return _cache_client
+
+
+def get_state_client() -> redis.Redis:
+    """Lazily instantiate the client of the Redis holding job progress."""
+    global _state_client
+    if _state_client is None:
+        _state_client = redis.Redis.from_url(
+            settings.STATE_REDIS_URL,
+            socket_timeout=5,
+            socket_connect_timeout=5,
+            socket_keepalive=True,
+            health_check_interval=30,
+        )
+    return _state_client
@@ -0,0 +1,91 @@
+import re
+from string import Formatter
+
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+class TemplateRenderError(ValueError):
+    """Raised when a template cannot be rendered with the given context."""
+
+
+class MissingVariablesError(TemplateRenderError):
+    """Raised when the context lacks one or more template variables."""
+
+    def __init__(self, missing) -> None:
+        self.missing = sorted(missing)
+        label = "variable" if len(self.missing) == 1 else "variables"
+        names = ", ".join(repr(name) for name in self.missing)
+        super().__init__(f"missing template {label}: {names}")
+
+
+class CompiledTemplate:
+    """
+    A ``str.format``-style template parsed once and rendered many times.
+
+    ``str.format`` re-parses the format string on every call. Here the
+    template is split into literal chunks and placeholder slots up front, so
+    rendering is a list copy, one dict lookup per placeholder and a join.
+    Templates using format specs, conversions or attribute/index access
+    (``{amount:.2f}``, ``{name!r}``, ``{user.name}``) keep the same
+    semantics by falling back to ``str.format_map``.
+    """
+
+    __slots__ = ("source", "variables", "_chunks", "_slots", "_fast", "_error")
+
+    def __init__(self, source: str) -> None:
+        self.source = source
+        self._chunks = []
+        self._slots = []
+        self._fast = True
+        self._error = None
+        variables = set()
+
+        try:
+            parsed = list(Formatter().parse(source))
+        except ValueError as exc:
+            parsed = []
+            self._error = str(exc)
+
+        for literal, field, spec, conversion in parsed:
+            if literal:
+                self._chunks.append(literal)
+            if field is None:
+                continue
+            if _IDENTIFIER.match(field) and not spec and not conversion:
+                self._slots.append((len(self._chunks), field))
+                self._chunks.append("")
+                variables.add(field)
+                continue
+
+            # Compound fields: only the leading name has to be in the context
+            self._fast = False
+            root = re.split(r"[.\[]", field, maxsplit=1)[0]
+            if root and not root.isdigit():
+                variables.add(root)
+
+        self.variables = frozenset(variables)
+
+    def render(self, context) -> str:
+        """Render with ``context``; all missing variables are reported at once."""
+        if self._error:
+            raise TemplateRenderError(f"invalid template: {self._error}")
+        if not self._fast:
+            missing = self.variables.difference(context)
+            if missing:
+                raise MissingVariablesError(missing)
+            try:
+                return self.source.format_map(context)
+            except (IndexError, KeyError, AttributeError, ValueError) as exc:
+                raise TemplateRenderError(f"invalid template: {exc}") from exc
+
+        chunks = self._chunks.copy()
+        try:
+            for index, name in self._slots:
+                value = context[name]
+                chunks[index] = value if type(value) is str else format(value)
+        except KeyError:
+            raise MissingVariablesError(self.variables.difference(context)) from None
+        return "".join(chunks)
+
+    def __repr__(self) -> str:
+        return f"<CompiledTemplate variables={sorted(self.variables)}>"
@@ -0,0 +1,180 @@
+"""
+Retention cleanup of old notification logs.
+
+Sent and failed logs older than the cutoff are deleted in batches of
+``batch_size`` primary keys, each batch in its own short transaction with a
+pause in between, so locks are held for milliseconds and WAL is written at a
+pace replicas and vacuum can keep up with. Before a batch is deleted it can
+be copied to ``NotificationLogArchive`` (one ``INSERT ... SELECT``) or
+appended to a gzipped NDJSON file in the export format.
+
+Batches walk the primary key upwards. The last key is stored as a watermark
+in the durable state Redis, so a run stopped by its time budget (or killed)
+resumes where it left off. The watermark is cleared once a pass reaches the
+end of the table. If the watermark cannot be read or written the run fails
+and the next one resumes from the last stored key.
+
+When NotificationLog is partitioned (see ``partitions``) retention instead
+drops every partition older than the cutoff, whatever the rows' status; each
+dropped partition counts as one batch.
+
+Either way the hourly rollups of hours before the cutoff are pruned with the
+logs, so the exporter's counts keep matching the log.
+"""
+
+import logging
+import os
+import time
+from typing import NamedTuple
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import partitions, rollups
+from .export import export_queryset, stream_export
+from .models import NotificationLog, NotificationLogArchive
+from .redis_clients import get_state_client
+
+logger = logging.getLogger("notifications.tasks.retention")
+
+ARCHIVE_MODES = ("table", "file")
+
+WATERMARK_KEY = "retention:watermark"
+
+
+class CleanupResult(NamedTuple):
+    deleted: int
+    batches: int
+    elapsed: float
+    finished: bool  # False when the time budget ran out first
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.deleted / self.elapsed if self.elapsed else 0.0
+
+
+def cleanup(
+    days_old: int,
+    batch_size: int = 5000,
+    pause: float = 0.1,
+    time_budget: float = None,
+    archive: str = "",
+) -> CleanupResult:
+    """Delete sent/failed logs older than ``days_old`` days in batches."""
+    if archive and archive not in ARCHIVE_MODES:
+        raise ValueError(f"archive must be one of: {', '.join(ARCHIVE_MODES)}")
+
+    cutoff = timezone.now() - timezone.timedelta(days=days_old)
+    partitioned = settings.NOTIFICATION_LOG_PARTITIONS and partitions.is_partitioned()
+    watermark = None if partitioned else _load_watermark()
+    pruned = rollups.prune(cutoff)
+    if pruned:
+        logger.info("Pruned %s hourly rollups older than %s days", pruned, days_old)
+    if partitioned:
+        return _drop_partitions(cutoff, archive)
+
+    old_logs = NotificationLog.objects.filter(
+        status__in=NotificationLog.TERMINAL_STATUSES, created_at__lt=cutoff
+    )
+    archive_file = _open_archive_file() if archive == "file" else None
+
+    started = time.monotonic()
+    deleted = batches = 0
+    finished = False
+    try:
+        while True:
+            batch = old_logs.order_by("id")
+            if watermark:
+                batch = batch.filter(id__gt=watermark)
+            ids = list(batch.values_list("id", flat=True)[:batch_size])
+            if not ids:
+                finished = True
+                break
+
+            with transaction.atomic():
+                if archive:
+                    archive_rows(archive, archive_file, id__in=ids)
+                # Nothing cascades from NotificationLog, so this is a single
+                # DELETE ... WHERE id IN (...) without collecting objects.
+                deleted += NotificationLog.objects.filter(id__in=ids).delete()[0]
+            batches += 1
+            watermark = ids[-1]
+            _save_watermark(watermark)
+
+            if len(ids) < batch_size:
+                finished = True
+                break
+            if time_budget is not None and time.monotonic() - started >= time_budget:
+                break
+            time.sleep(pause)
+    finally:
+        if archive_file is not None:
+            archive_file.close()
+
+    if finished:
+        _save_watermark(None)
+    return CleanupResult(deleted, batches, time.monotonic() - started, finished)
+
+
+def _drop_partitions(cutoff, archive):
+    archive_file = _open_archive_file() if archive == "file" else None
+    started = time.monotonic()
+    try:
+        deleted, dropped = partitions.drop_expired(
+            cutoff,
+            settings.NOTIFICATION_LOG_PARTITIONS,
+            archive=(
+                (lambda **filters: archive_rows(archive, archive_file, **filters))
+                if archive
+                else None
+            ),
+        )
+    finally:
+        if archive_file is not None:
+            archive_file.close()
+    return CleanupResult(deleted, len(dropped), time.monotonic() - started, True)
+
+
+def archive_rows(archive, archive_file=None, **filters):
+    """Copy the logs matching ``filters`` to the archive table or file."""
+    if archive == "table":
+        _archive_to_table(NotificationLog.objects.filter(**filters))
+    else:
+        for block in stream_export(export_queryset().filter(**filters), compress=True):
+            archive_file.write(block)
+        archive_file.flush()
+
+
+def _archive_to_table(logs):
+    columns = [field.column for field in NotificationLogArchive._meta.concrete_fields]
+    select, params = logs.values_list(*columns).query.sql_with_params()
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {quote(NotificationLogArchive._meta.db_table)} "
+            f"({', '.join(quote(column) for column in columns)}) {select}",
+            params,
+        )
+
+
+def _open_archive_file():
+    os.makedirs(settings.RETENTION_ARCHIVE_DIR, exist_ok=True)
+    name = f"notification_logs_{timezone.now():%Y%m%dT%H%M%S}.ndjson.gz"
+    # Each batch is appended as its own gzip member; readers such as
+    # gzip.open and zcat treat the concatenation as one stream.
+    return open(os.path.join(settings.RETENTION_ARCHIVE_DIR, name), "ab")
+
+
+def _load_watermark():
+    # Errors propagate: a watermark that cannot be read is not a missing one,
+    # and starting over would rescan everything already deleted.
+    value = get_state_client().get(WATERMARK_KEY)
+    return value.decode() if value else None
+
+
+def _save_watermark(log_id):
+    if log_id is None:
+        get_state_client().delete(WATERMARK_KEY)
+    else:
+        get_state_client().set(WATERMARK_KEY, str(log_id))
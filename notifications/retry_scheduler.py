@@ -0,0 +1,129 @@
+"""
+Delayed delivery retries parked in a Redis sorted set.
+
+``task.retry(countdown=...)`` publishes the retry immediately with an ETA: a
+worker reserves it and keeps it in memory (and in the transport's unacked
+hash) until it is due, which during a provider outage means thousands of
+messages held for up to half an hour. With ``RETRY_SCHEDULER_ENABLED`` the
+delivery engine instead adds the retry to the ``RETRY_SCHEDULE_KEY`` sorted
+set, scored by the time it is due, and ``promote_retries`` moves due entries
+back onto their queue in pipelined batches.
+
+The schedule is the only copy of a parked retry, so it lives on its own
+connection to ``RETRY_SCHEDULE_REDIS_URL`` (the broker by default), not on
+the rate limiter's short-timeout, fail-open Redis. If it cannot be written the
+retry falls back to a Celery countdown.
+
+Promotion is at least once. Due entries are claimed by pushing their score
+``CLAIM_TIMEOUT`` seconds ahead, published, then removed; entries of a
+promoter that dies in between come due again. Workers skip logs that are
+already sent or failed.
+"""
+
+import json
+import logging
+import time
+from typing import Optional
+
+import redis
+from celery import current_app
+from django.conf import settings
+
+from .publisher import publish_many
+
+logger = logging.getLogger(__name__)
+
+# Seconds a claimed entry stays invisible to other promoters
+CLAIM_TIMEOUT = 60
+
+# Claims up to ARGV[2] entries due at ARGV[1] by moving their score to
+# ARGV[3], so concurrent promoters never publish the same entry twice.
+#
+# KEYS[1]  retry schedule
+# ARGV[1]  now, ARGV[2] batch size, ARGV[3] claim expiry
+CLAIM_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, member in ipairs(due) do
+    redis.call('ZADD', KEYS[1], 'XX', ARGV[3], member)
+end
+return due
+"""
+
+_schedule_client: Optional[redis.Redis] = None
+
+
+def get_schedule_client() -> redis.Redis:
+    """Lazily instantiate the client of the Redis holding the retry schedule."""
+    global _schedule_client
+    if _schedule_client is None:
+        _schedule_client = redis.Redis.from_url(
+            settings.RETRY_SCHEDULE_REDIS_URL,
+            socket_timeout=5,
+            socket_connect_timeout=5,
+            socket_keepalive=True,
+            health_check_interval=30,
+        )
+    return _schedule_client
+
+
+def schedule(task_name: str, args, kwargs, queue: str, delay: float, attempt: int) -> bool:
+    """
+    Park a retry of ``task_name`` due in ``delay`` seconds.
+
+    ``attempt`` keeps consecutive retries of the same message distinct.
+    Returns ``False`` if Redis is unavailable, in which case callers fall
+    back to a Celery countdown.
+    """
+    entry = json.dumps(
+        {
+            "task": task_name,
+            "args": list(args or ()),
+            "kwargs": kwargs or {},
+            "queue": queue,
+            "attempt": attempt,
+        },
+        sort_keys=True,
+    )
+    try:
+        get_schedule_client().zadd(settings.RETRY_SCHEDULE_KEY, {entry: time.time() + delay})
+    except redis.RedisError as exc:
+        logger.warning("Failed to schedule retry in Redis (%s); using countdown", exc)
+        return False
+    return True
+
+
+def promote_due(batch_size: int) -> int:
+    """Publish up to ``batch_size`` due retries to their queues; return how many."""
+    client = get_schedule_client()
+    now = time.time()
+    entries = _script()(
+        keys=[settings.RETRY_SCHEDULE_KEY],
+        args=[now, batch_size, now + CLAIM_TIMEOUT],
+    )
+    if not entries:
+        return 0
+
+    signatures = []
+    for raw in entries:
+        entry = json.loads(raw)
+        signatures.append(
+            current_app.signature(
+                entry["task"],
+                args=entry["args"],
+                kwargs=entry["kwargs"],
+                queue=entry["queue"],
+            )
+        )
+    publish_many(signatures)
+    client.zrem(settings.RETRY_SCHEDULE_KEY, *entries)
+    return len(entries)
+
+
+_claim_script = None
+
+
+def _script():
+    global _claim_script
+    if _claim_script is None:
+        _claim_script = get_schedule_client().register_script(CLAIM_SCRIPT)
+    return _claim_script
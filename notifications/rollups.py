@@ -0,0 +1,182 @@
+"""
+Hourly rollups of NotificationLog.
+
+``roll_up`` recomputes ``NotificationHourlyRollup`` for the hours that can
+still change and leaves the rest alone:
+
+- hours after the last run (a backlog, or the backfill on first run,
+  limited to ``ROLLUP_BACKFILL_DAYS``);
+- the ``ROLLUP_LATE_HOURS`` closed hours before it, whose logs may still be
+  retrying or just landed;
+- the current hour, which is provisional until it closes.
+
+The hour the last run reached is kept in Redis, since quiet hours leave no
+rollup rows behind; without it the newest rollup row is used instead.
+
+Each hour is one grouped ``INSERT ... SELECT`` over that hour's rows (found
+through the ``created_at`` index) replacing its previous rollup in the same
+transaction. A log whose status changes more than ``ROLLUP_LATE_HOURS``
+after its hour closed keeps its old status in the rollup.
+
+Retention ``prune``s the rollups of hours it has cleaned up, so the rollups
+cover the same window as the log.
+"""
+
+import logging
+import statistics
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import redis
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .models import NotificationHourlyRollup, NotificationLog
+from .redis_clients import get_state_client
+
+logger = logging.getLogger("notifications.tasks.rollups")
+
+GROUP_BY = ("channel", "status", "template_id")
+
+WATERMARK_KEY = "rollups:watermark"
+
+
+def _truncate(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def hours_to_roll(now=None) -> list:
+    """Start of every hour ``roll_up`` should recompute, oldest first."""
+    current = _truncate(now or timezone.now())
+    latest = _load_watermark()
+    if latest is None:
+        latest = NotificationHourlyRollup.objects.aggregate(latest=Max("hour"))["latest"]
+    if latest is None:
+        oldest = NotificationLog.objects.aggregate(oldest=Min("created_at"))["oldest"]
+        if oldest is None:
+            return []
+        start = max(_truncate(oldest), current - timedelta(days=settings.ROLLUP_BACKFILL_DAYS))
+    else:
+        start = min(latest, current) - timedelta(hours=settings.ROLLUP_LATE_HOURS)
+
+    hours = []
+    while start <= current:
+        hours.append(start)
+        start += timedelta(hours=1)
+    return hours
+
+
+def roll_up(now=None) -> int:
+    """Recompute the rollups that can still change; return how many hours."""
+    hours = hours_to_roll(now)
+    for hour in hours:
+        roll_up_hour(hour)
+    if hours:
+        _save_watermark(hours[-1])
+    return len(hours)
+
+
+def roll_up_hour(hour) -> None:
+    with transaction.atomic():
+        NotificationHourlyRollup.objects.filter(hour=hour).delete()
+        if connection.vendor == "postgresql":
+            _insert_select(hour)
+        else:
+            _aggregate_in_python(hour)
+
+
+def prune(cutoff) -> int:
+    """Delete the rollups of hours that end before ``cutoff``; return rows."""
+    return NotificationHourlyRollup.objects.filter(
+        hour__lt=cutoff - timedelta(hours=1)
+    ).delete()[0]
+
+
+def _insert_select(hour):
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {quote(NotificationHourlyRollup._meta.db_table)} (
+                hour, channel, status, template_id, count, attempts_sum,
+                max_attempts, latency_p50, latency_p95, latency_p99
+            )
+            SELECT
+                %s, channel, status, template_id, COUNT(*), SUM(attempts),
+                MAX(attempts),
+                percentile_cont(0.5) WITHIN GROUP (ORDER BY latency),
+                percentile_cont(0.95) WITHIN GROUP (ORDER BY latency),
+                percentile_cont(0.99) WITHIN GROUP (ORDER BY latency)
+            FROM (
+                SELECT
+                    channel, status, template_id, attempts,
+                    EXTRACT(EPOCH FROM (sent_at - created_at)) AS latency
+                FROM {quote(NotificationLog._meta.db_table)}
+                WHERE created_at >= %s AND created_at < %s
+            ) AS logs
+            GROUP BY channel, status, template_id
+            """,
+            [hour, hour, hour + timedelta(hours=1)],
+        )
+
+
+def _aggregate_in_python(hour):
+    groups = {}
+    rows = NotificationLog.objects.filter(
+        created_at__gte=hour, created_at__lt=hour + timedelta(hours=1)
+    ).values_list(*GROUP_BY, "attempts", "created_at", "sent_at")
+    for channel, status, template_id, attempts, created_at, sent_at in rows.iterator():
+        group = groups.setdefault((channel, status, template_id), [0, 0, 0, []])
+        group[0] += 1
+        group[1] += attempts
+        group[2] = max(group[2], attempts)
+        if sent_at is not None:
+            group[3].append((sent_at - created_at).total_seconds())
+
+    NotificationHourlyRollup.objects.bulk_create(
+        [
+            NotificationHourlyRollup(
+                hour=hour,
+                channel=channel,
+                status=status,
+                template_id=template_id,
+                count=count,
+                attempts_sum=attempts_sum,
+                max_attempts=max_attempts,
+                **_percentiles(latencies),
+            )
+            for (channel, status, template_id), (
+                count,
+                attempts_sum,
+                max_attempts,
+                latencies,
+            ) in groups.items()
+        ]
+    )
+
+
+def _percentiles(latencies):
+    if not latencies:
+        return {"latency_p50": None, "latency_p95": None, "latency_p99": None}
+    if len(latencies) == 1:
+        return dict.fromkeys(("latency_p50", "latency_p95", "latency_p99"), latencies[0])
+    # Same interpolation as PostgreSQL's percentile_cont
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {"latency_p50": cuts[49], "latency_p95": cuts[94], "latency_p99": cuts[98]}
+
+
+def _load_watermark():
+    try:
+        value = get_state_client().get(WATERMARK_KEY)
+    except redis.RedisError as exc:
+        logger.warning("Could not read rollup watermark (%s); using the rollup table", exc)
+        return None
+    return datetime.fromtimestamp(int(value), dt_timezone.utc) if value else None
+
+
+def _save_watermark(hour):
+    try:
+        get_state_client().set(WATERMARK_KEY, int(hour.timestamp()))
+    except redis.RedisError as exc:
+        logger.warning("Could not store rollup watermark: %s", exc)
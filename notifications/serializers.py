@@ -1,6 +1,11 @@
+from django.conf import settings
 from rest_framework import serializers
 
+from . import idempotency
 from .models import NotificationLog, NotificationTemplate
+from .rendering import TemplateRenderError
+from .template_cache import template_cache
+from .timing import stage
 
 
 # ============================================================================
@@ -8,8 +13,8 @@ from .models import NotificationLog, NotificationTemplate
 # ============================================================================
 
 
-class SendNotificationSerializer(serializers.Serializer):
-    """Request serializer for sending notifications."""
+class SendNotificationItemSerializer(serializers.Serializer):
+    """Fields of a single send request, without database validation."""
 
     template_name = serializers.CharField(
         max_length=100, help_text="Name of the notification template to use"
@@ -21,6 +26,12 @@ class SendNotificationSerializer(serializers.Serializer):
         max_length=255,
         help_text="Destination address (email, phone number, or device token)",
     )
+    tenant_id = serializers.CharField(
+        max_length=100,
+        required=False,
+        allow_blank=True,
+        help_text="Tenant the user belongs to (scopes the per-tenant rate limit)",
+    )
     context = serializers.DictField(
         child=serializers.CharField(allow_blank=True),
         default=dict,
@@ -50,9 +61,14 @@ class SendNotificationSerializer(serializers.Serializer):
         help_text="Push notification title override",
     )
 
+
+class SendNotificationSerializer(SendNotificationItemSerializer):
+    """Request serializer for sending notifications."""
+
     def validate_template_name(self, value: str) -> str:
         try:
-            self._template = NotificationTemplate.objects.get(name=value)
+            with stage(self.context.get("timer"), "template"):
+                self._template = template_cache.get(value)
         except NotificationTemplate.DoesNotExist as exc:
             raise serializers.ValidationError("Template not found") from exc
         return value
@@ -65,24 +81,94 @@ class SendNotificationSerializer(serializers.Serializer):
                 {"template_name": "Template lookup failed"}
             )
 
+        timer = self.context.get("timer")
         idem_key = attrs.get("idempotency_key") or None
         if idem_key:
-            existing = NotificationLog.objects.filter(idempotency_key=idem_key).first()
-            if existing:
-                attrs["existing_log"] = existing
+            # Redis answers most duplicates; the database remains the fallback
+            with stage(timer, "idempotency"):
+                reserved, hit = idempotency.reserve(idem_key)
+                if hit:
+                    attrs["existing_log"] = hit
+                elif not reserved:
+                    existing = NotificationLog.objects.filter(
+                        idempotency_key=idem_key
+                    ).first()
+                    if existing:
+                        attrs["existing_log"] = existing
+            attrs["idempotency_reserved"] = reserved
 
         try:
-            rendered_body = template.body_template.format(**attrs.get("context", {}))
-        except KeyError as exc:
-            raise serializers.ValidationError(
-                {"context": f"missing template variable: {exc}"}
-            ) from exc
+            with stage(timer, "render"):
+                rendered_body = template.renderer.render(attrs.get("context", {}))
+        except TemplateRenderError as exc:
+            if attrs.get("idempotency_reserved"):
+                # No notification will be created: free the key for a retry
+                idempotency.release(idem_key)
+            raise serializers.ValidationError({"context": str(exc)}) from exc
 
         attrs["template"] = template
         attrs["rendered_body"] = rendered_body
         return attrs
 
 
+class SendNotificationBatchSerializer(serializers.Serializer):
+    """
+    Request serializer for batch sends.
+
+    Templates come from the template cache and idempotency keys for the whole
+    batch are resolved with one query. Items that fail lookup or rendering are not rejected here;
+    they are annotated with an ``error`` so the view can report a status for
+    every item instead of failing the whole batch.
+    """
+
+    notifications = SendNotificationItemSerializer(
+        many=True,
+        allow_empty=False,
+        max_length=settings.NOTIFICATION_BATCH_MAX_SIZE,
+        help_text="Notifications to send (same fields as the single send endpoint)",
+    )
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        items = attrs["notifications"]
+
+        names = {item["template_name"] for item in items}
+        templates = template_cache.get_many(names)
+
+        idem_keys = {
+            item["idempotency_key"] for item in items if item.get("idempotency_key")
+        }
+        existing_logs = {}
+        if idem_keys:
+            existing_logs = {
+                log.idempotency_key: log
+                for log in NotificationLog.objects.filter(
+                    idempotency_key__in=idem_keys
+                ).only("id", "idempotency_key", "status")
+            }
+
+        for item in items:
+            template = templates.get(item["template_name"])
+            if template is None:
+                item["error"] = "Template not found"
+                continue
+
+            existing = existing_logs.get(item.get("idempotency_key") or None)
+            if existing:
+                item["existing_log"] = existing
+                continue
+
+            try:
+                item["rendered_body"] = template.renderer.render(
+                    item.get("context", {})
+                )
+            except TemplateRenderError as exc:
+                item["error"] = str(exc)
+                continue
+            item["template"] = template
+        return attrs
+
+
 # ============================================================================
 # Response Serializers (for OpenAPI schema generation)
 # ============================================================================
@@ -108,6 +194,43 @@ class NotificationIdempotentResponseSerializer(serializers.Serializer):
     )
 
 
+class BatchItemResultSerializer(serializers.Serializer):
+    """Outcome of a single item in a batch send."""
+
+    index = serializers.IntegerField(help_text="Position of the item in the request")
+    result = serializers.ChoiceField(
+        choices=["queued", "duplicate", "rejected"],
+        help_text="What happened to the item",
+    )
+    notification_id = serializers.UUIDField(
+        allow_null=True, help_text="Notification identifier (null if rejected)"
+    )
+    status = serializers.CharField(
+        allow_null=True, help_text="Notification status (null if rejected)"
+    )
+    error = serializers.CharField(
+        required=False, help_text="Reason the item was rejected"
+    )
+    tier = serializers.CharField(
+        required=False, help_text="Rate limit tier that rejected the item"
+    )
+    retry_after = serializers.IntegerField(
+        required=False, help_text="Seconds until the rate limit tier admits the item"
+    )
+
+
+class NotificationBatchResponseSerializer(serializers.Serializer):
+    """Response for batch sends."""
+
+    count = serializers.IntegerField(help_text="Number of items in the batch")
+    queued = serializers.IntegerField(help_text="Number of notifications queued")
+    duplicates = serializers.IntegerField(
+        help_text="Number of items matching an existing idempotency key"
+    )
+    rejected = serializers.IntegerField(help_text="Number of items rejected")
+    results = BatchItemResultSerializer(many=True, help_text="Per-item results")
+
+
 class ErrorResponseSerializer(serializers.Serializer):
     """Generic error response."""
 
@@ -167,6 +290,10 @@ class NotificationListResponseSerializer(serializers.Serializer):
     """Response for notification list endpoint."""
 
     count = serializers.IntegerField(help_text="Number of notifications returned")
+    next_cursor = serializers.CharField(
+        allow_null=True,
+        help_text="Cursor for the next page; null on the last page",
+    )
     results = NotificationSummarySerializer(
         many=True, help_text="List of notifications"
     )
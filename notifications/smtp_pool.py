@@ -0,0 +1,135 @@
+import logging
+import os
+import smtplib
+import threading
+import time
+
+from celery.signals import worker_process_shutdown
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+
+logger = logging.getLogger(__name__)
+
+# Errors that mean the pooled connection is unusable, not that the message
+# was rejected; the send is retried once on a fresh connection.
+STALE_CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError)
+
+
+class _PooledConnection:
+    __slots__ = ("backend", "last_used", "messages")
+
+    def __init__(self, backend) -> None:
+        self.backend = backend
+        self.last_used = time.monotonic()
+        self.messages = 0
+
+
+class SMTPConnectionPool:
+    """
+    Long-lived SMTP connections shared by the tasks of one worker process.
+
+    ``django.core.mail.send_mail`` opens a connection (and TLS session) per
+    message. Here connections are kept open and reused: a connection idle for
+    longer than ``idle_timeout`` seconds, or which has sent ``max_messages``
+    messages, is closed and replaced, and a send that fails because the
+    server dropped the connection is retried once on a new one. At most
+    ``size`` idle connections are kept. The pool is reset after a fork, so
+    each prefork child opens its own connections.
+    """
+
+    def __init__(self, size=2, idle_timeout=30.0, max_messages=100) -> None:
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.max_messages = max_messages
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def send(self, message: EmailMessage) -> None:
+        """Send ``message`` over a pooled connection."""
+        conn = self._acquire()
+        try:
+            self._send(conn, message)
+        except STALE_CONNECTION_ERRORS as exc:
+            if not conn.messages:
+                # Failed on a brand-new connection: the server is the problem
+                self._discard(conn)
+                raise
+            logger.info("Pooled SMTP connection went stale (%s); reconnecting", exc)
+            self._discard(conn)
+            conn = self._open()
+            try:
+                self._send(conn, message)
+            except Exception:
+                self._discard(conn)
+                raise
+        except Exception:
+            self._discard(conn)
+            raise
+        self._release(conn)
+
+    def close_all(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._discard(conn)
+
+    def _send(self, conn, message):
+        message.connection = conn.backend
+        conn.backend.send_messages([message])
+        conn.messages += 1
+        conn.last_used = time.monotonic()
+
+    def _acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked: the sockets belong to the parent
+                self._idle, self._pid = [], os.getpid()
+            while self._idle:
+                conn = self._idle.pop()
+                if time.monotonic() - conn.last_used < self.idle_timeout:
+                    return conn
+                self._discard(conn)
+        return self._open()
+
+    def _release(self, conn):
+        if conn.messages >= self.max_messages:
+            self._discard(conn)
+            return
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        self._discard(conn)
+
+    def _open(self):
+        backend = get_connection(fail_silently=False)
+        backend.open()
+        return _PooledConnection(backend)
+
+    @staticmethod
+    def _discard(conn):
+        try:
+            conn.backend.close()
+        except Exception:  # pragma: no cover - closing a dead socket
+            pass
+
+
+_pool = None
+
+
+def get_smtp_pool() -> SMTPConnectionPool:
+    global _pool
+    if _pool is None:
+        _pool = SMTPConnectionPool(
+            size=settings.SMTP_POOL_SIZE,
+            idle_timeout=settings.SMTP_POOL_IDLE_TIMEOUT,
+            max_messages=settings.SMTP_POOL_MAX_MESSAGES,
+        )
+    return _pool
+
+
+@worker_process_shutdown.connect
+def _close_pool(**kwargs):
+    if _pool is not None:
+        _pool.close_all()
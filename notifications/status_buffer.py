@@ -0,0 +1,221 @@
+"""
+Worker-side buffering of delivery status updates.
+
+With ``STATUS_BUFFER_ENABLED`` the delivery engine hands each outcome to a
+per-process ``StatusBuffer`` instead of issuing its own UPDATE. The buffer is
+flushed when it holds ``STATUS_BUFFER_SIZE`` outcomes or its oldest outcome is
+``STATUS_BUFFER_MAX_DELAY`` seconds old, and drained on worker shutdown. On
+PostgreSQL a flush is a single ``UPDATE ... FROM (VALUES ...)``; elsewhere it
+is one SELECT plus ``bulk_update``.
+
+The trade-off: outcomes buffered when a worker process is killed without a
+clean shutdown are lost (the task message is already acknowledged), and for
+up to ``STATUS_BUFFER_MAX_DELAY`` the database lags what was actually sent.
+A small delay already turns thousands of single-row UPDATEs per second into a
+few dozen statements.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+
+from celery.signals import worker_process_shutdown
+from django.conf import settings
+from django.db import connection, transaction
+
+from . import idempotency
+from .models import NotificationLog
+
+logger = logging.getLogger(__name__)
+
+# Columns an outcome can set, besides status and attempts
+FIELDS = ("last_attempt_at", "sent_at", "error_message", "next_retry_at", "provider_config")
+
+# Outcomes kept after failed flushes, as a multiple of the flush size
+MAX_BACKLOG_FACTOR = 10
+
+
+class StatusBuffer:
+    def __init__(self, size=200, max_delay=0.05) -> None:
+        self.size = size
+        self.max_delay = max_delay
+        self._pending = {}  # log_id -> outcome
+        self._first_at = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def add(self, log_id, status, idempotency_key=None, **fields) -> None:
+        """Queue a status change with the same arguments as ``transition``."""
+        with self._lock:
+            self._ensure_flusher()
+            outcome = self._pending.get(str(log_id))
+            attempts = 1 if status == "retrying" else 0
+            if outcome is not None:
+                # A later outcome for the same log wins; attempts accumulate
+                attempts += outcome["attempts"]
+            self._pending[str(log_id)] = {
+                "status": status,
+                "attempts": attempts,
+                "idempotency_key": idempotency_key,
+                "fields": fields,
+            }
+            if self._first_at is None:
+                self._first_at = time.monotonic()
+                self._wakeup.set()
+            full = len(self._pending) >= self.size
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        """Write every buffered outcome; return how many rows were updated."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._first_at = None
+                self._wakeup.clear()
+            if not pending:
+                return 0
+            try:
+                updated = write_outcomes(pending)
+            except Exception:
+                logger.exception("Failed to flush %s status updates", len(pending))
+                self._requeue(pending)
+                return 0
+
+        for log_id in updated:
+            key = pending[log_id]["idempotency_key"]
+            if key:
+                idempotency.update_status(key, log_id, pending[log_id]["status"])
+        return len(updated)
+
+    def _requeue(self, pending):
+        with self._lock:
+            pending.update(self._pending)
+            limit = self.size * MAX_BACKLOG_FACTOR
+            if len(pending) > limit:
+                dropped = len(pending) - limit
+                logger.error("Status buffer backlog full; dropping %s outcomes", dropped)
+                pending = dict(list(pending.items())[dropped:])
+            self._pending = pending
+            self._first_at = self._first_at or time.monotonic()
+            self._wakeup.set()
+
+    def _ensure_flusher(self):
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        # First use in this process (or after a fork): start its flusher
+        self._pid = os.getpid()
+        self._thread = threading.Thread(
+            target=self._run, name="status-buffer-flusher", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            # Sleep until something is buffered, then until it is due
+            self._wakeup.wait()
+            with self._lock:
+                if self._first_at is None:
+                    self._wakeup.clear()
+                    continue
+                remaining = self._first_at + self.max_delay - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+            else:
+                self.flush()
+
+
+def write_outcomes(pending) -> list:
+    """Apply ``{log_id: outcome}`` to logs not yet sent/failed; return updated ids."""
+    with transaction.atomic():
+        if connection.vendor == "postgresql":
+            return _update_from_values(pending)
+        return _bulk_update(pending)
+
+
+def _update_from_values(pending):
+    table = connection.ops.quote_name(NotificationLog._meta.db_table)
+    columns = {name: NotificationLog._meta.get_field(name) for name in FIELDS}
+    id_field = NotificationLog._meta.pk
+
+    rows, params = [], []
+    for log_id, outcome in pending.items():
+        casts = [f"%s::{id_field.db_type(connection)}", "%s", "%s::integer"]
+        params += [
+            id_field.get_db_prep_save(log_id, connection),
+            outcome["status"],
+            outcome["attempts"],
+        ]
+        for name, field in columns.items():
+            value = outcome["fields"].get(name)
+            casts.append(f"%s::{field.db_type(connection)}")
+            params.append(field.get_db_prep_save(value, connection))
+        rows.append(f"({', '.join(casts)})")
+
+    terminal = ", ".join(["%s"] * len(NotificationLog.TERMINAL_STATUSES))
+    params += list(NotificationLog.TERMINAL_STATUSES)
+    # Columns left NULL by an outcome keep their current value, except
+    # next_retry_at which retrying/failed always set (failed clears it)
+    sql = f"""
+        UPDATE {table} AS t SET
+            status = v.status,
+            attempts = t.attempts + v.attempts,
+            last_attempt_at = COALESCE(v.last_attempt_at, t.last_attempt_at),
+            sent_at = COALESCE(v.sent_at, t.sent_at),
+            error_message = COALESCE(v.error_message, t.error_message),
+            next_retry_at = CASE WHEN v.status = 'sent'
+                THEN t.next_retry_at ELSE v.next_retry_at END,
+            provider_config = COALESCE(v.provider_config, t.provider_config)
+        FROM (VALUES {", ".join(rows)})
+            AS v(id, status, attempts, {", ".join(FIELDS)})
+        WHERE t.id = v.id AND t.status NOT IN ({terminal})
+        RETURNING t.id
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [str(row[0]) for row in cursor.fetchall()]
+
+
+def _bulk_update(pending):
+    logs = list(
+        NotificationLog.objects.filter(id__in=list(pending))
+        .exclude(status__in=NotificationLog.TERMINAL_STATUSES)
+        .only("id", "attempts", *FIELDS)
+    )
+    for log in logs:
+        outcome = pending[str(log.id)]
+        log.status = outcome["status"]
+        log.attempts += outcome["attempts"]
+        for name, value in outcome["fields"].items():
+            setattr(log, name, value)
+    NotificationLog.objects.bulk_update(
+        logs, ["status", "attempts", *FIELDS], batch_size=500
+    )
+    return [str(log.id) for log in logs]
+
+
+_buffer = None
+
+
+def get_status_buffer() -> StatusBuffer:
+    global _buffer
+    if _buffer is None:
+        _buffer = StatusBuffer(
+            size=settings.STATUS_BUFFER_SIZE,
+            max_delay=settings.STATUS_BUFFER_MAX_DELAY,
+        )
+    return _buffer
+
+
+@worker_process_shutdown.connect
+def _drain(**kwargs):
+    if _buffer is not None:
+        _buffer.flush()
+
+
+atexit.register(_drain)
@@ -1,11 +1,9 @@
 import logging
 
 from celery import shared_task
-from django.conf import settings
-from django.core.mail import send_mail
 from django.utils import timezone
 
-from .models import NotificationLog
+from .delivery import deliver
 
 logger = logging.getLogger(__name__)
 if not any(
@@ -23,223 +21,134 @@ logger.setLevel(logging.INFO)
 
 @shared_task(bind=True, max_retries=5, default_retry_delay=60)
 def send_email_task(self, log_id: str, to_email: str, subject: str, body: str) -> None:
-    try:
-        log = NotificationLog.objects.get(id=log_id)
-    except NotificationLog.DoesNotExist:
-        logger.warning(
-            "NotificationLog %s no longer exists, skipping email send", log_id
-        )
-        return
-
-    try:
-        send_mail(
-            subject=subject,
-            message=body,
-            from_email=getattr(settings, "DEFAULT_FROM_EMAIL", "pulse@example.com"),
-            recipient_list=[to_email],
-            fail_silently=False,
-        )
-        # Atomic success update
-        log.atomic_update_status(
-            "sent", sent_at=timezone.now(), last_attempt_at=timezone.now()
-        )
-        logger.info("Email sent successfully to %s (log=%s)", to_email, log_id)
-    except Exception as exc:  # pragma: no cover - network/provider specific
-        # Atomic fail/retry
-        next_attempt = log.attempts + 1
-        retry_delay = 60 * (2**next_attempt)
-        next_retry = timezone.now() + timezone.timedelta(seconds=retry_delay)
-
-        if next_attempt >= log.max_retries:
-            log.atomic_update_status(
-                "failed",
-                error_message=str(exc),
-                last_attempt_at=timezone.now(),
-                next_retry_at=None,
-            )
-            logger.exception(
-                "Email delivery failed permanently for %s (log=%s)",
-                to_email,
-                log_id,
-                exc_info=exc,
-            )
-            return  # No retry
-
-        log.atomic_update_status(
-            "retrying",
-            error_message=str(exc),
-            last_attempt_at=timezone.now(),
-            next_retry_at=next_retry,
-        )
-        logger.warning(
-            "Email delivery failed for %s (log=%s). Retrying in %s seconds",
-            to_email,
-            log_id,
-            retry_delay,
-        )
-        raise self.retry(exc=exc, countdown=retry_delay)
+    deliver(self, "email", log_id, to_email, body, subject=subject)
 
 
 @shared_task(bind=True, max_retries=5, default_retry_delay=60)
 def send_sms_task(self, log_id: str, to_phone: str, body: str) -> None:
-    try:
-        log = NotificationLog.objects.get(id=log_id)
-    except NotificationLog.DoesNotExist:
-        logger.warning("NotificationLog %s no longer exists, skipping SMS send", log_id)
-        return
-
-    try:
-        from twilio.rest import Client
-
-        client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
-        message = client.messages.create(
-            body=body, from_=settings.TWILIO_PHONE_NUMBER, to=to_phone
-        )
-        # Atomic success update
-        log.atomic_update_status(
-            "sent", sent_at=timezone.now(), last_attempt_at=timezone.now()
-        )
-        # Store SID in provider_config for tracking
-        log.provider_config = {"twilio_sid": str(message.sid)}
-        log.save(update_fields=["provider_config"])
-        logger.info(
-            "SMS sent successfully to %s, SID: %s (log=%s)",
-            to_phone,
-            message.sid,
-            log_id,
-        )
-    except Exception as exc:
-        # Atomic fail/retry
-        next_attempt = log.attempts + 1
-        retry_delay = 60 * (2**next_attempt)
-        next_retry = timezone.now() + timezone.timedelta(seconds=retry_delay)
-
-        if next_attempt >= log.max_retries:
-            log.atomic_update_status(
-                "failed",
-                error_message=str(exc),
-                last_attempt_at=timezone.now(),
-                next_retry_at=None,
-            )
-            logger.exception(
-                "SMS delivery failed permanently for %s (log=%s)",
-                to_phone,
-                log_id,
-                exc_info=exc,
-            )
-            return  # No retry
-
-        log.atomic_update_status(
-            "retrying",
-            error_message=str(exc),
-            last_attempt_at=timezone.now(),
-            next_retry_at=next_retry,
-        )
-        logger.warning(
-            "SMS delivery failed for %s (log=%s). Retrying in %s seconds",
-            to_phone,
-            log_id,
-            retry_delay,
-        )
-        raise self.retry(exc=exc, countdown=retry_delay)
+    deliver(self, "sms", log_id, to_phone, body)
 
 
 @shared_task(bind=True, max_retries=5, default_retry_delay=60)
 def send_push_task(self, log_id: str, device_token: str, title: str, body: str) -> None:
-    try:
-        log = NotificationLog.objects.get(id=log_id)
-    except NotificationLog.DoesNotExist:
-        logger.warning(
-            "NotificationLog %s no longer exists, skipping Push send", log_id
-        )
-        return
-
-    try:
-        # Dummy for now — prints to logs. Real:
-        # from firebase_admin import messaging
-        # message = messaging.Message(
-        #     notification=messaging.Notification(title=title, body=body),
-        #     token=device_token,
-        # )
-        # response = messaging.send(message)
-
-        logger.info(
-            "Push sent to %s: %s - %s (log=%s)", device_token, title, body, log_id
-        )
-        # Atomic success update
-        log.atomic_update_status(
-            "sent", sent_at=timezone.now(), last_attempt_at=timezone.now()
-        )
-    except Exception as exc:
-        # Atomic fail/retry
-        next_attempt = log.attempts + 1
-        retry_delay = 60 * (2**next_attempt)
-        next_retry = timezone.now() + timezone.timedelta(seconds=retry_delay)
-
-        if next_attempt >= log.max_retries:
-            log.atomic_update_status(
-                "failed",
-                error_message=str(exc),
-                last_attempt_at=timezone.now(),
-                next_retry_at=None,
-            )
-            logger.exception(
-                "Push delivery failed permanently for %s (log=%s)",
-                device_token,
-                log_id,
-                exc_info=exc,
-            )
-            return  # No retry
-
-        log.atomic_update_status(
-            "retrying",
-            error_message=str(exc),
-            last_attempt_at=timezone.now(),
-            next_retry_at=next_retry,
-        )
-        logger.warning(
-            "Push delivery failed for %s (log=%s). Retrying in %s seconds",
-            device_token,
-            log_id,
-            retry_delay,
-        )
-        raise self.retry(exc=exc, countdown=retry_delay)
+    deliver(self, "push", log_id, device_token, body, title=title)
 
 
 @shared_task(queue="low_priority")
 def cleanup_old_logs(days_old=30):
-    """Archive old notification logs (failed/sent) older than specified days."""
-    from .models import NotificationLog
+    """
+    Delete (and optionally archive) sent/failed logs older than ``days_old``.
+
+    Runs in bounded batches within ``RETENTION_TIME_BUDGET`` seconds; see
+    ``notifications.retention``.
+    """
+    from django.conf import settings
+
+    from .retention import cleanup
+
+    result = cleanup(
+        days_old,
+        batch_size=settings.RETENTION_BATCH_SIZE,
+        pause=settings.RETENTION_BATCH_PAUSE,
+        time_budget=settings.RETENTION_TIME_BUDGET,
+        archive=settings.RETENTION_ARCHIVE,
+    )
+    logger.info(
+        "Cleaned up %s logs older than %s days in %s batches (%.1fs, %.0f rows/s)%s",
+        result.deleted,
+        days_old,
+        result.batches,
+        result.elapsed,
+        result.rows_per_second,
+        "" if result.finished else "; time budget reached, will resume",
+    )
+    return result.deleted
+
+
+@shared_task(queue="low_priority")
+def ensure_log_partitions():
+    """Create upcoming NotificationLog partitions when partitioning is enabled."""
+    from django.conf import settings
+
+    from . import partitions
 
-    cutoff = timezone.now() - timezone.timedelta(days=days_old)
-    old_logs = NotificationLog.objects.filter(
-        status__in=["failed", "sent"], created_at__lt=cutoff
+    interval = settings.NOTIFICATION_LOG_PARTITIONS
+    if not interval or not partitions.is_partitioned():
+        return 0
+    created = partitions.ensure_partitions(
+        interval, settings.NOTIFICATION_LOG_PARTITIONS_AHEAD
     )
-    archived_count = old_logs.count()
-    # For now, just delete old logs (in production, you might move to archive table)
-    old_logs.delete()
-    logger.info(f"Cleaned up {archived_count} old logs older than {days_old} days")
-    return archived_count
+    if created:
+        logger.info("Created log partitions: %s", ", ".join(created))
+    return len(created)
 
 
 @shared_task(queue="low_priority")
-def send_daily_digest():
+def rollup_notification_stats():
+    """Refresh the hourly rollups read by the dashboard and metrics exporter."""
+    from .rollups import roll_up
+
+    return roll_up()
+
+
+@shared_task(queue="low_priority")
+def send_daily_digest(day=None, lease=None):
     """
-    Sample recurring task to show how Celery Beat integrates with the app.
+    Coordinate the daily digest for ``day`` (ISO date, default today).
+
+    Dispatches chunks of users while slots are free, then re-enqueues itself
+    with its ``lease`` until every user has been handed out; see
+    ``notifications.digest``. A run started while another chain holds the
+    day's lease does nothing. Running it again for a day resumes from the
+    checkpoint, or does nothing once the day is done.
 
-    For now this is intentionally simple and primarily logs activity, but it
-    can be extended to aggregate per-user notification stats and send
-    summary emails/SMS.
+    If the Redis holding the lease and checkpoint fails, the run stops and
+    tries again later with the same lease: the state is unknown, not absent.
     """
-    seven_days_ago = timezone.now() - timezone.timedelta(days=7)
-    quiet_users = (
-        NotificationLog.objects.filter(created_at__lt=seven_days_ago)
-        .values_list("user_id", flat=True)
-        .distinct()[:50]
+    from datetime import date
+
+    import redis
+    from django.conf import settings
+
+    from . import digest
+
+    day = date.fromisoformat(day) if day else timezone.localdate()
+    try:
+        held = digest.hold_lease(day, lease)
+        if held is None:
+            logger.info("Digest for %s is already being coordinated", day)
+            return 0
+        dispatched, finished = digest.dispatch(day)
+        if finished:
+            digest.release_lease(day, held)
+            logger.info("Digest for %s fully dispatched", day)
+            return dispatched
+    except redis.RedisError as exc:
+        logger.warning("Digest state for %s unavailable (%s); retrying later", day, exc)
+        held, dispatched = lease, 0
+    send_daily_digest.apply_async(
+        args=[day.isoformat(), held], countdown=settings.DIGEST_POLL_INTERVAL
     )
-    count = len(quiet_users)
-    if count:
-        logger.info("send_daily_digest would run for %s users", count)
-    else:
-        logger.info("send_daily_digest found no quiet users to notify")
-    return count
+    return dispatched
+
+
+@shared_task(queue="low_priority")
+def send_digest_chunk(day, user_ids):
+    """Aggregate and send the digests of one chunk of users."""
+    from datetime import date
+
+    import redis
+
+    from . import digest
+
+    day = date.fromisoformat(day)
+    try:
+        sent = digest.send_chunk(day, user_ids)
+    finally:
+        try:
+            digest.release_slot(day)
+        except redis.RedisError as exc:
+            # The slot frees itself when the in-flight count expires
+            logger.warning("Cannot release digest slot for %s: %s", day, exc)
+    logger.info("Sent %s digests for %s users", sent, len(user_ids))
+    return sent
@@ -0,0 +1,131 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import NotificationTemplate
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = "pulse:template_cache:version"
+
+
+class TemplateCache:
+    """
+    Per-process cache of notification templates keyed by name.
+
+    Templates are compiled (see ``CompiledTemplate``) as they are loaded, so
+    cached entries carry a ready-to-use ``renderer``.
+
+    Every process (gunicorn worker, Celery worker) keeps its own copy.
+    Saving or deleting a template bumps a version counter in Redis; each
+    process compares its version with Redis at most once per
+    ``check_interval`` seconds and drops all entries when it changed. The
+    send hot path therefore makes no database query for templates, and at
+    most one Redis GET per interval.
+
+    If Redis cannot be reached the cache is bypassed, so templates are read
+    from the database as if there were no cache.
+    """
+
+    def __init__(self, check_interval: float = 1.0) -> None:
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self._entries: dict[str, NotificationTemplate] = {}
+        self._version = None
+        self._checked_at = 0.0
+        self._usable = True
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> NotificationTemplate:
+        """Return the template called ``name`` or raise ``DoesNotExist``."""
+        templates = self.get_many([name])
+        if name not in templates:
+            raise NotificationTemplate.DoesNotExist(f"Template {name!r} not found")
+        return templates[name]
+
+    def get_many(self, names) -> dict[str, NotificationTemplate]:
+        """Return the templates that exist among ``names``, keyed by name."""
+        usable = self._validate()
+        names = set(names)
+        found = {
+            name: self._entries[name] for name in names if name in self._entries
+        }
+        missing = names - found.keys()
+        self.hits += len(found)
+        self.misses += len(missing)
+        if missing:
+            for template in NotificationTemplate.objects.filter(name__in=missing):
+                template.renderer  # compile once, on load
+                found[template.name] = template
+                if usable:
+                    self._entries[template.name] = template
+        return found
+
+    def invalidate(self) -> None:
+        """Drop local entries and tell every other process to do the same."""
+        self.clear()
+        try:
+            _redis().incr(VERSION_KEY)
+        except Exception:
+            logger.exception("Failed to publish template cache invalidation")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries = {}
+            self._version = None
+            self._checked_at = 0.0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+    def _validate(self) -> bool:
+        """Drop stale entries; return False when the cache must be bypassed."""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return self._usable
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return self._usable
+            self._checked_at = now
+            try:
+                version = _redis().get(VERSION_KEY)
+            except Exception:
+                logger.warning("Template cache version check failed; bypassing cache")
+                self._entries = {}
+                self._version = None
+                self._usable = False
+                return False
+            if version != self._version:
+                self._entries = {}
+                self._version = version
+            self._usable = True
+            return True
+
+
+def _redis():
+    from .redis_clients import get_cache_client
+
+    return get_cache_client()
+
+
+template_cache = TemplateCache(check_interval=settings.TEMPLATE_CACHE_CHECK_INTERVAL)
+
+
+@receiver(post_save, sender=NotificationTemplate)
+@receiver(post_delete, sender=NotificationTemplate)
+def invalidate_template_cache(sender, **kwargs):
+    template_cache.clear()
+    # Wait for the commit so other processes cannot reload the old row.
+    transaction.on_commit(template_cache.invalidate)
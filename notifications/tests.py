@@ -1,4 +1,4 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 from django.utils import timezone
 from rest_framework.test import APIClient
 from rest_framework import status
@@ -103,6 +103,35 @@ class IdempotencyTest(TestCase):
         # But should still update status if explicitly set
         self.assertEqual(log.status, "retrying")
 
+    def test_create_idempotent_uses_single_insert_on_postgres(self):
+        """Test that PostgreSQL creates with one INSERT and selects only on conflict"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        if connection.vendor != "postgresql":
+            self.skipTest("PostgreSQL only")
+
+        fields = dict(
+            user_id="user_pg",
+            template=self.template,
+            channel="email",
+            to="pg@example.com",
+            idempotency_key="test-on-conflict-1",
+        )
+        with CaptureQueriesContext(connection) as first:
+            log1, created1 = NotificationLog.create_idempotent(**fields)
+        with CaptureQueriesContext(connection) as second:
+            log2, created2 = NotificationLog.create_idempotent(**fields)
+
+        self.assertTrue(created1)
+        self.assertFalse(created2)
+        self.assertEqual(log1.id, log2.id)
+        self.assertEqual(len(first), 1)
+        self.assertIn("ON CONFLICT", first[0]["sql"])
+        self.assertEqual(len(second), 2)
+        log1.atomic_update_status("sent")
+        self.assertEqual(NotificationLog.objects.get(id=log1.id).status, "sent")
+
 
 class IdempotencyAPITest(TestCase):
     """Test idempotency via API"""
@@ -116,6 +145,9 @@ class IdempotencyAPITest(TestCase):
             body_template="Hello {name}!",
         )
         self.client = APIClient()
+        from .redis_clients import get_cache_client
+
+        get_cache_client().delete("idempotency:api-dup-test-123")
 
     def test_duplicate_api_request_with_idempotency_key(self):
         """Test that duplicate API requests with same idempotency key return existing notification"""
@@ -145,3 +177,1859 @@ class IdempotencyAPITest(TestCase):
         self.assertEqual(
             NotificationLog.objects.filter(idempotency_key="api-dup-test-123").count(), 1
         )
+
+
+class BatchSendAPITest(TestCase):
+    """Test the batch send endpoint"""
+
+    def setUp(self):
+        import uuid
+
+        self.template = NotificationTemplate.objects.create(
+            name="batch_email",
+            channel="email",
+            subject="Hi",
+            body_template="Hello {name}!",
+        )
+        self.client = APIClient()
+        # Batch items are rate limited per user: keep runs independent
+        self.user = f"user_batch_{uuid.uuid4().hex}"
+
+    def _item(self, **overrides):
+        item = {
+            "template_name": "batch_email",
+            "user_id": self.user,
+            "to": "batch@example.com",
+            "context": {"name": "Batch"},
+        }
+        item.update(overrides)
+        return item
+
+    def test_batch_reports_status_per_item(self):
+        """Test that each item in a batch gets its own result"""
+        existing = NotificationLog.objects.create(
+            user_id="user_batch",
+            template=self.template,
+            channel="email",
+            to="batch@example.com",
+            idempotency_key="batch-existing",
+            status="sent",
+        )
+        items = [
+            self._item(),
+            self._item(template_name="does_not_exist"),
+            self._item(context={}),
+            self._item(idempotency_key="batch-existing"),
+            self._item(idempotency_key="batch-new"),
+            self._item(idempotency_key="batch-new"),
+        ]
+
+        response = self.client.post(
+            "/api/notifications/send/batch/", {"notifications": items}, format="json"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        results = response.data["results"]
+        self.assertEqual(
+            [r["result"] for r in results],
+            ["queued", "rejected", "rejected", "duplicate", "queued", "duplicate"],
+        )
+        self.assertEqual(results[1]["error"], "Template not found")
+        self.assertIn("name", results[2]["error"])
+        self.assertEqual(results[3]["notification_id"], str(existing.id))
+        self.assertEqual(results[3]["status"], "sent")
+        self.assertEqual(results[5]["notification_id"], results[4]["notification_id"])
+        self.assertEqual(results[5]["status"], results[4]["status"])
+        self.assertEqual(response.data["queued"], 2)
+        self.assertEqual(response.data["duplicates"], 2)
+        self.assertEqual(response.data["rejected"], 2)
+        self.assertEqual(
+            NotificationLog.objects.filter(idempotency_key="batch-new").count(), 1
+        )
+
+    def test_batch_items_are_rate_limited(self):
+        """Test that batch items are charged to the rate limit tiers one by one"""
+        from .metrics import RATE_LIMIT_REJECTIONS
+
+        rejections = RATE_LIMIT_REJECTIONS.labels(tier="batch", channel="email")
+        before = rejections._value.get()
+        tiers = [{"name": "batch", "key": "{user_id}", "max_requests": 2, "window": 60}]
+        with self.settings(RATE_LIMITS=tiers):
+            response = self.client.post(
+                "/api/notifications/send/batch/",
+                {
+                    "notifications": [
+                        self._item(),
+                        self._item(),
+                        self._item(idempotency_key=f"{self.user}-over"),
+                        self._item(idempotency_key=f"{self.user}-over"),
+                    ]
+                },
+                format="json",
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        results = response.data["results"]
+        self.assertEqual(
+            [r["result"] for r in results], ["queued", "queued", "rejected", "rejected"]
+        )
+        self.assertEqual(results[2]["tier"], "batch")
+        self.assertGreater(results[2]["retry_after"], 0)
+        self.assertIsNone(results[2]["notification_id"])
+        # A repeated key is reported like its first item
+        self.assertEqual(results[3]["tier"], "batch")
+        self.assertEqual(rejections._value.get(), before + 1)
+        self.assertEqual(NotificationLog.objects.filter(user_id=self.user).count(), 2)
+
+    def test_publish_many_pipelines_messages_onto_queue(self):
+        """Test that bulk publishing lands every message on the broker queue"""
+        import json
+
+        from .adapters import EmailAdapter
+        from .publisher import get_broker_client, publish_many
+
+        client = get_broker_client()
+        client.delete("batch_test_queue")
+        adapter = EmailAdapter()
+        signatures = [
+            adapter.signature(
+                f"log-{i}",
+                {
+                    "to": "a@example.com",
+                    "subject": "s",
+                    "body": "b",
+                    "queue": "batch_test_queue",
+                },
+            )
+            for i in range(3)
+        ]
+
+        self.assertEqual(publish_many(signatures), 3)
+
+        messages = [json.loads(m) for m in client.lrange("batch_test_queue", 0, -1)]
+        client.delete("batch_test_queue")
+        self.assertEqual(len(messages), 3)
+        self.assertEqual(
+            {m["headers"]["task"] for m in messages},
+            {"notifications.tasks.send_email_task"},
+        )
+
+    def test_publish_many_matches_apply_async_messages(self):
+        """Test that pipelined messages match apply_async's and decode through kombu"""
+        import base64
+        import json
+        import uuid
+
+        from django.conf import settings
+        from kombu import Connection
+
+        from .adapters import EmailAdapter
+        from .publisher import get_broker_client, publish_many
+
+        client = get_broker_client()
+        payload = {"to": "a@example.com", "subject": "s", "body": "b"}
+        pipelined_queue = f"batch_test_{uuid.uuid4().hex}"
+        direct_queue = f"batch_test_{uuid.uuid4().hex}"
+        adapter = EmailAdapter()
+
+        publish_many([adapter.signature("log-1", {**payload, "queue": pipelined_queue})])
+        adapter.signature("log-1", {**payload, "queue": direct_queue}).apply_async(
+            ignore_result=True
+        )
+
+        pipelined = json.loads(client.lindex(pipelined_queue, 0))
+        direct = json.loads(client.lpop(direct_queue))
+        self.assertEqual(pipelined.keys(), direct.keys())
+        self.assertEqual(pipelined["headers"].keys(), direct["headers"].keys())
+        self.assertEqual(pipelined["properties"].keys(), direct["properties"].keys())
+        self.assertEqual(
+            base64.b64decode(pipelined["body"]), base64.b64decode(direct["body"])
+        )
+        self.assertIn("published_at", pipelined["headers"])
+
+        with Connection(settings.CELERY_BROKER_URL) as connection:
+            queue = connection.SimpleQueue(pipelined_queue)
+            message = queue.get(timeout=1)
+            message.ack()
+            queue.close()
+        client.delete(pipelined_queue)
+        self.assertEqual(message.headers["task"], "notifications.tasks.send_email_task")
+        self.assertEqual(message.decode()[0], ["log-1", "a@example.com", "s", "b"])
+
+
+class TemplateCacheTest(TestCase):
+    """Test the per-process template cache"""
+
+    def setUp(self):
+        self.template = NotificationTemplate.objects.create(
+            name="cached_email",
+            channel="email",
+            subject="Cached",
+            body_template="Hello {name}!",
+        )
+
+    def test_repeated_lookups_skip_database(self):
+        """Test that a cached template is served without a query"""
+        from .template_cache import TemplateCache
+
+        cache = TemplateCache(check_interval=60)
+        cache.get("cached_email")
+        with self.assertNumQueries(0):
+            template = cache.get("cached_email")
+
+        self.assertEqual(template.id, self.template.id)
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_missing_template_raises_does_not_exist(self):
+        """Test that unknown names raise DoesNotExist"""
+        from .template_cache import TemplateCache
+
+        with self.assertRaises(NotificationTemplate.DoesNotExist):
+            TemplateCache().get("no_such_template")
+
+    def test_save_invalidates_other_processes(self):
+        """Test that saving a template drops entries cached elsewhere"""
+        from .template_cache import TemplateCache, template_cache
+
+        other_process = TemplateCache(check_interval=0)
+        other_process.get("cached_email")
+
+        self.template.body_template = "Hi {name}!"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.template.save()
+
+        self.assertEqual(template_cache.stats()["size"], 0)
+        self.assertEqual(
+            other_process.get("cached_email").body_template, "Hi {name}!"
+        )
+
+
+class CompiledTemplateTest(TestCase):
+    """Test the precompiled template renderer"""
+
+    def test_renders_like_str_format(self):
+        """Test that compiled output matches str.format"""
+        from .rendering import CompiledTemplate
+
+        source = "{{literal}} Hi {name}, order {order_id}: {amount:>6} {name!r}"
+        context = {"name": "Ada", "order_id": "A-1", "amount": "9.99"}
+        self.assertEqual(
+            CompiledTemplate(source).render(context), source.format(**context)
+        )
+        self.assertEqual(
+            CompiledTemplate("Hi {name}, {code}").render({"name": "Ada", "code": 7}),
+            "Hi Ada, 7",
+        )
+
+    def test_reports_all_missing_variables(self):
+        """Test that every missing variable is reported in one error"""
+        from .rendering import CompiledTemplate, MissingVariablesError
+
+        compiled = CompiledTemplate("Hi {name}, your code is {code} ({user.id})")
+        self.assertEqual(compiled.variables, {"name", "code", "user"})
+        with self.assertRaises(MissingVariablesError) as ctx:
+            compiled.render({"name": "Ada"})
+        self.assertEqual(ctx.exception.missing, ["code", "user"])
+
+    def test_send_rejects_all_missing_variables(self):
+        """Test that the send endpoint lists every missing variable"""
+        NotificationTemplate.objects.create(
+            name="two_vars", channel="email", body_template="{greeting} {name}"
+        )
+        response = APIClient().post(
+            "/api/notifications/send/",
+            {"template_name": "two_vars", "user_id": "u", "to": "a@example.com"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("'greeting', 'name'", str(response.data["context"]))
+
+
+class RateLimiterTest(TestCase):
+    """Test the Lua-backed rate limiter"""
+
+    def _key(self):
+        import uuid
+
+        return f"test:{uuid.uuid4().hex}"
+
+    def test_each_algorithm_enforces_limit(self):
+        """Test that every algorithm admits max_requests and then rejects"""
+        from .rate_limiter import RateLimiter
+
+        for algorithm in ("fixed_window", "sliding_log", "gcra", "token_bucket"):
+            with self.subTest(algorithm=algorithm):
+                limiter = RateLimiter(max_requests=3, window=60, algorithm=algorithm)
+                key = self._key()
+                results = [limiter.check(key) for _ in range(4)]
+
+                self.assertEqual([r.allowed for r in results], [True] * 3 + [False])
+                self.assertEqual([r.remaining for r in results], [2, 1, 0, 0])
+                self.assertGreater(results[-1].retry_after, 0)
+
+    def test_unknown_algorithm_is_rejected(self):
+        """Test that unknown algorithms fail fast"""
+        from .rate_limiter import RateLimiter
+
+        with self.assertRaises(ValueError):
+            RateLimiter(algorithm="leaky")
+
+    def test_tiers_are_checked_and_charged_together(self):
+        """Test that a rejected request charges no tier"""
+        from .rate_limiter import TieredRateLimiter
+
+        user = self._key()
+        limiter = TieredRateLimiter.from_settings(
+            [
+                {"name": "user", "key": "{user_id}", "max_requests": 5, "window": 60},
+                {
+                    "name": "tenant",
+                    "key": "{tenant}",
+                    "max_requests": 1,
+                    "window": 60,
+                    "algorithm": "gcra",
+                },
+            ]
+        )
+
+        first = limiter.check(user_id=user, tenant=user)
+        rejected = [limiter.check(user_id=user, tenant=user) for _ in range(3)]
+        untenanted = limiter.check(user_id=user)
+
+        self.assertTrue(first.allowed)
+        self.assertTrue(all(not r.allowed for r in rejected))
+        self.assertEqual(rejected[0].tier, "tenant")
+        self.assertGreater(rejected[0].retry_after, 0)
+        # Only the first and the tenant-less request reached the user tier
+        self.assertTrue(untenanted.allowed)
+        self.assertEqual(untenanted.tier, "user")
+        self.assertEqual(untenanted.remaining, 3)
+
+    def test_batch_reloads_flushed_script(self):
+        """Test that a batch check survives Redis forgetting the script"""
+        from .rate_limiter import TieredRateLimiter, get_redis_client
+
+        limiter = TieredRateLimiter.from_settings(
+            [{"name": "user", "key": "{user_id}", "max_requests": 1, "window": 60}]
+        )
+        first, second = self._key(), self._key()
+        get_redis_client().script_flush()
+
+        results = limiter.check_many(
+            [{"user_id": first}, {"user_id": second}, {"user_id": first}]
+        )
+
+        self.assertEqual([r.allowed for r in results], [True, True, False])
+
+    def test_local_fallback_enforces_process_share(self):
+        """Test that an unreachable Redis falls back to a local share of the quota"""
+        from unittest import mock
+
+        import redis
+
+        from . import rate_limiter
+        from .metrics import RATE_LIMIT_FALLBACK_ACTIVE
+
+        def unreachable(*args, **kwargs):
+            raise redis.ConnectionError("Connection refused")
+
+        fallback = rate_limiter.LocalRateLimiter(processes=2, retry_interval=60)
+        limiter = rate_limiter.RateLimiter(max_requests=4, window=60)
+        key = self._key()
+        with (
+            mock.patch.object(rate_limiter, "local_limiter", fallback),
+            mock.patch.object(rate_limiter, "_script", return_value=unreachable),
+        ):
+            results = [limiter.check(key) for _ in range(3)]
+            self.assertEqual(RATE_LIMIT_FALLBACK_ACTIVE._value.get(), 1)
+
+        self.assertEqual([r.allowed for r in results], [True, True, False])
+        self.assertTrue(fallback.active)
+
+        # The next successful Redis call leaves the fallback
+        with mock.patch.object(rate_limiter, "local_limiter", fallback):
+            fallback._failed_at = 0
+            self.assertTrue(limiter.check(key).allowed)
+        self.assertFalse(fallback.active)
+        self.assertEqual(RATE_LIMIT_FALLBACK_ACTIVE._value.get(), 0)
+
+    def test_rate_limited_response_has_retry_after(self):
+        """Test that a 429 carries a Retry-After header"""
+        NotificationTemplate.objects.create(
+            name="limited", channel="email", body_template="hi"
+        )
+        client = APIClient()
+        data = {"template_name": "limited", "user_id": self._key(), "to": "a@b.com"}
+        # GCRA has no window boundary that could reset the quota mid-test
+        limits = [
+            {
+                "name": "user",
+                "key": "{user_id}",
+                "max_requests": 10,
+                "window": 60,
+                "algorithm": "gcra",
+            }
+        ]
+        with self.settings(RATE_LIMITS=limits):
+            responses = [
+                client.post("/api/notifications/send/", data, format="json")
+                for _ in range(11)
+            ]
+
+        self.assertEqual(responses[-1].status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreaterEqual(int(responses[-1]["Retry-After"]), 1)
+
+
+class RedisIdempotencyTest(TestCase):
+    """Test the Redis idempotency fast path"""
+
+    def setUp(self):
+        import uuid
+
+        NotificationTemplate.objects.create(
+            name="idem_email", channel="email", body_template="Hello {name}!"
+        )
+        self.client = APIClient()
+        self.key = f"redis-idem-{uuid.uuid4().hex}"
+        self.data = {
+            "template_name": "idem_email",
+            "user_id": self.key,
+            "to": "idem@example.com",
+            "context": {"name": "Idem"},
+            "idempotency_key": self.key,
+        }
+
+    def _send(self):
+        return self.client.post("/api/notifications/send/", self.data, format="json")
+
+    def test_duplicate_is_answered_from_redis(self):
+        """Test that a duplicate request makes no database query"""
+        first = self._send()
+        self.assertEqual(first.status_code, status.HTTP_202_ACCEPTED)
+
+        with self.assertNumQueries(0):
+            second = self._send()
+
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.data["notification_id"], first.data["notification_id"])
+        self.assertEqual(second.data["status"], "pending")
+
+    def test_database_stays_source_of_truth(self):
+        """Test that a lost Redis entry still cannot create a duplicate"""
+        from .redis_clients import get_cache_client
+
+        first = self._send()
+        get_cache_client().delete(f"idempotency:{self.key}")
+        second = self._send()
+
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.data["notification_id"], first.data["notification_id"])
+        self.assertEqual(
+            NotificationLog.objects.filter(idempotency_key=self.key).count(), 1
+        )
+
+    def test_rate_limited_request_releases_reservation(self):
+        """Test that a rejected request does not keep the key reserved"""
+        from .redis_clients import get_cache_client
+
+        limits = [{"name": "none", "key": "{user_id}", "max_requests": 1, "window": 60}]
+        with self.settings(RATE_LIMITS=limits):
+            self.data["idempotency_key"] = f"{self.key}-a"
+            self._send()
+            self.data["idempotency_key"] = f"{self.key}-b"
+            rejected = self._send()
+
+        self.assertEqual(rejected.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIsNone(get_cache_client().get(f"idempotency:{self.key}-b"))
+
+    def test_render_error_releases_reservation(self):
+        """Test that a request failing to render can be retried with the same key"""
+        from .redis_clients import get_cache_client
+
+        self.data["context"] = {}
+        rejected = self._send()
+        self.assertEqual(rejected.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIsNone(get_cache_client().get(f"idempotency:{self.key}"))
+
+        self.data["context"] = {"name": "Idem"}
+        self.assertEqual(self._send().status_code, status.HTTP_202_ACCEPTED)
+
+
+class NotificationListAPITest(TestCase):
+    """Test keyset pagination of the list endpoint"""
+
+    def setUp(self):
+        template = NotificationTemplate.objects.create(
+            name="list_email", channel="email", body_template="Hello {name}!"
+        )
+        created_at = timezone.now()
+        logs = [
+            NotificationLog(
+                user_id="user_list", template=template, channel="email", to=f"{i}@example.com"
+            )
+            for i in range(5)
+        ]
+        NotificationLog.objects.bulk_create(logs)
+        # Identical timestamps make the id tie-break decide the order
+        NotificationLog.objects.update(created_at=created_at)
+        self.client = APIClient()
+
+    def test_pages_cover_every_row_once(self):
+        """Test that following next_cursor visits each notification exactly once"""
+        seen = []
+        cursor = None
+        while True:
+            params = {"user_id": "user_list", "limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            with self.assertNumQueries(1):
+                response = self.client.get("/api/notifications/list/", params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen += [row["notification_id"] for row in response.data["results"]]
+            cursor = response.data["next_cursor"]
+            if cursor is None:
+                break
+
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(len(set(seen)), 5)
+        self.assertEqual(response.data["results"][0]["template_name"], "list_email")
+
+    def test_rejects_bad_cursor_and_caps_limit(self):
+        """Test that a malformed cursor is a 400 and limit is capped"""
+        bad = self.client.get("/api/notifications/list/", {"cursor": "not-a-cursor"})
+        self.assertEqual(bad.status_code, status.HTTP_400_BAD_REQUEST)
+
+        with self.settings(NOTIFICATION_LIST_MAX_LIMIT=3):
+            capped = self.client.get("/api/notifications/list/", {"limit": 1000})
+        self.assertEqual(capped.data["count"], 3)
+        self.assertIsNotNone(capped.data["next_cursor"])
+
+
+class NotificationExportTest(TestCase):
+    """Test the streaming export"""
+
+    def setUp(self):
+        template = NotificationTemplate.objects.create(
+            name="export_email", channel="email", body_template="Hello {name}!"
+        )
+        for i, channel in enumerate(["email", "sms", "email"]):
+            NotificationLog.objects.create(
+                user_id=f"user_{i}", template=template, channel=channel, to=f"{i}@x.io"
+            )
+        self.client = APIClient()
+
+    def test_endpoint_streams_ndjson_and_gzipped_csv(self):
+        """Test that the endpoint streams filtered rows in both formats"""
+        import csv
+        import gzip
+        import io
+        import json
+
+        response = self.client.get("/api/notifications/export/", {"channel": "email"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual([row["user_id"] for row in rows], ["user_0", "user_2"])
+        self.assertEqual(rows[0]["template_name"], "export_email")
+
+        response = self.client.get("/api/notifications/export/", {"output": "csv", "gzip": "1"})
+        text = gzip.decompress(b"".join(response.streaming_content)).decode()
+        rows = list(csv.DictReader(io.StringIO(text)))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[1]["channel"], "sms")
+
+    def test_invalid_filters_are_rejected(self):
+        """Test that bad dates and formats return 400 / CommandError"""
+        from django.core.management import CommandError, call_command
+
+        response = self.client.get("/api/notifications/export/", {"start": "yesterday"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get("/api/notifications/export/", {"output": "xml"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with self.assertRaises(CommandError):
+            call_command("export_notifications", start="2024-13-45")
+
+
+class DeliveryEngineTest(TestCase):
+    """Test the shared delivery engine"""
+
+    def setUp(self):
+        self.template = NotificationTemplate.objects.create(
+            name="delivery_email", channel="email", subject="Hi", body_template="Hi"
+        )
+
+    def _log(self, **fields):
+        return NotificationLog.objects.create(
+            user_id="user_delivery",
+            template=self.template,
+            channel="email",
+            to="delivery@example.com",
+            **fields,
+        )
+
+    def test_success_takes_one_select_and_one_update(self):
+        """Test that a delivery records its outcome in a single UPDATE"""
+        from django.core import mail
+
+        from .tasks import send_email_task
+
+        log = self._log()
+        with self.assertNumQueries(2):
+            send_email_task.apply(args=[str(log.id), log.to, "Hi", "Body"])
+
+        log.refresh_from_db()
+        self.assertEqual(log.status, "sent")
+        self.assertIsNotNone(log.sent_at)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_terminal_logs_are_not_sent_again(self):
+        """Test that sent or failed logs skip the provider"""
+        from django.core import mail
+
+        from .tasks import send_email_task
+
+        log = self._log(status="sent")
+        with self.assertNumQueries(1):
+            send_email_task.apply(args=[str(log.id), log.to, "Hi", "Body"])
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_provider_metadata_and_failure_are_recorded(self):
+        """Test that metadata is stored with the status and final failures stop retrying"""
+        from unittest import mock
+
+        from .providers import PROVIDERS
+        from .tasks import send_sms_task
+
+        log = self._log()
+        with mock.patch.object(PROVIDERS["sms"], "send", return_value={"twilio_sid": "SM1"}):
+            send_sms_task.apply(args=[str(log.id), "+15550000000", "Body"])
+        log.refresh_from_db()
+        self.assertEqual(log.provider_config, {"twilio_sid": "SM1"})
+
+        log = self._log(max_retries=1)
+        with mock.patch.object(PROVIDERS["sms"], "send", side_effect=RuntimeError("down")):
+            send_sms_task.apply(args=[str(log.id), "+15550000000", "Body"])
+        log.refresh_from_db()
+        self.assertEqual(log.status, "failed")
+        self.assertEqual(log.error_message, "down")
+
+
+class SMTPConnectionPoolTest(TestCase):
+    """Test SMTP connection reuse"""
+
+    def _message(self):
+        from django.core.mail import EmailMessage
+
+        return EmailMessage("Hi", "Body", "pulse@example.com", ["pool@example.com"])
+
+    def test_connections_are_reused_and_recycled(self):
+        """Test that one connection carries messages until max_messages"""
+        from .smtp_pool import SMTPConnectionPool
+
+        pool = SMTPConnectionPool(size=1, idle_timeout=30, max_messages=2)
+        pool.send(self._message())
+        first = pool._idle[0]
+        pool.send(self._message())
+
+        self.assertEqual(first.messages, 2)
+        self.assertEqual(pool._idle, [])  # recycled after max_messages
+
+    def test_stale_connection_is_replaced(self):
+        """Test that a dropped connection is reopened and the message still sent"""
+        import smtplib
+        from unittest import mock
+
+        from django.core import mail
+
+        from .smtp_pool import SMTPConnectionPool
+
+        pool = SMTPConnectionPool(size=1, idle_timeout=30, max_messages=100)
+        pool.send(self._message())
+        stale = pool._idle[0]
+        stale.backend.send_messages = mock.Mock(
+            side_effect=smtplib.SMTPServerDisconnected("gone")
+        )
+        pool.send(self._message())
+
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertIsNot(pool._idle[0], stale)
+
+
+class TwilioClientReuseTest(TestCase):
+    """Test that SMS delivery keeps one keep-alive client per process"""
+
+    def test_messages_share_one_connection(self):
+        """Test that consecutive sends reuse the client and its connection"""
+        import json
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        from .providers import SMSProvider
+
+        peers = []
+
+        class StubHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                peers.append(self.client_address)
+                body = json.dumps({"sid": f"SM{len(peers)}"}).encode()
+                self.send_response(201)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.shutdown)
+
+        provider = SMSProvider()
+        base_url = f"http://127.0.0.1:{server.server_port}"
+        with self.settings(
+            TWILIO_BASE_URL=base_url, TWILIO_ACCOUNT_SID="AC1", TWILIO_AUTH_TOKEN="t"
+        ):
+            first = provider.send("+15550000001", "one")
+            client = provider.client()
+            second = provider.send("+15550000002", "two")
+
+        self.assertEqual(first, {"twilio_sid": "SM1"})
+        self.assertEqual(second, {"twilio_sid": "SM2"})
+        self.assertIs(provider.client(), client)
+        self.assertEqual(len(set(peers)), 1)  # same client port: connection reused
+
+
+class AsyncDeliveryWorkerTest(TransactionTestCase):
+    """Test the asyncio delivery worker end to end against Redis"""
+
+    def test_worker_delivers_queued_messages(self):
+        """Test that queued deliveries are sent once and recorded"""
+        import asyncio
+        import uuid
+
+        import redis.asyncio
+        from django.conf import settings
+        from django.core import mail
+
+        from .async_delivery import AsyncDeliveryWorker
+        from .publisher import publish_many
+        from .tasks import send_email_task
+
+        template = NotificationTemplate.objects.create(
+            name="async_email", channel="email", subject="Hi", body_template="Hi"
+        )
+        logs = [
+            NotificationLog.objects.create(
+                user_id="user_async", template=template, channel="email", to=f"{i}@x.io"
+            )
+            for i in range(3)
+        ]
+        NotificationLog.objects.filter(id=logs[2].id).update(status="sent")
+        queue = f"async_test_{uuid.uuid4().hex}"
+        publish_many(
+            send_email_task.signature(args=[str(log.id), log.to, "Hi", "Body"], queue=queue)
+            for log in logs
+        )
+
+        async def run():
+            client = redis.asyncio.Redis.from_url(settings.CELERY_BROKER_URL)
+            worker = AsyncDeliveryWorker([queue], concurrency=10, db_threads=2, redis_client=client)
+            runner = asyncio.create_task(worker.run())
+            while await client.llen(queue) or worker._inflight:
+                await asyncio.sleep(0.05)
+            worker.stop()
+            await runner
+            await client.aclose()
+
+        asyncio.run(run())
+
+        statuses = dict(NotificationLog.objects.values_list("to", "status"))
+        self.assertEqual(statuses, {"0@x.io": "sent", "1@x.io": "sent", "2@x.io": "sent"})
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ["0@x.io", "1@x.io"])
+
+    def test_messages_not_due_are_parked_without_a_slot(self):
+        """Test that an ETA message waits in the delayed set, not in a slot"""
+        import asyncio
+        import uuid
+
+        import redis.asyncio
+        from django.conf import settings
+        from django.core import mail
+
+        from .async_delivery import AsyncDeliveryWorker
+        from .publisher import publish_many
+        from .tasks import send_email_task
+
+        template = NotificationTemplate.objects.create(
+            name="async_eta_email", channel="email", subject="Hi", body_template="Hi"
+        )
+        later, now = [
+            NotificationLog.objects.create(
+                user_id="user_async", template=template, channel="email", to=to
+            )
+            for to in ("later@x.io", "now@x.io")
+        ]
+        queue = f"async_test_{uuid.uuid4().hex}"
+        delayed_key = f"async_test_delayed_{uuid.uuid4().hex}"
+        publish_many(
+            [
+                send_email_task.signature(
+                    args=[str(later.id), later.to, "Hi", "Body"], queue=queue, countdown=1
+                ),
+                send_email_task.signature(args=[str(now.id), now.to, "Hi", "Body"], queue=queue),
+            ]
+        )
+
+        async def run():
+            client = redis.asyncio.Redis.from_url(settings.CELERY_BROKER_URL)
+            # One slot: the due message can only be sent if the parked one
+            # does not hold it
+            worker = AsyncDeliveryWorker([queue], concurrency=1, db_threads=2, redis_client=client)
+            runner = asyncio.create_task(worker.run())
+            while len(mail.outbox) < 1:
+                await asyncio.sleep(0.05)
+            parked = await client.zcard(delayed_key)
+            while await client.zcard(delayed_key) or await client.llen(queue) or worker._inflight:
+                await asyncio.sleep(0.05)
+            worker.stop()
+            await runner
+            await client.aclose()
+            return parked
+
+        with self.settings(ASYNC_WORKER_DELAYED_KEY=delayed_key):
+            parked = asyncio.run(run())
+
+        self.assertEqual(parked, 1)
+        self.assertEqual([m.to[0] for m in mail.outbox], ["now@x.io", "later@x.io"])
+        self.assertEqual(
+            set(NotificationLog.objects.values_list("status", flat=True)), {"sent"}
+        )
+
+    def test_messages_of_a_killed_worker_are_requeued(self):
+        """Test that a worker requeues what its killed predecessor held"""
+        import asyncio
+        import uuid
+
+        import redis.asyncio
+        from django.conf import settings
+        from django.core import mail
+
+        from .async_delivery import AsyncDeliveryWorker
+        from .publisher import get_broker_client, publish_many
+        from .tasks import send_email_task
+
+        template = NotificationTemplate.objects.create(
+            name="async_requeue_email", channel="email", subject="Hi", body_template="Hi"
+        )
+        log = NotificationLog.objects.create(
+            user_id="user_async", template=template, channel="email", to="held@x.io"
+        )
+        queue = f"async_test_{uuid.uuid4().hex}"
+        name = f"async_test_{uuid.uuid4().hex}"
+        publish_many(
+            [send_email_task.signature(args=[str(log.id), log.to, "Hi", "Body"], queue=queue)]
+        )
+        # The predecessor took the message and died before recording it
+        processing_key = f"{settings.ASYNC_WORKER_PROCESSING_KEY}:{name}"
+        get_broker_client().lmove(queue, processing_key, "RIGHT", "LEFT")
+
+        async def run():
+            client = redis.asyncio.Redis.from_url(settings.CELERY_BROKER_URL)
+            worker = AsyncDeliveryWorker(
+                [queue], concurrency=10, db_threads=2, redis_client=client, name=name
+            )
+            runner = asyncio.create_task(worker.run())
+            while not mail.outbox or worker._inflight:
+                await asyncio.sleep(0.05)
+            worker.stop()
+            await runner
+            left = await client.llen(processing_key)
+            await client.aclose()
+            return left
+
+        self.assertEqual(asyncio.run(run()), 0)
+        self.assertEqual([m.to[0] for m in mail.outbox], ["held@x.io"])
+        self.assertEqual(NotificationLog.objects.get(id=log.id).status, "sent")
+
+
+class OutboxTest(TestCase):
+    """Test the transactional outbox"""
+
+    def setUp(self):
+        NotificationTemplate.objects.create(
+            name="outbox_email", channel="email", subject="Hi", body_template="Hello {name}!"
+        )
+        self.client = APIClient()
+
+    def _item(self, user_id):
+        return {
+            "template_name": "outbox_email",
+            "user_id": user_id,
+            "to": "outbox@example.com",
+            "context": {"name": "Outbox"},
+        }
+
+    def test_send_writes_outbox_and_dispatcher_publishes(self):
+        """Test that the API only writes the outbox and the dispatcher drains it"""
+        import json
+        import uuid
+
+        from .models import NotificationOutbox
+        from .outbox import dispatch_batch
+        from .publisher import get_broker_client
+
+        queue = f"outbox_test_{uuid.uuid4().hex}"
+        with self.settings(NOTIFICATION_OUTBOX_ENABLED=True):
+            response = self.client.post(
+                "/api/notifications/send/", self._item("user_outbox"), format="json"
+            )
+            batch = self.client.post(
+                "/api/notifications/send/batch/",
+                {"notifications": [self._item("user_outbox_a"), self._item("user_outbox_b")]},
+                format="json",
+            )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(batch.data["queued"], 2)
+        entry = NotificationOutbox.objects.get(log_id=response.data["notification_id"])
+        self.assertEqual(entry.task, "notifications.tasks.send_email_task")
+        self.assertEqual(NotificationOutbox.objects.count(), 3)
+
+        NotificationOutbox.objects.update(queue=queue)
+        self.assertEqual(dispatch_batch(2), 2)
+        self.assertEqual(dispatch_batch(2), 1)
+        self.assertEqual(dispatch_batch(2), 0)
+
+        client = get_broker_client()
+        messages = client.lrange(queue, 0, -1)
+        client.delete(queue)
+        self.assertEqual(len(messages), 3)
+        tasks = {json.loads(m)["headers"]["task"] for m in messages}
+        self.assertEqual(tasks, {"notifications.tasks.send_email_task"})
+
+    def test_dispatcher_survives_a_failing_batch(self):
+        """Test that the dispatch loop logs a failure, backs off and carries on"""
+        import os
+        import signal
+        from io import StringIO
+        from unittest import mock
+
+        from django.core.management import call_command
+
+        from .management.commands import dispatch_outbox
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            self.addCleanup(signal.signal, signum, signal.getsignal(signum))
+
+        calls = []
+
+        def dispatch_batch(batch_size):
+            calls.append(batch_size)
+            if len(calls) == 1:
+                raise RuntimeError("Broker unreachable")
+            os.kill(os.getpid(), signal.SIGTERM)  # stop after this batch
+            return 2
+
+        out = StringIO()
+        with (
+            mock.patch.object(dispatch_outbox, "dispatch_batch", side_effect=dispatch_batch),
+            mock.patch.object(dispatch_outbox, "close_old_connections"),
+            mock.patch.object(dispatch_outbox.time, "sleep") as sleep,
+            self.assertLogs("notifications.outbox", "ERROR") as logs,
+        ):
+            call_command("dispatch_outbox", batch_size=5, poll_interval=1, stdout=out)
+
+        self.assertEqual(calls, [5, 5])
+        # Backoff after the failure, then the usual idle poll
+        self.assertEqual([c.args[0] for c in sleep.call_args_list], [2, 1])
+        self.assertIn("Broker unreachable", logs.output[0])
+        self.assertIn("Published 2 outbox entries", out.getvalue())
+
+
+class StatusBufferTest(TestCase):
+    """Test buffered status write-back"""
+
+    def setUp(self):
+        self.template = NotificationTemplate.objects.create(
+            name="buffer_sms", channel="sms", body_template="Hi"
+        )
+
+    def _log(self, **fields):
+        return NotificationLog.objects.create(
+            user_id="user_buffer", template=self.template, channel="sms", to="+1", **fields
+        )
+
+    def test_outcomes_are_flushed_together(self):
+        """Test that deliveries are written in one flush once the buffer is full"""
+        from unittest import mock
+
+        from .delivery import deliver
+        from .providers import PROVIDERS
+        from .status_buffer import StatusBuffer
+        from .tasks import send_sms_task
+
+        buffer = StatusBuffer(size=3, max_delay=60)
+        sent, retried, done = self._log(), self._log(), self._log(status="sent")
+
+        with self.settings(STATUS_BUFFER_ENABLED=True), mock.patch(
+            "notifications.delivery.get_status_buffer", return_value=buffer
+        ):
+            with mock.patch.object(PROVIDERS["sms"], "send", return_value={"twilio_sid": "SM1"}):
+                send_sms_task.apply(args=[str(sent.id), "+1", "Hi"])
+            task = mock.Mock()
+            task.retry.return_value = RuntimeError("retry scheduled")
+            with mock.patch.object(PROVIDERS["sms"], "send", side_effect=RuntimeError("down")):
+                with self.assertRaisesMessage(RuntimeError, "retry scheduled"):
+                    deliver(task, "sms", str(retried.id), "+1", "Hi")
+            sent.refresh_from_db()
+            self.assertEqual(sent.status, "pending")  # still buffered
+
+            # A stale outcome for an already-sent log fills the buffer
+            buffer.add(str(done.id), "failed", error_message="late")
+
+        for log in (sent, retried, done):
+            log.refresh_from_db()
+        self.assertEqual((sent.status, sent.provider_config), ("sent", {"twilio_sid": "SM1"}))
+        self.assertEqual((retried.status, retried.attempts), ("retrying", 1))
+        self.assertIsNotNone(retried.next_retry_at)
+        self.assertEqual((done.status, done.error_message), ("sent", None))
+
+    def test_flush_drains_partial_buffer(self):
+        """Test that an explicit flush (as on shutdown) writes what is buffered"""
+        from django.utils import timezone
+
+        from .status_buffer import StatusBuffer
+
+        log = self._log(status="retrying", attempts=2)
+        buffer = StatusBuffer(size=100, max_delay=60)
+        buffer.add(
+            str(log.id),
+            "failed",
+            error_message="gone",
+            next_retry_at=None,
+            last_attempt_at=timezone.now(),
+        )
+
+        self.assertEqual(buffer.flush(), 1)
+        log.refresh_from_db()
+        self.assertEqual((log.status, log.attempts, log.error_message), ("failed", 2, "gone"))
+        self.assertIsNone(log.next_retry_at)
+
+
+class RetrySchedulerTest(TestCase):
+    """Test retries parked in the Redis retry schedule"""
+
+    def setUp(self):
+        import uuid
+
+        self.template = NotificationTemplate.objects.create(
+            name="retry_sms", channel="sms", body_template="Hi"
+        )
+        self.key = f"retry_test_{uuid.uuid4().hex}"
+        self.queue = f"retry_test_queue_{uuid.uuid4().hex}"
+
+    def tearDown(self):
+        from .retry_scheduler import get_schedule_client
+
+        get_schedule_client().delete(self.key, self.queue)
+
+    def test_retry_delay_is_jittered(self):
+        """Test that backoff stays between half and all of the exponential delay"""
+        from .delivery import retry_delay
+
+        delays = {retry_delay(3) for _ in range(50)}
+        self.assertTrue(all(240 <= delay <= 480 for delay in delays))
+        self.assertGreater(len(delays), 1)
+
+    def test_failed_delivery_is_parked_then_promoted(self):
+        """Test that a retry waits in the sorted set until the promoter publishes it"""
+        import json
+        import time
+        from unittest import mock
+
+        from .delivery import deliver
+        from .providers import PROVIDERS
+        from .retry_scheduler import get_schedule_client, promote_due
+
+        log = NotificationLog.objects.create(
+            user_id="user_retry", template=self.template, channel="sms", to="+1"
+        )
+        task = mock.Mock()
+        task.name = "notifications.tasks.send_sms_task"
+        task.request.args = [str(log.id), "+1", "Hi"]
+        task.request.kwargs = {}
+        task.request.delivery_info = {"routing_key": self.queue}
+
+        with self.settings(RETRY_SCHEDULER_ENABLED=True, RETRY_SCHEDULE_KEY=self.key):
+            with mock.patch.object(PROVIDERS["sms"], "send", side_effect=RuntimeError("down")):
+                deliver(task, "sms", str(log.id), "+1", "Hi")
+            task.retry.assert_not_called()
+
+            client = get_schedule_client()
+            [(entry, due)] = client.zrange(self.key, 0, -1, withscores=True)
+            self.assertTrue(59 <= due - time.time() <= 120)
+            self.assertEqual(promote_due(100), 0)  # not due yet
+
+            client.zadd(self.key, {entry: time.time() - 1}, xx=True)
+            self.assertEqual(promote_due(100), 1)
+
+        self.assertEqual(client.zcard(self.key), 0)
+        [message] = [json.loads(m) for m in client.lrange(self.queue, 0, -1)]
+        self.assertEqual(message["headers"]["task"], "notifications.tasks.send_sms_task")
+        log.refresh_from_db()
+        self.assertEqual((log.status, log.attempts), ("retrying", 1))
+
+    def test_unavailable_schedule_falls_back_to_countdown(self):
+        """Test that a retry that cannot be parked becomes a Celery countdown"""
+        from unittest import mock
+
+        import redis
+
+        from . import retry_scheduler
+        from .delivery import deliver
+        from .providers import PROVIDERS
+
+        log = NotificationLog.objects.create(
+            user_id="user_retry", template=self.template, channel="sms", to="+1"
+        )
+        task = mock.Mock()
+        task.name = "notifications.tasks.send_sms_task"
+        task.request.args = [str(log.id), "+1", "Hi"]
+        task.request.kwargs = {}
+        task.request.delivery_info = {"routing_key": self.queue}
+        task.retry.side_effect = RuntimeError("retry")
+        client = mock.Mock()
+        client.zadd.side_effect = redis.ConnectionError("Connection refused")
+
+        with (
+            self.settings(RETRY_SCHEDULER_ENABLED=True, RETRY_SCHEDULE_KEY=self.key),
+            mock.patch.object(retry_scheduler, "get_schedule_client", return_value=client),
+            mock.patch.object(PROVIDERS["sms"], "send", side_effect=RuntimeError("down")),
+        ):
+            with self.assertRaisesMessage(RuntimeError, "retry"):
+                deliver(task, "sms", str(log.id), "+1", "Hi")
+
+        self.assertTrue(60 <= task.retry.call_args.kwargs["countdown"] <= 120)
+
+
+class RetentionCleanupTest(TestCase):
+    """Test batched retention cleanup"""
+
+    def setUp(self):
+        from django.utils import timezone
+
+        from .redis_clients import get_state_client
+        from .retention import WATERMARK_KEY
+
+        get_state_client().delete(WATERMARK_KEY)
+        template = NotificationTemplate.objects.create(
+            name="retention_email", channel="email", body_template="Hi"
+        )
+        for status_ in ("sent", "sent", "failed", "sent", "failed", "pending"):
+            NotificationLog.objects.create(
+                user_id="user_old", template=template, channel="email", to="a@b.c", status=status_
+            )
+        NotificationLog.objects.update(created_at=timezone.now() - timezone.timedelta(days=40))
+        self.recent = NotificationLog.objects.create(
+            user_id="user_new", template=template, channel="email", to="a@b.c", status="sent"
+        )
+
+    def test_batches_archive_to_table_and_resume(self):
+        """Test that a run stopped by its budget resumes and archives every row"""
+        from .models import NotificationLogArchive
+        from .retention import cleanup
+
+        first = cleanup(30, batch_size=2, pause=0, time_budget=0, archive="table")
+        self.assertEqual((first.deleted, first.batches, first.finished), (2, 1, False))
+
+        rest = cleanup(30, batch_size=2, pause=0, archive="table")
+        self.assertEqual((rest.deleted, rest.finished), (3, True))
+
+        remaining = set(NotificationLog.objects.values_list("status", "user_id"))
+        self.assertEqual(remaining, {("pending", "user_old"), ("sent", "user_new")})
+        self.assertEqual(NotificationLogArchive.objects.count(), 5)
+        archived = NotificationLogArchive.objects.filter(status="failed").first()
+        self.assertEqual(archived.template_id, self.recent.template_id)
+
+    def test_unreadable_watermark_does_not_start_over(self):
+        """Test that a failed watermark read stops the run instead of rescanning"""
+        from unittest import mock
+
+        import redis
+
+        from . import retention
+
+        first = retention.cleanup(30, batch_size=2, pause=0, time_budget=0)
+        self.assertEqual(first.deleted, 2)
+
+        down = mock.Mock()
+        down.get.side_effect = redis.ConnectionError("Connection refused")
+        with (
+            mock.patch.object(retention, "get_state_client", return_value=down),
+            self.assertRaises(redis.ConnectionError),
+        ):
+            retention.cleanup(30, batch_size=2, pause=0)
+        self.assertEqual(NotificationLog.objects.count(), 5)
+
+        rest = retention.cleanup(30, batch_size=2, pause=0)
+        self.assertEqual((rest.deleted, rest.batches, rest.finished), (3, 2, True))
+
+    def test_rollups_are_pruned_with_the_logs(self):
+        """Test that cleanup drops the rollups of hours before the cutoff"""
+        from django.utils import timezone
+
+        from .models import NotificationHourlyRollup
+        from .retention import cleanup
+
+        hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+        for days in (40, 0):
+            NotificationHourlyRollup.objects.create(
+                hour=hour - timezone.timedelta(days=days),
+                channel="email",
+                status="sent",
+                template_id=self.recent.template_id,
+                count=1,
+                attempts_sum=0,
+                max_attempts=0,
+            )
+
+        cleanup(30, pause=0)
+
+        self.assertEqual(
+            list(NotificationHourlyRollup.objects.values_list("hour", flat=True)), [hour]
+        )
+
+    def test_archive_to_gzipped_ndjson(self):
+        """Test that file archival writes every deleted row"""
+        import gzip
+        import json
+        import os
+        import tempfile
+
+        from .retention import cleanup
+
+        with tempfile.TemporaryDirectory() as directory:
+            with self.settings(RETENTION_ARCHIVE_DIR=directory):
+                result = cleanup(30, batch_size=2, pause=0, archive="file")
+            [name] = os.listdir(directory)
+            with gzip.open(os.path.join(directory, name), "rt") as archive:
+                rows = [json.loads(line) for line in archive]
+
+        self.assertEqual(result.deleted, 5)
+        self.assertEqual(len(rows), 5)
+        self.assertEqual({row["status"] for row in rows}, {"sent", "failed"})
+
+
+class LogPartitioningTest(TestCase):
+    """Test range partitioning of NotificationLog (PostgreSQL only)"""
+
+    def setUp(self):
+        from django.db import connection
+
+        if connection.vendor != "postgresql":
+            self.skipTest("Partitioning requires PostgreSQL")
+        self.template = NotificationTemplate.objects.create(
+            name="partition_email", channel="email", body_template="Hi"
+        )
+
+    def test_partitions_prune_dedupe_and_expire(self):
+        """Test pruning, idempotency across partitions and retention by DROP"""
+        from django.db import IntegrityError, connection, transaction
+        from django.utils import timezone
+
+        from . import partitions
+        from .retention import cleanup
+
+        forty_days_ago = timezone.now() - timezone.timedelta(days=40)
+        old = NotificationLog.objects.create(
+            user_id="user_part", template=self.template, channel="email", to="a@b.c",
+            idempotency_key="part-old",
+        )
+        NotificationLog.objects.filter(id=old.id).update(created_at=forty_days_ago)
+
+        with self.settings(NOTIFICATION_LOG_PARTITIONS="day"):
+            self.assertEqual(partitions.convert("day", 2), 1)
+            self.assertTrue(partitions.is_partitioned())
+            log, created = NotificationLog.create_idempotent(
+                user_id="user_part", template=self.template, channel="email",
+                to="a@b.c", idempotency_key="part-new",
+            )
+            self.assertTrue(created)
+            duplicate, created = NotificationLog.create_idempotent(
+                user_id="user_part", template=self.template, channel="email",
+                to="a@b.c", idempotency_key="part-old",
+            )
+            self.assertEqual((duplicate.id, created), (old.id, False))
+            with self.assertRaises(IntegrityError), transaction.atomic():
+                NotificationLog.objects.create(
+                    user_id="user_part", template=self.template, channel="email",
+                    to="a@b.c", idempotency_key="part-new",
+                )
+
+            today = partitions.partition_name(timezone.now(), "day")
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "EXPLAIN SELECT * FROM notifications_notificationlog "
+                    "WHERE created_at >= date_trunc('day', now())"
+                )
+                plan = "\n".join(row[0] for row in cursor.fetchall())
+            self.assertIn(today, plan)
+            self.assertNotIn(partitions.partition_name(forty_days_ago, "day"), plan)
+
+            result = cleanup(30)
+
+        # Days 40 to 31 ago are dropped, one partition each
+        self.assertEqual((result.deleted, result.batches), (1, 10))
+        self.assertEqual(list(NotificationLog.objects.values_list("id", flat=True)), [log.id])
+
+    def test_straddling_partition_keeps_its_claims(self):
+        """Test that claims expire only up to the last dropped partition"""
+        from django.db import connection
+        from django.utils import timezone
+
+        from . import partitions
+
+        noon = timezone.now().replace(hour=12, minute=0, second=0, microsecond=0)
+        cutoff = noon - timezone.timedelta(days=5)
+        for key, created_at in (
+            ("part-dropped", cutoff - timezone.timedelta(days=2)),
+            ("part-straddling", cutoff - timezone.timedelta(hours=6)),
+        ):
+            log = NotificationLog.objects.create(
+                user_id="user_part", template=self.template, channel="email",
+                to="a@b.c", idempotency_key=key,
+            )
+            NotificationLog.objects.filter(id=log.id).update(created_at=created_at)
+
+        with self.settings(NOTIFICATION_LOG_PARTITIONS="day"):
+            partitions.convert("day", 1)
+            rows, _ = partitions.drop_expired(cutoff, "day")
+
+        self.assertEqual(rows, 1)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT idempotency_key FROM notifications_idempotencyclaim")
+            claims = {row[0] for row in cursor.fetchall()}
+        self.assertEqual(claims, {"part-straddling"})
+
+    def test_deleted_rows_release_their_idempotency_keys(self):
+        """Test that deleting a log outside retention frees its key for reuse"""
+        from django.db import connection
+
+        from . import partitions
+
+        fields = dict(user_id="user_part", channel="email", to="a@b.c")
+        with self.settings(NOTIFICATION_LOG_PARTITIONS="month"):
+            partitions.convert("month", 1)
+            NotificationLog.create_idempotent(
+                template=self.template, idempotency_key="part-cascade", **fields
+            )
+            self.template.delete()  # cascades to the log
+
+            template = NotificationTemplate.objects.create(
+                name="partition_email", channel="email", body_template="Hi"
+            )
+            log, created = NotificationLog.create_idempotent(
+                template=template, idempotency_key="part-cascade", **fields
+            )
+            self.assertTrue(created)
+
+            # Claims orphaned before the delete trigger existed are swept
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "INSERT INTO notifications_idempotencyclaim VALUES ('part-orphan', now())"
+                )
+            partitions.install_claim_triggers()
+            self.assertEqual(partitions.remove_orphaned_claims(), 1)
+
+
+class DailyDigestTest(TestCase):
+    """Test the chunked, checkpointed daily digest"""
+
+    def setUp(self):
+        import uuid
+        from datetime import date
+
+        from django.utils import timezone
+
+        from .digest import window
+        from .publisher import get_broker_client
+        from .redis_clients import get_state_client
+
+        self.day = date(2001, 1, 2)
+        self.queue = f"digest_test_{uuid.uuid4().hex}"
+        self.broker = get_broker_client()
+        self.redis = get_state_client()
+        self.redis.delete(
+            *(
+                f"digest:2001-01-02:{name}"
+                for name in ("done", "in_flight", "checkpoint", "running")
+            )
+        )
+
+        NotificationTemplate.objects.create(
+            name="daily_digest",
+            channel="email",
+            subject="Your day",
+            body_template="{sent} of {total} sent, {failed} failed on {date}",
+        )
+        email = NotificationTemplate.objects.create(
+            name="digest_src", channel="email", body_template="x"
+        )
+        sms = NotificationTemplate.objects.create(
+            name="digest_sms", channel="sms", body_template="x"
+        )
+        for user_id, template, to, status_ in (
+            ("user_a", email, "a@example.com", "sent"),
+            ("user_a", email, "a@example.com", "failed"),
+            ("user_b", email, "b@example.com", "sent"),
+            ("user_c", sms, "+1555", "sent"),  # no email address
+        ):
+            NotificationLog.objects.create(
+                user_id=user_id, template=template, channel=template.channel, to=to, status=status_
+            )
+        NotificationLog.objects.update(created_at=window(self.day)[0] + timezone.timedelta(hours=1))
+
+    def tearDown(self):
+        self.broker.delete(self.queue)
+
+    def _messages(self):
+        import json
+
+        messages = [json.loads(m) for m in self.broker.lrange(self.queue, 0, -1)]
+        self.broker.delete(self.queue)
+        return messages
+
+    def test_chunks_are_bounded_checkpointed_and_idempotent(self):
+        """Test that chunks respect the in-flight limit and resume after the checkpoint"""
+        import base64
+        import json
+
+        from .digest import dispatch
+        from .tasks import send_digest_chunk
+
+        with self.settings(DIGEST_QUEUE=self.queue, DIGEST_CHUNK_SIZE=2, DIGEST_MAX_IN_FLIGHT=1):
+            self.assertEqual(dispatch(self.day), (1, False))
+            self.assertEqual(dispatch(self.day), (0, False))  # no free slot
+
+            [chunk] = self._messages()
+            args = json.loads(base64.b64decode(chunk["body"]))[0]
+            self.assertEqual(args, ["2001-01-02", ["user_a", "user_b"]])
+            self.assertEqual(send_digest_chunk.apply(args=args).get(), 2)
+            self.assertEqual(len(self._messages()), 2)  # two digest emails
+
+            self.assertEqual(dispatch(self.day), (1, True))  # resumes with user_c
+            [chunk] = self._messages()
+            args = json.loads(base64.b64decode(chunk["body"]))[0]
+            self.assertEqual(args[1], ["user_c"])
+            self.assertEqual(send_digest_chunk.apply(args=args).get(), 0)
+            self.assertEqual(dispatch(self.day), (0, True))
+
+            # A chunk that runs again sends nothing twice
+            self.assertEqual(send_digest_chunk.apply(args=["2001-01-02", ["user_a"]]).get(), 0)
+
+        digest = NotificationLog.objects.get(idempotency_key="digest:2001-01-02:user_a")
+        self.assertEqual(digest.to, "a@example.com")
+        self.assertEqual(
+            NotificationLog.objects.filter(template__name="daily_digest").count(), 2
+        )
+
+    def test_only_one_coordinator_chain_runs(self):
+        """Test that a second coordinator exits while the first holds the lease"""
+        from .digest import hold_lease, release_lease
+        from .tasks import send_daily_digest
+
+        lease = hold_lease(self.day)
+        self.assertIsNotNone(lease)
+        self.assertIsNone(hold_lease(self.day))
+        self.assertEqual(hold_lease(self.day, lease), lease)  # renewed by its holder
+
+        # Beat's next run neither dispatches nor re-enqueues itself
+        with self.settings(DIGEST_QUEUE=self.queue):
+            self.assertEqual(send_daily_digest.apply(args=["2001-01-02"]).get(), 0)
+        self.assertEqual(self._messages(), [])
+        self.assertIsNone(self.redis.get("digest:2001-01-02:checkpoint"))
+
+        release_lease(self.day, lease)
+        self.assertIsNotNone(hold_lease(self.day))
+
+    def test_redis_failure_retries_later_with_the_lease(self):
+        """Test that unreadable digest state stops the run instead of restarting it"""
+        from unittest import mock
+
+        import redis
+
+        from . import digest
+        from .tasks import send_daily_digest
+
+        lease = digest.hold_lease(self.day)
+        with (
+            self.settings(DIGEST_QUEUE=self.queue),
+            mock.patch.object(digest, "dispatch", side_effect=redis.ConnectionError("down")),
+            mock.patch.object(send_daily_digest, "apply_async") as requeue,
+        ):
+            self.assertEqual(send_daily_digest.apply(args=["2001-01-02", lease]).get(), 0)
+
+        self.assertEqual(requeue.call_args.kwargs["args"], ["2001-01-02", lease])
+        self.assertEqual(self._messages(), [])
+        self.assertIsNone(digest.hold_lease(self.day))  # still held by the chain
+        digest.release_lease(self.day, lease)
+
+
+class MetricsExporterTest(TransactionTestCase):
+    """Test the Prometheus exporter's incremental collection (PostgreSQL only)"""
+
+    def setUp(self):
+        from django.db import connection
+
+        if connection.vendor != "postgresql":
+            self.skipTest("The exporter's queries are PostgreSQL-specific")
+        self.template = NotificationTemplate.objects.create(
+            name="exporter_email", channel="email", body_template="Hi"
+        )
+
+    def _sent(self, seconds_ago):
+        from django.utils import timezone
+
+        sent_at = timezone.now() - timezone.timedelta(seconds=seconds_ago)
+        log = NotificationLog.objects.create(
+            user_id="user_exporter", template=self.template, channel="email",
+            to="e@example.com", status="sent", sent_at=sent_at,
+        )
+        NotificationLog.objects.filter(id=log.id).update(
+            created_at=sent_at - timezone.timedelta(seconds=2)
+        )
+
+    def test_each_delivery_is_observed_once(self):
+        """Test that the high-water mark keeps repeated cycles from re-observing rows"""
+        from django.db import connection
+        from django.utils import timezone
+        from prometheus_client import REGISTRY
+        from sqlalchemy import create_engine
+
+        from dashboard import metrics
+
+        from .rollups import roll_up
+
+        db = connection.settings_dict
+        engine = create_engine(
+            f"postgresql://{db['USER']}:{db['PASSWORD']}@{db['HOST']}:{db['PORT']}/{db['NAME']}"
+        )
+        labels = {"channel": "email"}
+        name = "pulse_notification_delivery_latency_seconds_count"
+        before = REGISTRY.get_sample_value(name, labels) or 0
+
+        self._sent(120)
+        self._sent(90)
+        self._sent(5)  # within the lag: left for a later cycle
+        mark = (timezone.now() - timezone.timedelta(minutes=10), metrics.NIL_UUID)
+        try:
+            with engine.connect() as conn:
+                mark = metrics.collect_delivery_latency(conn, mark)
+                self.assertEqual(REGISTRY.get_sample_value(name, labels), before + 2)
+
+                mark = metrics.collect_delivery_latency(conn, mark)
+                self.assertEqual(REGISTRY.get_sample_value(name, labels), before + 2)
+
+                self._sent(60)
+                metrics.collect_delivery_latency(conn, mark)
+                self.assertEqual(REGISTRY.get_sample_value(name, labels), before + 3)
+
+                roll_up()
+                metrics.collect_notification_metrics(conn)
+                self.assertEqual(
+                    REGISTRY.get_sample_value("pulse_notifications_by_status", {"status": "sent"}), 4
+                )
+        finally:
+            engine.dispose()
+
+
+class HourlyRollupTest(TestCase):
+    """Test the hourly rollups read by the dashboard and exporter"""
+
+    def setUp(self):
+        self.template = NotificationTemplate.objects.create(
+            name="rollup_email", channel="email", body_template="Hi"
+        )
+        self.hour = timezone.now().replace(minute=0, second=0, microsecond=0) - timezone.timedelta(
+            hours=5
+        )
+
+    def _log(self, status_, attempts=0, latency=None, minute=10):
+        created_at = self.hour + timezone.timedelta(minutes=minute)
+        log = NotificationLog.objects.create(
+            user_id="user_rollup", template=self.template, channel="email",
+            to="r@example.com", status=status_, attempts=attempts,
+        )
+        sent_at = created_at + timezone.timedelta(seconds=latency) if latency else None
+        NotificationLog.objects.filter(id=log.id).update(created_at=created_at, sent_at=sent_at)
+        return log
+
+    def test_hour_is_aggregated_and_replaced(self):
+        """Test counts, attempts and latency percentiles, recomputed on status changes"""
+        from .models import NotificationHourlyRollup
+        from .rollups import roll_up_hour
+
+        for latency in (1, 2, 3, 4, 5):
+            self._log("sent", latency=latency)
+        failing = self._log("retrying", attempts=2)
+        self._log("pending", minute=70)  # next hour
+
+        roll_up_hour(self.hour)
+        rows = {r.status: r for r in NotificationHourlyRollup.objects.filter(hour=self.hour)}
+        self.assertEqual(set(rows), {"sent", "retrying"})
+        self.assertEqual((rows["sent"].count, rows["sent"].latency_p50), (5, 3))
+        self.assertAlmostEqual(rows["sent"].latency_p95, 4.8)
+        self.assertEqual((rows["retrying"].attempts_sum, rows["retrying"].max_attempts), (2, 2))
+        self.assertIsNone(rows["retrying"].latency_p50)
+
+        NotificationLog.objects.filter(id=failing.id).update(status="failed", attempts=5)
+        roll_up_hour(self.hour)
+        statuses = dict(
+            NotificationHourlyRollup.objects.filter(hour=self.hour).values_list("status", "count")
+        )
+        self.assertEqual(statuses, {"sent": 5, "failed": 1})
+
+    def test_only_recent_and_late_hours_are_recomputed(self):
+        """Test that a run backfills once and then only revisits the late window"""
+        from .redis_clients import get_state_client
+        from .rollups import WATERMARK_KEY, hours_to_roll, roll_up
+
+        get_state_client().delete(WATERMARK_KEY)
+        self.addCleanup(get_state_client().delete, WATERMARK_KEY)
+        self._log("sent", latency=1)
+        self.assertEqual(hours_to_roll()[0], self.hour)  # backfill from the oldest log
+        self.assertEqual(roll_up(), 6)
+
+        with self.settings(ROLLUP_LATE_HOURS=2):
+            hours = hours_to_roll()
+        current = timezone.now().replace(minute=0, second=0, microsecond=0)
+        self.assertEqual(hours, [current - timezone.timedelta(hours=n) for n in (2, 1, 0)])
+
+
+class LiveCountersTest(TestCase):
+    """Test the per-minute Redis counters behind the live dashboard"""
+
+    def test_increments_are_flushed_and_read_back(self):
+        """Test that buffered increments land in one hash per minute and feed the gauges"""
+        import time
+
+        from prometheus_client import REGISTRY
+
+        from dashboard import metrics
+
+        from .live_counters import LiveCounters, key
+        from .redis_clients import get_cache_client
+
+        client = get_cache_client()
+        counters = LiveCounters(flush_interval=60, retention=10)
+        counters.incr("live_test", "sent", "high_priority", 3)
+        counters.incr("live_test", "sent", "low_priority")
+        counters.incr("live_test", "failed", "low_priority")
+        self.assertEqual(counters.flush(), 3)
+        self.assertEqual(counters.flush(), 0)
+
+        now = time.time()
+        minutes = metrics.read_live_counters(client, 2, now)
+        self.addCleanup(client.delete, *(key(int(start // 60)) for start, _ in minutes))
+        totals = {}
+        for _, counts in minutes:
+            for (channel, status, queue), count in counts.items():
+                if channel == "live_test":
+                    totals[status, queue] = totals.get((status, queue), 0) + count
+        self.assertEqual(
+            totals,
+            {("sent", "high_priority"): 3, ("sent", "low_priority"): 1, ("failed", "low_priority"): 1},
+        )
+        self.assertLessEqual(client.ttl(key(int(now // 60))), 11 * 60)
+
+        metrics.collect_live_metrics(client, now + 60)  # once the minute has closed
+        rate = REGISTRY.get_sample_value(
+            "pulse_live_notifications_per_minute", {"channel": "live_test", "status": "sent"}
+        )
+        self.assertAlmostEqual(rate, 4 / metrics.LIVE_WINDOW_MINUTES)
+        self.assertEqual(
+            REGISTRY.get_sample_value("pulse_live_failure_rate", {"channel": "live_test"}), 20.0
+        )
+
+
+class PrometheusInstrumentationTest(TestCase):
+    """Test the in-process metrics of the API and workers"""
+
+    def setUp(self):
+        import uuid
+
+        self.template = NotificationTemplate.objects.create(
+            name="prom_email", channel="email", subject="Hi", body_template="Hi {name}"
+        )
+        self.user = f"user_prom_{uuid.uuid4().hex}"
+        self.client = APIClient()
+
+    def _sample(self, name, **labels):
+        from prometheus_client import REGISTRY
+
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_send_view_records_latency_rejections_and_idempotent_hits(self):
+        """Test the API histogram and counters, and that /metrics serves them"""
+        duration = "pulse_api_request_duration_seconds_count"
+        view = "send-notification"
+        before = {
+            code: self._sample(duration, view=view, status_code=code)
+            for code in ("202", "200", "429")
+        }
+        hits = self._sample("pulse_idempotent_hits_total", source="lookup")
+        rejections = self._sample("pulse_rate_limit_rejections_total", tier="prom", channel="email")
+
+        data = {
+            "template_name": "prom_email",
+            "user_id": self.user,
+            "to": "prom@example.com",
+            "context": {"name": "Prom"},
+            "idempotency_key": f"{self.user}-1",
+        }
+        tiers = [{"name": "prom", "key": "{user_id}", "max_requests": 1, "window": 60}]
+        with self.settings(RATE_LIMITS=tiers):
+            send = lambda: self.client.post("/api/notifications/send/", data, format="json")
+            self.assertEqual(send().status_code, 202)
+            self.assertEqual(send().status_code, 200)  # same idempotency key
+            data["idempotency_key"] = f"{self.user}-2"
+            self.assertEqual(send().status_code, 429)
+
+        for code in ("202", "200", "429"):
+            self.assertEqual(self._sample(duration, view=view, status_code=code), before[code] + 1)
+        self.assertEqual(self._sample("pulse_idempotent_hits_total", source="lookup"), hits + 1)
+        self.assertEqual(
+            self._sample("pulse_rate_limit_rejections_total", tier="prom", channel="email"),
+            rejections + 1,
+        )
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            b'pulse_rate_limit_rejections_total{channel="email",tier="prom"}', response.content
+        )
+
+    def test_worker_records_queue_wait_provider_time_and_outcomes(self):
+        """Test the task signal timings and the delivery engine's outcome counters"""
+        import time
+        from datetime import datetime, timezone as dt_timezone
+
+        from celery.signals import task_postrun, task_prerun
+
+        from .tasks import send_email_task
+
+        log = NotificationLog.objects.create(
+            user_id=self.user, template=self.template, channel="email", to="prom@example.com"
+        )
+        sent = self._sample("pulse_notifications_total", channel="email", status="sent")
+        calls = self._sample(
+            "pulse_provider_call_duration_seconds_count", channel="email", outcome="success"
+        )
+        runs = self._sample(
+            "pulse_task_duration_seconds_count", task=send_email_task.name, state="SUCCESS"
+        )
+        send_email_task.apply(args=[str(log.id), log.to, "Hi", "Body"])
+        self.assertEqual(
+            self._sample("pulse_notifications_total", channel="email", status="sent"), sent + 1
+        )
+        self.assertEqual(
+            self._sample(
+                "pulse_provider_call_duration_seconds_count", channel="email", outcome="success"
+            ),
+            calls + 1,
+        )
+        self.assertEqual(
+            self._sample(
+                "pulse_task_duration_seconds_count", task=send_email_task.name, state="SUCCESS"
+            ),
+            runs + 1,
+        )
+
+        # A countdown retry published 60s ago and due 2s ago waited about 2s
+        labels = {"task": send_email_task.name, "queue": "low_priority"}
+        waited = self._sample("pulse_task_queue_wait_seconds_sum", **labels)
+        now = time.time()
+        send_email_task.push_request(
+            id="prom-task",
+            published_at=now - 60,
+            eta=datetime.fromtimestamp(now - 2, dt_timezone.utc).isoformat(),
+            delivery_info={"routing_key": "low_priority"},
+        )
+        try:
+            task_prerun.send(sender=send_email_task, task_id="prom-task", task=send_email_task)
+            task_postrun.send(
+                sender=send_email_task, task_id="prom-task", task=send_email_task, state="SUCCESS"
+            )
+        finally:
+            send_email_task.pop_request()
+        self.assertAlmostEqual(
+            self._sample("pulse_task_queue_wait_seconds_sum", **labels) - waited, 2, delta=0.5
+        )
+
+
+class SendTimingTest(TestCase):
+    """Test the per-stage latency breakdown of the send path"""
+
+    def setUp(self):
+        import uuid
+
+        NotificationTemplate.objects.create(
+            name="timing_email", channel="email", subject="Hi", body_template="Hi {name}"
+        )
+        self.key = f"timing-{uuid.uuid4().hex}"
+        self.client = APIClient()
+
+    def test_stages_and_queries_are_reported(self):
+        """Test the Server-Timing header, access log line and stage histograms"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from prometheus_client import REGISTRY
+
+        labels = {"view": "send-notification", "stage": "insert"}
+        inserts = REGISTRY.get_sample_value("pulse_api_stage_duration_seconds_count", labels) or 0
+        data = {
+            "template_name": "timing_email",
+            "user_id": "user_timing",
+            "to": "timing@example.com",
+            "context": {"name": "Timing"},
+            "idempotency_key": self.key,
+        }
+        with self.assertLogs("pulse.access", "INFO") as access, CaptureQueriesContext(
+            connection
+        ) as queries:
+            response = self.client.post("/api/notifications/send/", data, format="json")
+        self.assertEqual(response.status_code, 202)
+
+        timings = dict(
+            (entry.split(";")[0], entry) for entry in response["Server-Timing"].split(", ")
+        )
+        self.assertEqual(
+            list(timings),
+            ["validate", "template", "idempotency", "render", "rate_limit", "insert",
+             "publish", "db", "total"],
+        )
+        self.assertIn(f'desc="{len(queries)} queries"', timings["db"])
+        self.assertIn(f"db={len(queries)}q/", access.output[0])
+        self.assertIn("rate_limit=", access.output[0])
+        self.assertEqual(
+            REGISTRY.get_sample_value("pulse_api_stage_duration_seconds_count", labels),
+            inserts + 1,
+        )
+
+    def test_nested_stages_report_their_own_time(self):
+        """Test that an outer stage excludes the time of the stages inside it"""
+        import time
+
+        from .timing import StageTimer
+
+        timer = StageTimer()
+        with timer.stage("outer"):
+            with timer.stage("inner"):
+                time.sleep(0.02)
+        self.assertGreaterEqual(timer.stages["inner"], 0.02)
+        self.assertLess(timer.stages["outer"], 0.01)
+        self.assertLessEqual(sum(timer.stages.values()), timer.elapsed)
@@ -0,0 +1,78 @@
+"""
+Stage timings of one API request.
+
+``StageTimer`` splits a request into named stages timed with
+``time.monotonic``. Stages may nest: each reports only its own time, without
+the stages inside it, so the stages add up to at most the request's total.
+Used as a Django ``connection.execute_wrapper`` it also counts the request's
+queries and the time spent in them (which overlaps the stages).
+
+The view reports the result three ways: appended to the access log line, as
+a ``Server-Timing`` response header (shown per request in browser dev tools)
+and as per-stage histograms.
+"""
+
+import time
+from contextlib import contextmanager, nullcontext
+
+from .metrics import API_DB_QUERIES, API_DB_TIME, API_STAGE_DURATION
+
+
+class StageTimer:
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        self.stages = {}  # name -> seconds, in the order first entered
+        self.db_queries = 0
+        self.db_time = 0.0
+        self._nested = []  # per open stage, seconds spent in its child stages
+
+    @contextmanager
+    def stage(self, name: str):
+        self.stages.setdefault(name, 0.0)
+        started = time.monotonic()
+        self._nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            children = self._nested.pop()
+            if self._nested:
+                self._nested[-1] += elapsed
+            self.stages[name] += elapsed - children
+
+    def __call__(self, execute, sql, params, many, context):
+        """``connection.execute_wrapper`` hook: count and time every query."""
+        started = time.monotonic()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_queries += 1
+            self.db_time += time.monotonic() - started
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def server_timing(self, total: float) -> str:
+        """Value of the ``Server-Timing`` header, in milliseconds."""
+        metrics = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        metrics.append(f'db;dur={self.db_time * 1000:.1f};desc="{self.db_queries} queries"')
+        metrics.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(metrics)
+
+    def summary(self) -> str:
+        """Compact form for the access log: ``validate=1.2ms ... db=3q/2.1ms``."""
+        parts = [f"{name}={seconds * 1000:.1f}ms" for name, seconds in self.stages.items()]
+        parts.append(f"db={self.db_queries}q/{self.db_time * 1000:.1f}ms")
+        return " ".join(parts)
+
+    def observe(self, view: str) -> None:
+        for name, seconds in self.stages.items():
+            API_STAGE_DURATION.labels(view=view, stage=name).observe(seconds)
+        API_DB_QUERIES.labels(view=view).observe(self.db_queries)
+        API_DB_TIME.labels(view=view).observe(self.db_time)
+
+
+def stage(timer, name: str):
+    """``timer.stage(name)``, or nothing when there is no timer."""
+    return timer.stage(name) if timer is not None else nullcontext()
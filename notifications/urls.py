@@ -1,8 +1,10 @@
 from django.urls import path
 
 from .views import (
+    NotificationExportView,
     NotificationListView,
     NotificationStatusView,
+    SendNotificationBatchView,
     SendNotificationView,
     TemplateDetailView,
     TemplateListView,
@@ -10,12 +12,18 @@ from .views import (
 
 urlpatterns = [
     path("send/", SendNotificationView.as_view(), name="send-notification"),
+    path(
+        "send/batch/",
+        SendNotificationBatchView.as_view(),
+        name="send-notification-batch",
+    ),
     path(
         "status/<uuid:notification_id>/",
         NotificationStatusView.as_view(),
         name="notification-status",
     ),
     path("list/", NotificationListView.as_view(), name="notification-list"),
+    path("export/", NotificationExportView.as_view(), name="notification-export"),
     path("templates/", TemplateListView.as_view(), name="template-list"),
     path(
         "templates/<uuid:template_id>/",
@@ -1,24 +1,33 @@
 import logging
-import time
+from contextlib import nullcontext
 
 from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.http import HttpResponse, StreamingHttpResponse
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .adapters import EmailAdapter, PushAdapter, SMSAdapter
+from . import idempotency, live_counters, metrics, outbox
+from .adapters import ADAPTERS, build_payload
+from .export import CONTENT_TYPES, ExportError, export_queryset, stream_export
 from .models import NotificationLog, NotificationTemplate
-from .rate_limiter import RateLimiter
+from .pagination import InvalidCursor, keyset_page
+from .publisher import publish_many
+from .rate_limiter import TieredRateLimiter
 from .serializers import (
     ErrorResponseSerializer,
+    NotificationBatchResponseSerializer,
     NotificationIdempotentResponseSerializer,
     NotificationListResponseSerializer,
     NotificationQueuedResponseSerializer,
     NotificationStatusResponseSerializer,
+    SendNotificationBatchSerializer,
     SendNotificationSerializer,
     TemplateListResponseSerializer,
     TemplateSerializer,
 )
+from .timing import StageTimer
 
 # Conditional import for OpenAPI decorators
 if settings.ENABLE_DOCS:
@@ -68,9 +77,14 @@ class SendNotificationView(APIView):
         },
     )
     def post(self, request):
-        started_at = time.monotonic()
-        serializer = self.serializer_class(data=request.data)
-        serializer.is_valid(raise_exception=True)
+        timer = StageTimer()
+        with connection.execute_wrapper(timer):
+            return self._send(request, timer)
+
+    def _send(self, request, timer):
+        with timer.stage("validate"):
+            serializer = self.serializer_class(data=request.data, context={"timer": timer})
+            serializer.is_valid(raise_exception=True)
         data = serializer.validated_data
 
         logger.info(
@@ -80,6 +94,7 @@ class SendNotificationView(APIView):
         )
         existing = data.get("existing_log")
         if existing:
+            metrics.IDEMPOTENT_HITS.labels(source="lookup").inc()
             logger.info(
                 "Idempotent hit for notification %s (status=%s)",
                 existing.id,
@@ -91,8 +106,8 @@ class SendNotificationView(APIView):
             )
             self._log_response(
                 request,
-                started_at,
-                response.status_code,
+                timer,
+                response,
                 extra={"notification_id": str(existing.id)},
             )
             return response
@@ -102,76 +117,95 @@ class SendNotificationView(APIView):
         idem_key = data.get("idempotency_key") or None
         channel = data.get("channel", template.channel)
 
-        # Per-user/channel rate limiting
-        limiter = RateLimiter(max_requests=10, window=60)  # 10 requests/minute
-        rate_key = f"{data['user_id']}:{channel}"
-        if not limiter.is_allowed(rate_key):
+        # Per-user/channel, template, tenant and provider limits in one call
+        with timer.stage("rate_limit"):
+            rate_limit = TieredRateLimiter.from_settings().check(
+                user_id=data["user_id"],
+                channel=channel,
+                template=template.name,
+                tenant=data.get("tenant_id"),
+                provider=settings.CHANNEL_PROVIDERS.get(channel, channel),
+            )
+        if not rate_limit.allowed:
+            metrics.RATE_LIMIT_REJECTIONS.labels(
+                tier=rate_limit.tier or "default", channel=channel
+            ).inc()
             logger.warning(
-                "Rate limit exceeded for user=%s channel=%s", data["user_id"], channel
+                "Rate limit exceeded for user=%s channel=%s (tier=%s)",
+                data["user_id"],
+                channel,
+                rate_limit.tier,
             )
+            if data.get("idempotency_reserved"):
+                idempotency.release(idem_key)
             response = Response(
                 {"error": "Rate limit exceeded. Try again later."},
                 status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={"Retry-After": rate_limit.retry_after_header},
             )
             self._log_response(
                 request,
-                started_at,
-                response.status_code,
+                timer,
+                response,
                 extra={"user_id": data['user_id'], "channel": channel},
             )
             return response
 
-        # Use atomic create for idempotency
-        log = NotificationLog.create_if_not_exists(
-            user_id=data["user_id"],
-            template=template,
-            channel=channel,
-            to=data["to"],
-            idempotency_key=idem_key,
-            max_retries=5,  # Default
-        )
+        use_outbox = settings.NOTIFICATION_OUTBOX_ENABLED and channel in ADAPTERS
+        payload = build_payload(data, template, channel, rendered_body)
 
-        # Check if this was an existing log (idempotent request)
-        # The serializer already checks, but create_if_not_exists handles race conditions
-        if idem_key and existing and existing.id == log.id:
-            # This is a duplicate request
+        # Use atomic create for idempotency; with the outbox enabled the
+        # delivery task is committed together with the log
+        try:
+            with timer.stage("insert"), transaction.atomic() if use_outbox else nullcontext():
+                log, created = NotificationLog.create_idempotent(
+                    user_id=data["user_id"],
+                    template=template,
+                    channel=channel,
+                    to=data["to"],
+                    idempotency_key=idem_key,
+                    max_retries=5,  # Default
+                )
+                if created and use_outbox:
+                    signature = ADAPTERS[channel].signature(str(log.id), payload)
+                    outbox.enqueue([(log.id, signature)])
+        except Exception:
+            if data.get("idempotency_reserved"):
+                idempotency.release(idem_key)
+            raise
+
+        if idem_key:
+            with timer.stage("idempotency"):
+                idempotency.remember(idem_key, log.id, log.status)
+
+        # The serializer already checks, but the database unique constraint is
+        # the source of truth (e.g. the Redis reservation expired or raced)
+        if not created:
+            metrics.IDEMPOTENT_HITS.labels(source="insert").inc()
             logger.info(
                 "Idempotent hit for notification %s (status=%s)",
                 log.id,
                 log.status,
             )
-            return Response(
+            response = Response(
                 {"notification_id": str(log.id), "status": log.status},
                 status=status.HTTP_200_OK,
             )
+            self._log_response(
+                request,
+                timer,
+                response,
+                extra={"notification_id": str(log.id)},
+            )
+            return response
 
-        adapters = {
-            "email": EmailAdapter(),
-            "sms": SMSAdapter(),
-            "push": PushAdapter(),
-        }
-
-        # Basic priority routing: treat OTP-like templates as high priority
-        template_name = (template.name or "").lower()
-        if "otp" in template_name:
-            queue_name = "high_priority"
-        else:
-            queue_name = "low_priority"
-
-        if channel in adapters:
-            adapter = adapters[channel]
-            payload = {
-                "to": data["to"],
-                "subject": data.get("subject", template.subject),
-                "body": rendered_body,
-                "device_token": data.get("device_token") if channel == "push" else None,
-                "title": data.get("title", template.subject)
-                if channel == "push"
-                else None,
-                "queue": queue_name,
-            }
+        if use_outbox:
+            pass  # Published by dispatch_outbox
+        elif channel in ADAPTERS:
+            adapter = ADAPTERS[channel]
             try:
-                adapter.send(str(log.id), payload)
+                with timer.stage("publish"):
+                    adapter.send(str(log.id), payload)
             except Exception as e:
                 logger.exception(
                     "Failed to send notification via adapter for channel=%s (log=%s)",
@@ -195,6 +229,7 @@ class SendNotificationView(APIView):
                 {"error": "Unsupported channel"}, status=status.HTTP_400_BAD_REQUEST
             )
 
+        live_counters.record(channel, "queued", payload["queue"])
         logger.info(
             "Notification %s queued for channel=%s destination=%s",
             log.id,
@@ -207,21 +242,285 @@ class SendNotificationView(APIView):
         )
         self._log_response(
             request,
-            started_at,
-            response.status_code,
+            timer,
+            response,
             extra={"notification_id": str(log.id)},
         )
         return response
 
     @staticmethod
     def _log_response(
-        request, started_at: float, status_code: int, extra: dict | None = None
+        request, timer: StageTimer, response: Response, extra: dict | None = None
     ) -> None:
-        elapsed_ms = (time.monotonic() - started_at) * 1000
+        """Report the request's timings: access log, Server-Timing and histograms."""
+        elapsed = timer.elapsed
+        status_code = response.status_code
+        view = request.resolver_match.url_name if request.resolver_match else request.path
+        metrics.API_REQUEST_DURATION.labels(view=view, status_code=status_code).observe(elapsed)
+        timer.observe(view)
+        response["Server-Timing"] = timer.server_timing(elapsed)
+        elapsed_ms = elapsed * 1000
         message = f"{request.method} {request.path} {status_code} {round(elapsed_ms)}ms"
         if extra and extra.get("notification_id"):
             message = f"{message} {extra['notification_id']}"
-        access_logger.info(message)
+        access_logger.info(f"{message} {timer.summary()}")
+
+
+class SendNotificationBatchView(APIView):
+    """
+    Queue many notifications in one request.
+
+    Intended for upstream services fanning out large volumes: the batch is
+    validated together, inserted with one ``bulk_create`` and published to
+    the broker in one pipelined round trip (or written to the outbox in the
+    same transaction). Every item gets its own result.
+    """
+
+    serializer_class = SendNotificationBatchSerializer
+
+    @extend_schema(
+        tags=["Notifications"],
+        summary="Send a batch of notifications",
+        description="Queue up to NOTIFICATION_BATCH_MAX_SIZE notifications in one call. "
+        "Each item accepts the same fields as the single send endpoint and gets its own "
+        "result: queued, duplicate (idempotency key already used) or rejected. Items are "
+        "charged to the same rate limit tiers as single sends.",
+        request=SendNotificationBatchSerializer,
+        responses={
+            202: NotificationBatchResponseSerializer,
+            200: NotificationBatchResponseSerializer,
+            400: ErrorResponseSerializer,
+            500: ErrorResponseSerializer,
+        },
+    )
+    def post(self, request):
+        timer = StageTimer()
+        with connection.execute_wrapper(timer):
+            return self._send(request, timer)
+
+    def _send(self, request, timer):
+        with timer.stage("validate"):
+            serializer = self.serializer_class(data=request.data)
+            serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data["notifications"]
+
+        results = []
+        pending = []  # (result, log, adapter, payload)
+        batch_keys = {}
+        repeats = []  # (result, result of the first item with the same key)
+        first_results = {}
+        for index, item in enumerate(items):
+            result = {"index": index, "notification_id": None, "status": None}
+            results.append(result)
+
+            if item.get("error"):
+                result.update(result="rejected", error=item["error"])
+                continue
+
+            existing = item.get("existing_log")
+            if existing:
+                result.update(
+                    result="duplicate",
+                    notification_id=str(existing.id),
+                    status=existing.status,
+                )
+                continue
+
+            idem_key = item.get("idempotency_key") or None
+            if idem_key in first_results:
+                # Repeated key within the same batch: reported like the first
+                # item once its outcome is known
+                repeats.append((result, first_results[idem_key]))
+                continue
+
+            template = item["template"]
+            channel = item.get("channel", template.channel)
+            adapter = ADAPTERS.get(channel)
+            if adapter is None:
+                result.update(result="rejected", error="Unsupported channel")
+                continue
+
+            log = NotificationLog(
+                user_id=item["user_id"],
+                template=template,
+                channel=channel,
+                to=item["to"],
+                idempotency_key=idem_key,
+                max_retries=5,  # Default
+            )
+            if idem_key:
+                batch_keys[idem_key] = log
+                first_results[idem_key] = result
+            payload = build_payload(item, template, channel, item["rendered_body"])
+            pending.append((result, log, adapter, payload))
+
+        if pending:
+            with timer.stage("rate_limit"):
+                pending = self._rate_limit(pending, items, batch_keys)
+
+        use_outbox = settings.NOTIFICATION_OUTBOX_ENABLED
+        with timer.stage("insert"), transaction.atomic() if use_outbox else nullcontext():
+            if pending:
+                pending = self._insert(pending, batch_keys)
+
+            signatures = [
+                (log.id, adapter.signature(str(log.id), payload))
+                for _, log, adapter, payload in pending
+            ]
+            if use_outbox:
+                # Committed with the logs; published by dispatch_outbox
+                outbox.enqueue(signatures)
+
+        if not use_outbox:
+            try:
+                with timer.stage("publish"):
+                    publish_many(signature for _, signature in signatures)
+            except Exception as e:
+                logger.exception(
+                    "Failed to publish batch of %s notifications",
+                    len(signatures),
+                    exc_info=e,
+                )
+                NotificationLog.objects.filter(
+                    id__in=[log.id for _, log, _, _ in pending]
+                ).update(status="failed", error_message=str(e), next_retry_at=None)
+                return Response(
+                    {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                )
+
+        for result, log, _, payload in pending:
+            result.update(result="queued", notification_id=str(log.id), status="queued")
+            live_counters.record(log.channel, "queued", payload["queue"])
+
+        for result, first in repeats:
+            if first["result"] == "queued":
+                result.update(
+                    result="duplicate",
+                    notification_id=first["notification_id"],
+                    status=first["status"],
+                )
+            else:
+                # Rejected, or a duplicate of a concurrent request's row
+                result.update({k: v for k, v in first.items() if k != "index"})
+
+        summary = {"count": len(results), "queued": 0, "duplicates": 0, "rejected": 0}
+        for result in results:
+            if result["result"] == "queued":
+                summary["queued"] += 1
+            elif result["result"] == "duplicate":
+                summary["duplicates"] += 1
+            else:
+                summary["rejected"] += 1
+
+        logger.info(
+            "Batch of %s notifications: %s queued, %s duplicates, %s rejected",
+            summary["count"],
+            summary["queued"],
+            summary["duplicates"],
+            summary["rejected"],
+        )
+        response = Response(
+            {**summary, "results": results},
+            status=status.HTTP_202_ACCEPTED
+            if summary["queued"]
+            else status.HTTP_200_OK,
+        )
+        SendNotificationView._log_response(request, timer, response)
+        return response
+
+    @staticmethod
+    def _rate_limit(pending, items, batch_keys):
+        """
+        Charge every item to the same tiers as a single send, in one round trip.
+
+        Items over a limit are rejected with the limiting tier and when to
+        retry; the rest go on to be inserted.
+        """
+        scopes = []
+        for result, log, _, _ in pending:
+            item = items[result["index"]]
+            scopes.append(
+                {
+                    "user_id": log.user_id,
+                    "channel": log.channel,
+                    "template": log.template.name,
+                    "tenant": item.get("tenant_id"),
+                    "provider": settings.CHANNEL_PROVIDERS.get(log.channel, log.channel),
+                }
+            )
+        admitted = []
+        rejected = 0
+        limits = TieredRateLimiter.from_settings().check_many(scopes)
+        for entry, rate_limit in zip(pending, limits):
+            if rate_limit.allowed:
+                admitted.append(entry)
+                continue
+            result, log = entry[0], entry[1]
+            metrics.RATE_LIMIT_REJECTIONS.labels(
+                tier=rate_limit.tier or "default", channel=log.channel
+            ).inc()
+            result.update(
+                result="rejected",
+                error="Rate limit exceeded",
+                tier=rate_limit.tier,
+                retry_after=int(rate_limit.retry_after_header),
+            )
+            if log.idempotency_key:
+                batch_keys.pop(log.idempotency_key, None)
+            rejected += 1
+        if rejected:
+            logger.warning("Rate limit rejected %s of %s batch items", rejected, len(pending))
+        return admitted
+
+    @staticmethod
+    def _insert(pending, batch_keys):
+        """
+        Insert the batch's logs with one ``bulk_create``.
+
+        If a concurrent request claimed one of the idempotency keys after
+        validation, the insert is retried ignoring conflicts and the losing
+        items are reported as duplicates of the winning rows.
+        """
+        logs = [log for _, log, _, _ in pending]
+        try:
+            # Savepoint, so a conflict does not abort an enclosing transaction
+            with transaction.atomic():
+                NotificationLog.objects.bulk_create(logs, batch_size=500)
+            return pending
+        except IntegrityError:
+            if not batch_keys:
+                raise
+            if settings.NOTIFICATION_LOG_PARTITIONS:
+                # The partitioned table's claim trigger raises on duplicates,
+                # which ON CONFLICT DO NOTHING does not catch
+                for log in logs:
+                    try:
+                        with transaction.atomic():
+                            log.save(force_insert=True)
+                    except IntegrityError:
+                        pass
+            else:
+                NotificationLog.objects.bulk_create(
+                    logs, batch_size=500, ignore_conflicts=True
+                )
+
+        winners = {
+            key: (log_id, log_status)
+            for key, log_id, log_status in NotificationLog.objects.filter(
+                idempotency_key__in=list(batch_keys)
+            ).values_list("idempotency_key", "id", "status")
+        }
+        inserted = []
+        for entry in pending:
+            result, log = entry[0], entry[1]
+            winner = winners.get(log.idempotency_key) if log.idempotency_key else None
+            if winner and winner[0] != log.id:
+                result.update(
+                    result="duplicate", notification_id=str(winner[0]), status=winner[1]
+                )
+            else:
+                inserted.append(entry)
+        return inserted
 
 
 class NotificationStatusView(APIView):
@@ -272,11 +571,24 @@ class NotificationStatusView(APIView):
 class NotificationListView(APIView):
     """List all notifications with optional filters."""
 
+    # Only the columns in the response; template name comes from the join
+    FIELDS = (
+        "id",
+        "user_id",
+        "template__name",
+        "channel",
+        "to",
+        "status",
+        "attempts",
+        "created_at",
+        "sent_at",
+    )
+
     @extend_schema(
         tags=["Notifications"],
         summary="List notifications",
         description="List all notifications with optional filtering by user, channel, and status. "
-        "Results are ordered by creation time (newest first).",
+        "Results are ordered by creation time (newest first) and paginated with an opaque cursor.",
         parameters=[
             OpenApiParameter(
                 name="user_id",
@@ -303,7 +615,14 @@ class NotificationListView(APIView):
                 name="limit",
                 type=int,
                 location=OpenApiParameter.QUERY,
-                description="Maximum number of results (default: 50)",
+                description="Maximum number of results (default: 50, max: 200)",
+                required=False,
+            ),
+            OpenApiParameter(
+                name="cursor",
+                type=str,
+                location=OpenApiParameter.QUERY,
+                description="next_cursor from the previous page",
                 required=False,
             ),
         ]
@@ -312,13 +631,20 @@ class NotificationListView(APIView):
         responses={200: NotificationListResponseSerializer},
     )
     def get(self, request):
-        logs = NotificationLog.objects.all().order_by("-created_at")
+        logs = NotificationLog.objects.values(*self.FIELDS)
 
         # Optional filters
         user_id = request.query_params.get("user_id")
         channel = request.query_params.get("channel")
         status_filter = request.query_params.get("status")
-        limit = int(request.query_params.get("limit", 50))
+        try:
+            limit = int(request.query_params.get("limit", 50))
+        except ValueError:
+            return Response(
+                {"error": "limit must be an integer"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        limit = max(1, min(limit, settings.NOTIFICATION_LIST_MAX_LIMIT))
 
         if user_id:
             logs = logs.filter(user_id=user_id)
@@ -327,30 +653,131 @@ class NotificationListView(APIView):
         if status_filter:
             logs = logs.filter(status=status_filter)
 
-        logs = logs[:limit]
+        try:
+            rows, next_cursor = keyset_page(
+                logs, request.query_params.get("cursor"), limit
+            )
+        except InvalidCursor as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
         return Response(
             {
-                "count": len(logs),
+                "count": len(rows),
+                "next_cursor": next_cursor,
                 "results": [
                     {
-                        "notification_id": str(log.id),
-                        "user_id": log.user_id,
-                        "template_name": log.template.name,
-                        "channel": log.channel,
-                        "to": log.to,
-                        "status": log.status,
-                        "attempts": log.attempts,
-                        "created_at": log.created_at.isoformat(),
-                        "sent_at": log.sent_at.isoformat() if log.sent_at else None,
+                        "notification_id": str(row["id"]),
+                        "user_id": row["user_id"],
+                        "template_name": row["template__name"],
+                        "channel": row["channel"],
+                        "to": row["to"],
+                        "status": row["status"],
+                        "attempts": row["attempts"],
+                        "created_at": row["created_at"].isoformat(),
+                        "sent_at": row["sent_at"].isoformat() if row["sent_at"] else None,
                     }
-                    for log in logs
+                    for row in rows
                 ],
             },
             status=status.HTTP_200_OK,
         )
 
 
+class NotificationExportView(APIView):
+    """Stream notification logs for a time range as NDJSON or CSV."""
+
+    @extend_schema(
+        tags=["Notifications"],
+        summary="Export notifications",
+        description="Stream every notification created in [start, end) matching the "
+        "optional filters, oldest first, as NDJSON or CSV (optionally gzipped). Rows are "
+        "read through a server-side cursor, so exports of any size use constant memory.",
+        parameters=[
+            OpenApiParameter(
+                name="start",
+                type=str,
+                location=OpenApiParameter.QUERY,
+                description="Inclusive lower bound on created_at (ISO 8601 date or datetime)",
+                required=False,
+            ),
+            OpenApiParameter(
+                name="end",
+                type=str,
+                location=OpenApiParameter.QUERY,
+                description="Exclusive upper bound on created_at (ISO 8601 date or datetime)",
+                required=False,
+            ),
+            OpenApiParameter(
+                name="channel",
+                type=str,
+                location=OpenApiParameter.QUERY,
+                description="Filter by channel (email, sms, push)",
+                required=False,
+            ),
+            OpenApiParameter(
+                name="status",
+                type=str,
+                location=OpenApiParameter.QUERY,
+                description="Filter by status (pending, sent, failed, retrying)",
+                required=False,
+            ),
+            OpenApiParameter(
+                name="user_id",
+                type=str,
+                location=OpenApiParameter.QUERY,
+                description="Filter by user identifier",
+                required=False,
+            ),
+            OpenApiParameter(
+                name="output",
+                type=str,
+                location=OpenApiParameter.QUERY,
+                description="ndjson (default) or csv",
+                required=False,
+            ),
+            OpenApiParameter(
+                name="gzip",
+                type=bool,
+                location=OpenApiParameter.QUERY,
+                description="Gzip the response body",
+                required=False,
+            ),
+        ]
+        if OpenApiParameter
+        else [],
+        responses={
+            200: OpenApiResponse(description="NDJSON or CSV stream"),
+            400: ErrorResponseSerializer,
+        }
+        if OpenApiResponse
+        else {},
+    )
+    def get(self, request):
+        params = request.query_params
+        fmt = params.get("output", "ndjson")
+        compress = params.get("gzip", "").lower() in ("1", "true", "yes")
+
+        try:
+            logs = export_queryset(
+                start=params.get("start"),
+                end=params.get("end"),
+                channel=params.get("channel"),
+                status=params.get("status"),
+                user_id=params.get("user_id"),
+            )
+            stream = stream_export(logs, fmt=fmt, compress=compress)
+        except ExportError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        filename = f"notifications.{fmt}" + (".gz" if compress else "")
+        response = StreamingHttpResponse(
+            stream,
+            content_type="application/gzip" if compress else CONTENT_TYPES[fmt],
+        )
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+
 class TemplateListView(APIView):
     """List all notification templates."""
 
@@ -428,3 +855,9 @@ class TemplateDetailView(APIView):
             return Response(
                 {"error": "Template not found"}, status=status.HTTP_404_NOT_FOUND
             )
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint (every process's samples in multiprocess mode)."""
+    body, content_type = metrics.render()
+    return HttpResponse(body, content_type=content_type)
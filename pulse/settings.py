@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 import os
+import socket
 from pathlib import Path
 
 import dj_database_url
@@ -192,9 +193,21 @@ CELERY_BEAT_SCHEDULE = {
         "schedule": crontab(hour=2, minute=0),  # Daily at 2 AM
         "args": (30,),  # days_old
     },
+    "ensure-log-partitions": {
+        "task": "notifications.tasks.ensure_log_partitions",
+        "schedule": crontab(minute=15),  # Hourly; no-op unless partitioned
+        "args": (),
+    },
+    "rollup-notification-stats": {
+        "task": "notifications.tasks.rollup_notification_stats",
+        "schedule": crontab(minute="*/5"),
+        "args": (),
+    },
     "send-daily-digest": {
         "task": "notifications.tasks.send_daily_digest",
-        "schedule": crontab(hour=9, minute=0),  # 9 AM daily
+        # 9 AM daily; the later runs resume a chain that died (once its
+        # lease expires) or exit while one is still running
+        "schedule": crontab(hour="9-12", minute=0),
         "args": (),
     },
 }
@@ -209,10 +222,209 @@ EMAIL_HOST_USER = os.environ.get("EMAIL_HOST_USER", "")
 EMAIL_HOST_PASSWORD = os.environ.get("EMAIL_HOST_PASSWORD", "")
 EMAIL_USE_TLS = os.environ.get("EMAIL_USE_TLS", "true").lower() == "true"
 
+# Per-worker SMTP connection pool: idle connections kept, seconds before an
+# idle connection is replaced, and messages sent before a connection is recycled
+SMTP_POOL_SIZE = int(os.environ.get("SMTP_POOL_SIZE", "2"))
+SMTP_POOL_IDLE_TIMEOUT = float(os.environ.get("SMTP_POOL_IDLE_TIMEOUT", "30"))
+SMTP_POOL_MAX_MESSAGES = int(os.environ.get("SMTP_POOL_MAX_MESSAGES", "100"))
+
 # Twilio settings for SMS
 TWILIO_ACCOUNT_SID = os.environ.get("TWILIO_ACCOUNT_SID")
 TWILIO_AUTH_TOKEN = os.environ.get("TWILIO_AUTH_TOKEN")
 TWILIO_PHONE_NUMBER = os.environ.get("TWILIO_PHONE_NUMBER")
+# Keep-alive connections per worker process, request timeout (seconds) and an
+# optional API base URL override (e.g. a local stub)
+TWILIO_POOL_SIZE = int(os.environ.get("TWILIO_POOL_SIZE", "10"))
+TWILIO_TIMEOUT = float(os.environ.get("TWILIO_TIMEOUT", "10"))
+TWILIO_BASE_URL = os.environ.get("TWILIO_BASE_URL")
+
+# Buffer delivery status updates in each worker and write them in batches.
+# Outcomes are flushed at STATUS_BUFFER_SIZE entries or after
+# STATUS_BUFFER_MAX_DELAY seconds; a hard-killed worker loses what is buffered.
+STATUS_BUFFER_ENABLED = os.environ.get("STATUS_BUFFER_ENABLED", "false").lower() == "true"
+STATUS_BUFFER_SIZE = int(os.environ.get("STATUS_BUFFER_SIZE", "200"))
+STATUS_BUFFER_MAX_DELAY = float(os.environ.get("STATUS_BUFFER_MAX_DELAY", "0.05"))
+
+# Per-minute counters by channel, status and queue for the live dashboard,
+# kept in Redis for LIVE_COUNTERS_RETENTION minutes; each process flushes its
+# increments every LIVE_COUNTERS_FLUSH_INTERVAL seconds in one pipeline
+LIVE_COUNTERS_ENABLED = os.environ.get("LIVE_COUNTERS_ENABLED", "true").lower() == "true"
+LIVE_COUNTERS_RETENTION = int(os.environ.get("LIVE_COUNTERS_RETENTION", "1440"))
+LIVE_COUNTERS_FLUSH_INTERVAL = float(os.environ.get("LIVE_COUNTERS_FLUSH_INTERVAL", "1.0"))
+
+# In-process Prometheus metrics: the API serves them at /metrics, each Celery
+# worker on WORKER_METRICS_PORT (0 disables). Under gunicorn or prefork set
+# PROMETHEUS_MULTIPROC_DIR to a per-service directory so processes aggregate.
+METRICS_ENDPOINT_ENABLED = (
+    os.environ.get("METRICS_ENDPOINT_ENABLED", "true").lower() == "true"
+)
+WORKER_METRICS_PORT = int(os.environ.get("WORKER_METRICS_PORT", "0"))
+
+# Delivery retries are parked in a Redis sorted set and `python manage.py
+# promote_retries` republishes them when due, instead of Celery countdowns
+# held in worker memory
+RETRY_SCHEDULER_ENABLED = (
+    os.environ.get("RETRY_SCHEDULER_ENABLED", "false").lower() == "true"
+)
+# The schedule is the only copy of a parked retry: keep it on a durable Redis
+# (persistence on, no eviction), never the rate limiter's disposable one
+RETRY_SCHEDULE_REDIS_URL = os.environ.get("RETRY_SCHEDULE_REDIS_URL", CELERY_BROKER_URL)
+RETRY_SCHEDULE_KEY = os.environ.get("RETRY_SCHEDULE_KEY", "notifications:retry_schedule")
+RETRY_PROMOTER_BATCH_SIZE = int(os.environ.get("RETRY_PROMOTER_BATCH_SIZE", "500"))
+RETRY_PROMOTER_POLL_INTERVAL = float(os.environ.get("RETRY_PROMOTER_POLL_INTERVAL", "1.0"))
+
+# Async delivery worker (python manage.py run_async_worker): concurrent sends
+# per process, ORM threads, and in-flight sends allowed per provider
+ASYNC_WORKER_CONCURRENCY = int(os.environ.get("ASYNC_WORKER_CONCURRENCY", "200"))
+ASYNC_WORKER_DB_THREADS = int(os.environ.get("ASYNC_WORKER_DB_THREADS", "20"))
+ASYNC_PROVIDER_CONCURRENCY = {
+    "smtp": int(os.environ.get("ASYNC_SMTP_CONCURRENCY", "20")),
+    "twilio": int(os.environ.get("ASYNC_TWILIO_CONCURRENCY", "100")),
+    "fcm": int(os.environ.get("ASYNC_FCM_CONCURRENCY", "200")),
+}
+# Sorted set (on the broker) where the async worker parks messages whose ETA
+# has not come yet; any running async worker moves them back when due.
+ASYNC_WORKER_DELAYED_KEY = os.environ.get(
+    "ASYNC_WORKER_DELAYED_KEY", "notifications:async_delayed"
+)
+# Each async worker moves the messages it holds onto its own list,
+# <ASYNC_WORKER_PROCESSING_KEY>:<ASYNC_WORKER_NAME>, and on start requeues
+# whatever a killed predecessor of the same name left there. The name must
+# be unique per running worker and survive restarts (the hostname by default).
+ASYNC_WORKER_PROCESSING_KEY = os.environ.get(
+    "ASYNC_WORKER_PROCESSING_KEY", "notifications:async_processing"
+)
+ASYNC_WORKER_NAME = os.environ.get("ASYNC_WORKER_NAME", socket.gethostname())
+
+# Maximum number of items accepted by the batch send endpoint
+NOTIFICATION_BATCH_MAX_SIZE = int(os.environ.get("NOTIFICATION_BATCH_MAX_SIZE", "5000"))
+
+# Transactional outbox: send endpoints commit delivery tasks with their logs
+# and `python manage.py dispatch_outbox` publishes them in batches
+NOTIFICATION_OUTBOX_ENABLED = (
+    os.environ.get("NOTIFICATION_OUTBOX_ENABLED", "false").lower() == "true"
+)
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", "500"))
+OUTBOX_POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL", "0.2"))
+
+# Range partitioning of NotificationLog by created_at on PostgreSQL: "day" or
+# "month" (empty: one table). Convert once with
+# `python manage.py partition_notification_logs`; Beat then keeps
+# NOTIFICATION_LOG_PARTITIONS_AHEAD partitions ready and retention drops
+# expired partitions instead of deleting rows.
+NOTIFICATION_LOG_PARTITIONS = os.environ.get("NOTIFICATION_LOG_PARTITIONS", "")
+NOTIFICATION_LOG_PARTITIONS_AHEAD = int(
+    os.environ.get("NOTIFICATION_LOG_PARTITIONS_AHEAD", "7")
+)
+
+# Hourly rollups (NotificationHourlyRollup) refreshed every 5 minutes: closed
+# hours are recomputed for ROLLUP_LATE_HOURS to pick up late status changes;
+# the first run backfills at most ROLLUP_BACKFILL_DAYS
+ROLLUP_LATE_HOURS = int(os.environ.get("ROLLUP_LATE_HOURS", "3"))
+ROLLUP_BACKFILL_DAYS = int(os.environ.get("ROLLUP_BACKFILL_DAYS", "30"))
+
+# Daily digest: emails rendered from DIGEST_TEMPLATE, DIGEST_CHUNK_SIZE users
+# per task, at most DIGEST_MAX_IN_FLIGHT chunk tasks queued or running at
+# once; the coordinator checks for free slots every DIGEST_POLL_INTERVAL s
+DIGEST_TEMPLATE = os.environ.get("DIGEST_TEMPLATE", "daily_digest")
+DIGEST_QUEUE = os.environ.get("DIGEST_QUEUE", "low_priority")
+DIGEST_CHUNK_SIZE = int(os.environ.get("DIGEST_CHUNK_SIZE", "1000"))
+DIGEST_MAX_IN_FLIGHT = int(os.environ.get("DIGEST_MAX_IN_FLIGHT", "8"))
+DIGEST_POLL_INTERVAL = float(os.environ.get("DIGEST_POLL_INTERVAL", "5"))
+
+# Retention cleanup (nightly cleanup_old_logs): rows deleted per transaction,
+# seconds between batches, and a time budget so the run ends well within the
+# beat window (it resumes from a watermark the next night). RETENTION_ARCHIVE
+# copies rows before deleting them: "table" (NotificationLogArchive) or "file"
+# (gzipped NDJSON in RETENTION_ARCHIVE_DIR); empty deletes without a copy.
+RETENTION_BATCH_SIZE = int(os.environ.get("RETENTION_BATCH_SIZE", "5000"))
+RETENTION_BATCH_PAUSE = float(os.environ.get("RETENTION_BATCH_PAUSE", "0.1"))
+RETENTION_TIME_BUDGET = float(os.environ.get("RETENTION_TIME_BUDGET", "3000"))
+RETENTION_ARCHIVE = os.environ.get("RETENTION_ARCHIVE", "")
+RETENTION_ARCHIVE_DIR = os.environ.get("RETENTION_ARCHIVE_DIR", str(BASE_DIR / "archive"))
+
+# Largest page the notification list endpoint returns
+NOTIFICATION_LIST_MAX_LIMIT = int(os.environ.get("NOTIFICATION_LIST_MAX_LIMIT", "200"))
+
+# Rows fetched per round trip of the export server-side cursor
+NOTIFICATION_EXPORT_CHUNK_SIZE = int(os.environ.get("NOTIFICATION_EXPORT_CHUNK_SIZE", "2000"))
+
+# Rate limit tiers for the send endpoint, all checked and charged together in
+# one Redis call. Keys are formatted with user_id, channel, template, tenant
+# and provider; a tier is skipped when the request lacks a value it needs
+# (e.g. no tenant_id). Algorithms: fixed_window, sliding_log, gcra.
+RATE_LIMITS = [
+    {
+        "name": "user_channel",
+        "key": "{user_id}:{channel}",
+        "max_requests": int(os.environ.get("RATE_LIMIT_USER_CHANNEL", "10")),
+        "window": 60,
+        "algorithm": "fixed_window",
+    },
+    {
+        "name": "template",
+        "key": "{template}",
+        "max_requests": int(os.environ.get("RATE_LIMIT_TEMPLATE", "6000")),
+        "window": 60,
+        "algorithm": "gcra",
+    },
+    {
+        "name": "tenant",
+        "key": "{tenant}",
+        "max_requests": int(os.environ.get("RATE_LIMIT_TENANT", "20000")),
+        "window": 60,
+        "algorithm": "gcra",
+    },
+    {
+        "name": "provider",
+        "key": "{provider}",
+        "max_requests": int(os.environ.get("RATE_LIMIT_PROVIDER", "60000")),
+        "window": 60,
+        "algorithm": "gcra",
+    },
+]
+
+# Redis used by the rate limiter. Point it at a separate instance to keep rate
+# limit traffic off the Celery broker.
+RATE_LIMIT_REDIS_URL = os.environ.get("RATE_LIMIT_REDIS_URL", CELERY_BROKER_URL)
+RATE_LIMIT_REDIS_MAX_CONNECTIONS = int(
+    os.environ.get("RATE_LIMIT_REDIS_MAX_CONNECTIONS", "20")
+)
+# Seconds; applies to connecting, every command and waiting for a pooled connection
+RATE_LIMIT_REDIS_TIMEOUT = float(os.environ.get("RATE_LIMIT_REDIS_TIMEOUT", "0.25"))
+RATE_LIMIT_REDIS_HEALTH_CHECK_INTERVAL = int(
+    os.environ.get("RATE_LIMIT_REDIS_HEALTH_CHECK_INTERVAL", "30")
+)
+# While that Redis is unreachable each process enforces 1/N of every limit
+# locally and retries Redis every RATE_LIMIT_FALLBACK_RETRY_INTERVAL seconds.
+RATE_LIMIT_LOCAL_PROCESSES = int(os.environ.get("RATE_LIMIT_LOCAL_PROCESSES", "4"))
+RATE_LIMIT_FALLBACK_RETRY_INTERVAL = float(
+    os.environ.get("RATE_LIMIT_FALLBACK_RETRY_INTERVAL", "5")
+)
+
+# Redis for disposable data: idempotency reservations, template cache
+# versions and live counters. Short timeouts; callers fail open.
+CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL", RATE_LIMIT_REDIS_URL)
+CACHE_REDIS_TIMEOUT = float(os.environ.get("CACHE_REDIS_TIMEOUT", "0.25"))
+# Redis for job progress: retention and rollup watermarks, the daily digest's
+# lease and checkpoint. Keep it durable (persistence on, no eviction).
+STATE_REDIS_URL = os.environ.get("STATE_REDIS_URL", CELERY_BROKER_URL)
+
+# Provider delivering each channel (scope of the "provider" rate limit tier)
+CHANNEL_PROVIDERS = {"email": "smtp", "sms": "twilio", "push": "fcm"}
+
+# Idempotency keys are reserved in the rate limiter's Redis so duplicates are
+# answered without touching the database. A reservation expires after
+# IDEMPOTENCY_RESERVATION_TTL seconds if its request dies; accepted keys are
+# remembered for IDEMPOTENCY_TTL seconds. The database unique constraint
+# remains the source of truth.
+IDEMPOTENCY_TTL = int(os.environ.get("IDEMPOTENCY_TTL", str(24 * 60 * 60)))
+IDEMPOTENCY_RESERVATION_TTL = int(os.environ.get("IDEMPOTENCY_RESERVATION_TTL", "30"))
+
+# Seconds between checks of the shared template cache version in Redis
+TEMPLATE_CACHE_CHECK_INTERVAL = float(
+    os.environ.get("TEMPLATE_CACHE_CHECK_INTERVAL", "1.0")
+)
 
 LOGGING = {
     "version": 1,
@@ -23,6 +23,11 @@ urlpatterns = [
     path("api/notifications/", include("notifications.urls")),
 ]
 
+if settings.METRICS_ENDPOINT_ENABLED:
+    from notifications.views import metrics_view
+
+    urlpatterns += [path("metrics", metrics_view, name="metrics")]
+
 # Conditionally add API documentation URLs
 if settings.ENABLE_DOCS:
     from drf_spectacular.views import (